@@ -0,0 +1,419 @@
+import argparse
+import collections
+import http.server
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from process_store import NUMERIC_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+# Low OEE, high downtime, OEE falling fast, OEE and downtime far off their recent
+# average, and stations stopped for a quarter of an hour
+DEFAULT_RULES = "oee<40,downtime>50,rate:oee<-10,zscore:oee<-3,zscore:downtime>3,stopped>15"
+RULE = re.compile(r"^(?:(rate|zscore):)?([a-z_]+)\s*([<>])\s*(-?\d+(?:\.\d+)?)$")
+# Cleared alerts kept for the panel and the published file
+MAX_ALERTS = 200
+# File the alerts are published to in the shared state directory
+ALERTS_FILE = "alerts.json"
+# Weight of the newest value in the moving average and variance of z-score rules, and
+# the values seen before they fire
+EWMA_ALPHA = 0.1
+MIN_SAMPLES = 20
+# Smallest standard deviation a z-score is taken against, in the metric's unit, so a
+# flat series does not alert on rounding noise
+MIN_STD = 1.0
+# Alerts waiting for the webhook beyond this many are dropped
+WEBHOOK_QUEUE = 1000
+
+
+def metric_label(metric):
+    return "OEE" if metric == "oee" else metric.replace("_", " ").title()
+
+
+class ThresholdRule:
+    kind = "threshold"
+    severity = "danger"
+
+    def __init__(self, metric, op, limit):
+        self.metric = metric
+        self.op = op
+        self.limit = limit
+        self.name = f"{metric}{op}{limit:g}"
+
+    def reset(self, n):
+        pass
+
+    # Mask of firing stations and the value shown in their alerts
+    def evaluate(self, timestamp, store):
+        values = store.values(self.metric, fill=np.nan).astype(np.float64)
+        firing = values < self.limit if self.op == "<" else values > self.limit
+        return firing, values
+
+    def describe(self, step, value):
+        return f"{metric_label(self.metric)} {value:.1f} {'below' if self.op == '<' else 'above'} {self.limit:g}"
+
+
+class RateRule:
+    # Change of a metric per minute between two evaluations
+    kind = "rate"
+    severity = "warning"
+
+    def __init__(self, metric, op, limit):
+        self.metric = metric
+        self.op = op
+        self.limit = limit
+        self.name = f"rate:{metric}{op}{limit:g}"
+
+    def reset(self, n):
+        self._previous = np.full(n, np.nan)
+        self._previous_time = None
+
+    def evaluate(self, timestamp, store):
+        values = store.values(self.metric, fill=np.nan).astype(np.float64)
+        if self._previous_time is None or timestamp <= self._previous_time:
+            rates = np.full(len(values), np.nan)
+        else:
+            rates = (values - self._previous) / (timestamp - self._previous_time) * 60
+        self._previous, self._previous_time = values, timestamp
+        firing = rates < self.limit if self.op == "<" else rates > self.limit
+        return firing, rates
+
+    def describe(self, step, value):
+        return f"{metric_label(self.metric)} {'falling' if value < 0 else 'rising'} {abs(value):.1f} per minute"
+
+
+class ZScoreRule:
+    # Distance of a metric from its exponentially weighted moving average, in standard
+    # deviations of the same weighting
+    kind = "zscore"
+    severity = "warning"
+
+    def __init__(self, metric, op, limit):
+        self.metric = metric
+        self.op = op
+        self.limit = limit
+        self.name = f"zscore:{metric}{op}{limit:g}"
+
+    def reset(self, n):
+        self._mean = np.full(n, np.nan)
+        self._variance = np.zeros(n)
+        self._count = np.zeros(n, dtype=np.int64)
+
+    def evaluate(self, timestamp, store):
+        values = store.values(self.metric, fill=np.nan).astype(np.float64)
+        present = np.isfinite(values)
+        first = present & np.isnan(self._mean)
+        self._mean[first] = values[first]
+
+        difference = np.where(present, values - self._mean, 0)
+        scores = difference / np.maximum(np.sqrt(self._variance), MIN_STD)
+        scores[~present | (self._count < MIN_SAMPLES)] = np.nan
+
+        # Welford-style update of the weighted mean and variance, after scoring
+        increment = EWMA_ALPHA * difference
+        self._mean += increment
+        self._variance = np.where(present, (1 - EWMA_ALPHA) * (self._variance + difference * increment), self._variance)
+        self._count += present
+
+        firing = scores < self.limit if self.op == "<" else scores > self.limit
+        return firing, scores
+
+    def describe(self, step, value):
+        return f"{metric_label(self.metric)} {abs(value):.1f} standard deviations {'below' if value < 0 else 'above'} its average"
+
+
+class StoppedRule:
+    kind = "stopped"
+    severity = "danger"
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.name = f"stopped>{minutes:g}"
+
+    def reset(self, n):
+        # Time each station was first seen stopped, NaN while running
+        self._since = np.full(n, np.nan)
+
+    def evaluate(self, timestamp, store):
+        stopped = store.column("status") != "Running"
+        self._since = np.where(stopped, np.where(np.isnan(self._since), timestamp, self._since), np.nan)
+        minutes = (timestamp - self._since) / 60
+        return stopped & (minutes >= self.minutes), minutes
+
+    def describe(self, step, value):
+        return f"Stopped for {value:.0f} min"
+
+
+# Rules from a spec such as DEFAULT_RULES: "<metric><op><limit>" thresholds,
+# "rate:<metric><op><per minute>", "zscore:<metric><op><deviations>" and "stopped><minutes>"
+def parse_rules(spec):
+    rules = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        match = RULE.match(entry)
+        if not match:
+            raise ValueError(f"Invalid alert rule {entry!r}")
+        kind, metric, op, limit = match[1], match[2], match[3], float(match[4])
+        if metric == "stopped" and kind is None and op == ">":
+            rules.append(StoppedRule(limit))
+        elif metric not in NUMERIC_COLUMNS:
+            raise ValueError(f"Unknown metric {metric!r} in alert rule {entry!r}")
+        else:
+            rules.append({None: ThresholdRule, "rate": RateRule, "zscore": ZScoreRule}[kind](metric, op, limit))
+    return rules
+
+
+class AlertEngine:
+    # Evaluates every rule over all stations of a store with array operations. An alert
+    # is raised when a rule starts firing for a station and cleared when it stops, so a
+    # condition lasting many evaluations is one alert; a rule and station that cleared
+    # less than `cooldown` seconds ago are not raised again.
+
+    def __init__(self, rules, cooldown=300):
+        self.rules = rules
+        self.cooldown = cooldown
+        self.cleared = collections.deque(maxlen=MAX_ALERTS)
+        self.version = 0
+        # Open alerts as {rule name: {step: alert}}, and as a mask over the stations
+        self._open = {rule.name: {} for rule in rules}
+        self._open_rows = {}
+        self._cleared_at = {}
+        self._next_id = 1
+        self._steps = None
+        self._lock = threading.Lock()
+
+    # Continue from alerts published earlier, e.g. by a worker that exited. Open alerts of
+    # rules no longer configured are cleared.
+    def restore(self, published):
+        with self._lock:
+            for alert in reversed(published.get("alerts", [])):
+                self._next_id = max(self._next_id, alert["id"] + 1)
+                if alert["cleared"] is None and alert["rule"] in self._open:
+                    self._open[alert["rule"]][alert["step"]] = alert
+                    continue
+                if alert["cleared"] is None:
+                    alert["cleared"] = time.time()
+                self.cleared.appendleft(alert)
+            self.version = published.get("version", 0)
+
+    # Evaluate the rules on `store` at `timestamp`. Returns the events this caused, raised
+    # and cleared alerts, for the sinks.
+    def evaluate(self, timestamp, store):
+        steps = store.column("step")
+        with self._lock:
+            events = []
+            if self._steps is None or (steps is not self._steps and not np.array_equal(steps, self._steps)):
+                events += self._reindex(steps, timestamp)
+            self._steps = steps
+
+            for rule in self.rules:
+                firing, values = rule.evaluate(timestamp, store)
+                is_open = self._open_rows[rule.name]
+                for row in np.flatnonzero(is_open & ~firing).tolist():
+                    events.append(self._clear(rule.name, steps[row], timestamp))
+                for row in np.flatnonzero(firing & ~is_open).tolist():
+                    if timestamp - self._cleared_at.get((rule.name, steps[row]), -np.inf) >= self.cooldown:
+                        events.append(self._raise(rule, steps[row], float(values[row]), timestamp))
+                        is_open[row] = True
+                is_open &= firing
+
+            if events:
+                self.version += 1
+            return events
+
+    # Start the rules over for a new set of stations, clearing the open alerts of stations
+    # that are gone
+    def _reindex(self, steps, timestamp):
+        rows = {step: row for row, step in enumerate(steps.tolist())}
+        events = []
+        for rule in self.rules:
+            rule.reset(len(steps))
+            is_open = np.zeros(len(steps), dtype=bool)
+            for step in list(self._open[rule.name]):
+                if step in rows:
+                    is_open[rows[step]] = True
+                else:
+                    events.append(self._clear(rule.name, step, timestamp))
+            self._open_rows[rule.name] = is_open
+        return events
+
+    def _raise(self, rule, step, value, timestamp):
+        alert = {
+            "id": self._next_id,
+            "rule": rule.name,
+            "kind": rule.kind,
+            "severity": rule.severity,
+            "step": step,
+            "value": value,
+            "message": rule.describe(step, value),
+            "started": timestamp,
+            "cleared": None,
+        }
+        self._next_id += 1
+        self._open[rule.name][step] = alert
+        return {"event": "raised", **alert}
+
+    def _clear(self, name, step, timestamp):
+        alert = self._open[name].pop(step)
+        alert["cleared"] = timestamp
+        self._cleared_at[(name, step)] = timestamp
+        self.cleared.appendleft(alert)
+        return {"event": "cleared", **alert}
+
+    # Every open alert and the MAX_ALERTS last cleared ones, each newest first, as plain
+    # JSON data
+    def snapshot(self):
+        with self._lock:
+            open_alerts = sorted((alert for alerts in self._open.values() for alert in alerts.values()), key=lambda alert: -alert["id"])
+            return {"version": self.version, "alerts": [dict(alert) for alert in (*open_alerts, *self.cleared)]}
+
+
+def write_alerts(path, snapshot):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot, f)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+class AlertReader:
+    # Alerts published by the worker running the engine, re-read when the file changes
+
+    def __init__(self, path):
+        self.path = path
+        self.alerts = {"version": 0, "alerts": []}
+        self._file_key = None
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.alerts
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._file_key:
+            with open(self.path) as f:
+                self.alerts = json.load(f)
+            self._file_key = key
+        return self.alerts
+
+
+def log_events(events):
+    for event in events:
+        log = logger.warning if event["event"] == "raised" else logger.info
+        log("Alert %s on %s: %s", event["event"], event["step"], event["message"])
+
+
+class WebhookSink:
+    # Posts events as a JSON list to `url` from its own thread, so a slow or unreachable
+    # receiver never holds up the evaluation. Failed posts are logged and dropped.
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=WEBHOOK_QUEUE)
+        threading.Thread(target=self._run, name="oee-alert-webhook", daemon=True).start()
+
+    def __call__(self, events):
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                logger.warning("Alert webhook queue full, dropping %s alert on %s", event["event"], event["step"])
+
+    def _run(self):
+        while True:
+            events = [self._queue.get()]
+            while not self._queue.empty() and len(events) < 100:
+                events.append(self._queue.get_nowait())
+            request = urllib.request.Request(
+                self.url, data=json.dumps(events).encode(), headers={"Content-Type": "application/json"}, method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            except Exception:
+                logger.exception("Posting %d alerts to %s failed", len(events), self.url)
+
+
+class AlertWorker:
+    # Background thread evaluating the engine every `interval` seconds on the store returned
+    # by read_store(), handing events to every sink and, given a path, publishing the alerts
+    # there for other processes
+
+    def __init__(self, engine, read_store, interval=5.0, sinks=(), publish_path=None):
+        self.engine = engine
+        self.read_store = read_store
+        self.interval = interval
+        self.sinks = list(sinks)
+        self.publish_path = publish_path
+        self.evaluations = 0
+        self.evaluate_seconds = 0.0
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="oee-alerts", daemon=True)
+        thread.start()
+        return thread
+
+    def tick(self, timestamp=None):
+        started = time.perf_counter()
+        events = self.engine.evaluate(time.time() if timestamp is None else timestamp, self.read_store())
+        self.evaluate_seconds += time.perf_counter() - started
+        self.evaluations += 1
+        if events:
+            for sink in self.sinks:
+                sink(events)
+        if self.publish_path is not None and (events or self.evaluations == 1):
+            write_alerts(self.publish_path, self.engine.snapshot())
+        return events
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                # A failing data source or sink must not stop the alerting
+                logger.exception("Evaluating alerts failed")
+            time.sleep(self.interval)
+
+
+# Local stand-in for the webhook receiver, printing every event it is sent
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        events = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+        for event in events:
+            started = time.strftime("%H:%M:%S", time.localtime(event["started"]))
+            print(f"{event['event']:<8} {event['severity']:<8} {started} {event['step']}: {event['message']}", flush=True)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alerting tools for the dashboard.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stub_parser = commands.add_parser("stub", help="receive and print the alerts posted to OEE_ALERT_WEBHOOK")
+    stub_parser.add_argument("--host", default="127.0.0.1")
+    stub_parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == "stub":
+        server = http.server.ThreadingHTTPServer((args.host, args.port), _StubHandler)
+        print(f"Receiving alerts on http://{args.host}:{args.port}/ (OEE_ALERT_WEBHOOK=http://{args.host}:{args.port}/)", flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
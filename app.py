@@ -1,46 +1,538 @@
+import atexit
+import functools
+import os
+import threading
+import time
+
 import dash
-from dash import dcc, html
+import flask
+from dash import dcc, html, Patch
 import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State, ALL, MATCH
+from dash.exceptions import PreventUpdate
 import numpy as np
 
+from alerting import ALERTS_FILE, DEFAULT_RULES, AlertEngine, AlertReader, AlertWorker, WebhookSink, log_events, parse_rules
+from capacity_simulator import WIP_PER_STATION, Simulator, apply_scenario, chain_parameters, summarise as summarise_simulation
+from compression import enable_compression
+from data_export import FORMATS as EXPORT_FORMATS, enable_exports, export_downtime, export_history, export_lot_moves, export_processes, pyarrow
+from downtime_log import DowntimeLog, DowntimeRecorder, generate_synthetic, load_csv as load_downtime_csv
+from fast_json import figure_to_json, loads, typed_array
+from figure_cache import FigureCache, cached_builder
+from history_store import HistoryStore
+from ingest import IngestService, create_transport
+from instrumentation import instrument_callbacks, instrument_figure_cache, instrument_server, timed_builder
+from lot_tracker import LotRecorder, LotTracker, generate_synthetic as generate_synthetic_lots
+from material_analytics import MaterialLedger, MaterialRecorder, generate_synthetic as generate_synthetic_materials, material_metrics, parse_costs
+from oee_engine import percent
+from period_rollups import RollupEngine, current_period, generate_synthetic as generate_synthetic_rollups, using_period
+from process_store import COLUMNS, get_routes, load_store, rank_rows, summarise_by
+from shared_store import SharedStateUpdater, SharedStoreReader, default_directory
+from shift_calendar import DEFAULT_SHIFTS, ShiftCalendar
+from sites import Site, SiteDash, combine_summaries, current_site, enable_site_routing, parse_sites, using_site
+
 
 downtime_icon = html.I(className="bi bi-clock-fill me-2")
 failure_rate_icon = html.I(className="bi bi-exclamation-triangle-fill me-2")
 
 
-# Initialize the Dash app with the Bootstrap theme
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
-
-server = app.server
+# Opt-in request profiling: requests with an X-OEE-Profile header or a profile query
+# parameter write folded stacks (for flamegraph.pl or speedscope) to this directory
+PROFILE_DIR = os.environ.get("OEE_PROFILE_DIR")
+# Gzip level for responses, 0 disables compression
+COMPRESS_LEVEL = int(os.environ.get("OEE_COMPRESS_LEVEL", "6"))
+
+# Build tab contents on first selection instead of when the layout is created
+LAZY_TABS = os.environ.get("OEE_LAZY_TABS", "1") != "0"
+# Number of neighbouring tabs on each side that are built along with the selected one
+PREFETCH_TABS = int(os.environ.get("OEE_PREFETCH_TABS", "1"))
+# Machine event ingest feeding the dashboard instead of reloading the data source:
+# "simulator[:events per second]", "replay:<jsonl file>", "mqtt:<host>" or "off"
+INGEST = os.environ.get("OEE_INGEST", "off")
+# Shared state for several gunicorn workers: a directory (or "shm" for one on tmpfs) where
+# a single elected worker publishes the data source or ingest state for all others to map.
+# Preload only through gunicorn.conf.py, the election has to happen in the workers.
+SHARED_STATE = os.environ.get("OEE_SHARED_STATE")
+# Live mode: poll the data source and push changed values every N milliseconds (0 disables),
+# on by default when events are ingested or state is shared
+LIVE_REFRESH_MS = int(os.environ.get("OEE_LIVE_REFRESH_MS", "1000" if INGEST != "off" or SHARED_STATE else "0"))
+# Directory the trend history is memory-mapped from and saved back to on exit
+HISTORY_DIR = os.environ.get("OEE_HISTORY_DIR")
+# Minimum seconds between two history snapshots of the whole plant
+HISTORY_INTERVAL = int(os.environ.get("OEE_HISTORY_INTERVAL", "10"))
+# Downtime event log behind the Pareto and reliability panels: "auto" (recorded from the
+# ingest, or 30 synthetic days without it), "synthetic[:days]", "csv:<file>",
+# "dir:<directory>" (memory-mapped and saved back on exit) or "off"
+DOWNTIME_LOG = os.environ.get("OEE_DOWNTIME_LOG", "auto")
+# Downtime analysis ranges as a number of shifts or production days of the shift calendar
+# up to the current one
+DOWNTIME_RANGES = {"Shift": ("shift", 1), "Day": ("day", 1), "7d": ("day", 7), "30d": ("day", 30)}
+# Lot tracking along the routes (the stations of a line, in order) behind the lot flow view:
+# "auto" (recorded from the ingest, or 24 synthetic hours without it), "synthetic[:hours]" or "off"
+LOT_TRACKING = os.environ.get("OEE_LOT_TRACKING", "auto")
+# Shift calendar of the shift, day and week rollups, in local time: shifts as
+# "<name>=HH:MM-HH:MM,...", daily breaks as "HH:MM-HH:MM,..." and planned stops as
+# "YYYY-MM-DD HH:MM/YYYY-MM-DD HH:MM,...". Breaks and planned stops are not planned time.
+SHIFTS = os.environ.get("OEE_SHIFTS", DEFAULT_SHIFTS)
+SHIFT_BREAKS = os.environ.get("OEE_SHIFT_BREAKS", "")
+PLANNED_STOPS = os.environ.get("OEE_PLANNED_STOPS", "")
+# Per-process shift, day and week rollups behind the period selectors: "auto" (recorded on
+# every refresh, starting from 7 synthetic days without an ingest), "record",
+# "synthetic[:days]", "dir:<directory>" (recorded, loaded and saved back on exit) or "off"
+ROLLUPS = os.environ.get("OEE_ROLLUPS", "auto")
+# Periods offered by the period selectors as (level, periods before the current one),
+# LIVE_PERIOD shows the current values
+LIVE_PERIOD = "Now"
+PERIODS = {
+    "This shift": ("shift", 0),
+    "Last shift": ("shift", 1),
+    "Today": ("day", 0),
+    "Yesterday": ("day", 1),
+    "This week": ("week", 0),
+    "Last week": ("week", 1),
+}
+# Alerts evaluated on every process in the background, shown on the overview and posted to
+# the webhook: comma separated rules, "<metric><limit" or "<metric>><limit" thresholds,
+# "rate:<metric><op><points per minute>", "zscore:<metric><op><deviations>" from the metric's
+# moving average, and "stopped><minutes>", or "off"
+ALERT_RULES = os.environ.get("OEE_ALERT_RULES", DEFAULT_RULES)
+# Seconds between two evaluations of the rules
+ALERT_INTERVAL = float(os.environ.get("OEE_ALERT_INTERVAL", "5"))
+# Seconds before an alert that cleared can be raised again for the same process
+ALERT_COOLDOWN = float(os.environ.get("OEE_ALERT_COOLDOWN", "300"))
+# URL raised and cleared alerts are posted to as JSON, e.g. the local stub started with
+# `python alerting.py stub` at http://127.0.0.1:8765/
+ALERT_WEBHOOK = os.environ.get("OEE_ALERT_WEBHOOK", "")
+# Alerts listed in the overview panel, open ones first
+ALERT_PANEL_ROWS = 10
+# Streamed raw data exports running at once in each process; further ones are turned away
+# so downloads leave the other request threads to the dashboard (see gunicorn.conf.py)
+EXPORT_SLOTS = int(os.environ.get("OEE_EXPORT_SLOTS", "1"))
+# Material yield and scrap cost analysis on the overview: "auto" (recorded from the ingest,
+# or 7 synthetic days without it), "synthetic[:days]" or "off"
+MATERIALS = os.environ.get("OEE_MATERIALS", "auto")
+# Cost of a kg of wasted material, "<cost>" optionally followed by ",<step>=<cost>" overrides
+MATERIAL_COST = os.environ.get("OEE_MATERIAL_COST", "1")
+# Material analysis ranges in seconds, yield trend groupings (rollup levels of the shift
+# calendar) and the most bars of the scrap Pareto
+MATERIAL_RANGES = {"24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400}
+MATERIAL_TREND_GROUPS = {"Hour": None, "Shift": "shift", "Day": "day", "Week": "week"}
+MATERIAL_PARETO_BARS = 20
+# Seconds between rebuilds of the material analysis in live mode
+MATERIAL_REFRESH = 60
+# What-if tab simulating shifts of a route with one station changed, and the processes
+# its replications run in (the number of CPUs by default)
+SIMULATION = os.environ.get("OEE_SIMULATION", "1") != "0"
+SIMULATION_WORKERS = int(os.environ.get("OEE_SIMULATION_WORKERS", "0")) or None
+# Replications a simulation runs by default and at most
+SIMULATION_REPLICATIONS = 1000
+SIMULATION_MAX_REPLICATIONS = 10000
+# Trend chart ranges in seconds, and the most points a trend chart is drawn with
+TREND_RANGES = {"1h": 3600, "24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "1y": 365 * 86400}
+TREND_MAX_POINTS = 1000
+# Where built figures are cached: "memory", "disk:<dir>" shared by all workers on a host,
+# "redis://..." shared across hosts, or "off"
+FIGURE_CACHE = os.environ.get("OEE_FIGURE_CACHE", "memory")
+FIGURE_CACHE_MB = int(os.environ.get("OEE_FIGURE_CACHE_MB", "64"))
+# Serialise cached figures with the fast path (typed arrays, no deep copy, orjson when
+# installed) instead of Figure.to_json(); the JSON is the same
+FAST_JSON = os.environ.get("OEE_FAST_JSON", "1") != "0"
+# How KPI gauges are drawn: "figures" (one graph per gauge), "grid" (one multi-domain
+# figure per process and for the plant) or "html" (CSS gauges, no Plotly at all)
+GAUGE_MODE = os.environ.get("OEE_GAUGE_MODE", "figures")
+# Overview for large plants: "scalable" (paginated grid, hierarchy drill-down, top/bottom-N
+# charts and a process search instead of one tab per process), "classic", or "auto" which
+# switches to scalable above SCALABLE_OVERVIEW_THRESHOLD processes
+OVERVIEW_MODE = os.environ.get("OEE_OVERVIEW_MODE", "auto")
+SCALABLE_OVERVIEW_THRESHOLD = int(os.environ.get("OEE_SCALABLE_OVERVIEW_THRESHOLD", "48"))
+# Status cards per page of the scalable overview grid
+STATUS_GRID_PAGE_SIZE = 48
 
 # Helper function to determine badge color based on status
 def get_badge_color(status):
     return "success" if status == "Running" else "danger"
 
-# Sample Data
-processes = [
-    {"step": "Paste Grinding", "status": "Running", "lot": 20005, "units": 1043, "run_time": 1.3, "expected_time": 1.5, "downtime": 8, "failure_rate": 5, "availability": 86.67, "performance": 86.67, "quality":95, "oee":71.36},
-    {"step": "Machine 1", "status": "Running", "lot": 20002, "units": 205, "run_time": 20, "expected_time": 30, "downtime": 12, "failure_rate": None, "availability": 66.67, "performance": 66.67, "material_used": 32.4, "waste_material": 4.2, "quality":100, "oee":44.44},
-    {"step": "Machine 2", "status": "Running", "lot": 20004, "units": 102, "run_time": 74, "expected_time": 108, "downtime": 40, "failure_rate": None, "availability": 68.52, "performance": 68.52, "material_used": 42.5, "waste_material": 5.3, "quality":100, "oee":46.95},
-    {"step": "Machine 3", "status": "Stopped", "lot": None, "units": 733, "run_time": None, "expected_time": None, "downtime": 3, "failure_rate": None, "availability": 0, "performance": 0, "quality":97, "oee":0},
-    {"step": "Furnace", "status": "Running", "lot": 19999, "units": 1037, "run_time": 8, "expected_time": 10, "downtime": 4, "failure_rate": None, "availability": 80, "performance": 80, "quality":100, "oee":64},
-    {"step": "Wirecut", "status": "Running", "lot": 20000, "units": 1036, "run_time": 3, "expected_time": 4, "downtime": 15, "failure_rate": None, "availability": 75, "performance": 75, "quality":100, "oee":56.25},
-    {"step": "Machining", "status": "Stopped", "lot": None, "units": 1035, "run_time": None, "expected_time": None, "downtime": 20, "failure_rate": 4, "availability": 0, "performance": 0, "quality":96, "oee":0},
-    {"step": "Dimension Measurement", "status": "Running", "lot": 19998, "units": 1034, "run_time": 1, "expected_time": 3, "downtime": 30, "failure_rate": 4, "availability": 33.33, "performance": 33.33, "quality":96, "oee":10.67},
-    {"step": "Tensile Strength Measurement", "status": "Running", "lot": 19998, "units": 1034, "run_time": 0.5, "expected_time": 1, "downtime": 14, "failure_rate": 10, "availability": 50, "performance": 50, "quality":90, "oee":22.5},
-    {"step": "Packing", "status": "Running", "lot": 19997, "units": 1033, "run_time": 1, "expected_time": 1, "downtime": 70, "failure_rate": None, "availability": 100, "performance": 100, "quality":100, "oee":100},
-    {"step": "Shipping", "status": "Running", "lot": 19996, "units": 1032, "run_time": 1, "expected_time": 2, "downtime": 70, "failure_rate": None, "availability": 50, "performance": 50, "quality":100, "oee":25},
-]
-
+# Process data, loaded from the source named by OEE_DATA_SOURCE (defaults to the static sample)
+DATA_SOURCE = os.environ.get("OEE_DATA_SOURCE", "sample")
+# Plants served by one deployment: "<name>=<data source>,...", each under /site/<name>/ with
+# a roll-up of all of them on /. Empty serves the single plant of OEE_DATA_SOURCE on /.
+# Directory settings (history, shared state, downtime dir:) get a subdirectory per site and
+# a "{site}" in a downtime csv: path is replaced by the site name.
+SITES_SPEC = os.environ.get("OEE_SITES", "")
+MULTI_SITE = bool(SITES_SPEC)
+
+
+# Dash app of the request being handled, or the one this module serves outside requests
+# (start-up hooks, background threads, scripts importing the module)
+def get_app():
+    return flask.current_app.extensions["oee"] if flask.has_app_context() else app
+
+
+# Sites of the app as {name: Site}, loaded by load_sites
+def get_sites():
+    return get_app().sites
+
+
+# Site of the current request, the only one on single-plant deployments
+def get_site():
+    return current_site.get() or next(iter(get_sites().values()))
+
+
+# Per-site location of a directory setting
+def get_site_directory(path, site):
+    return os.path.join(path, site.name) if MULTI_SITE else path
+
+
+# Shifts, breaks and planned stops shared by the downtime logs and rollups of every site
+shift_calendar = ShiftCalendar.from_spec(SHIFTS, SHIFT_BREAKS, PLANNED_STOPS)
+
+
+def load_downtime_log(spec, site):
+    kind, _, argument = spec.partition(":")
+    machines = site.store.column("step").tolist()
+    if kind == "off":
+        return None
+    if kind == "auto":
+        return DowntimeLog(machines, calendar=shift_calendar) if INGEST != "off" else generate_synthetic(machines, calendar=shift_calendar)
+    if kind == "synthetic":
+        return generate_synthetic(machines, days=float(argument or 30), calendar=shift_calendar)
+    if kind == "csv":
+        return load_downtime_csv(argument.replace("{site}", site.name), machines, shift_calendar)
+    if kind == "dir":
+        directory = get_site_directory(argument, site)
+        if os.path.exists(os.path.join(directory, "index.json")):
+            log = DowntimeLog.load(directory, machines, shift_calendar)
+        else:
+            log = DowntimeLog(machines, calendar=shift_calendar)
+        site.saves.append(functools.partial(log.save, directory))
+        return log
+    raise ValueError(f"Unknown downtime log {spec!r}")
+
+
+# Downtime events per process step (appended to by the ingest when it runs) and lot moves
+# between the stations of each route. Both are built on first use or by load_deferred
+# rather than on import, synthetic ones take seconds for large plants.
+_deferred_lock = threading.Lock()
+
+
+def get_downtime_log(site=None):
+    site = site or get_site()
+    if site.downtime_log is None and DOWNTIME_LOG != "off":
+        with _deferred_lock:
+            if site.downtime_log is None:
+                site.downtime_log = load_downtime_log(DOWNTIME_LOG, site)
+    return site.downtime_log
+
+
+def load_lot_tracker(spec, site):
+    kind, _, argument = spec.partition(":")
+    if kind == "off":
+        return None
+    if kind == "auto":
+        return LotTracker(site.store) if INGEST != "off" else generate_synthetic_lots(site.store)
+    if kind == "synthetic":
+        return generate_synthetic_lots(site.store, hours=float(argument or 24))
+    raise ValueError(f"Unknown lot tracking {spec!r}")
+
+
+def get_lot_tracker(site=None):
+    site = site or get_site()
+    if site.lot_tracker is None and LOT_TRACKING != "off":
+        with _deferred_lock:
+            if site.lot_tracker is None:
+                site.lot_tracker = load_lot_tracker(LOT_TRACKING, site)
+    return site.lot_tracker
+
+
+def load_rollups(spec, site):
+    kind, _, argument = spec.partition(":")
+    if kind == "off":
+        return None
+    if kind == "auto":
+        return RollupEngine(shift_calendar) if INGEST != "off" else generate_synthetic_rollups(site.store, shift_calendar)
+    if kind == "record":
+        return RollupEngine(shift_calendar)
+    if kind == "synthetic":
+        return generate_synthetic_rollups(site.store, shift_calendar, days=float(argument or 7))
+    if kind == "dir":
+        directory = get_site_directory(argument, site)
+        if os.path.exists(os.path.join(directory, "index.json")):
+            rollups = RollupEngine.load(directory, shift_calendar)
+        else:
+            rollups = RollupEngine(shift_calendar)
+        site.saves.append(functools.partial(rollups.save, directory))
+        return rollups
+    raise ValueError(f"Unknown rollups {spec!r}")
+
+
+# Shift, day and week rollups, fed by refresh_store once built
+def get_rollups(site=None):
+    site = site or get_site()
+    if site.rollups is None and ROLLUPS != "off":
+        with _deferred_lock:
+            if site.rollups is None:
+                site.rollups = load_rollups(ROLLUPS, site)
+    return site.rollups
+
+
+def load_materials(spec, site):
+    kind, _, argument = spec.partition(":")
+    if kind == "off":
+        return None
+    costs = parse_costs(MATERIAL_COST, site.store.column("step").tolist())
+    if kind == "auto":
+        return MaterialLedger(site.store.column("step").tolist(), costs) if INGEST != "off" else generate_synthetic_materials(site.store, costs)
+    if kind == "synthetic":
+        return generate_synthetic_materials(site.store, costs, days=float(argument or 7))
+    raise ValueError(f"Unknown materials {spec!r}")
+
+
+# Material used, wasted and scrapped per station, hour and lot, behind the material analysis
+def get_materials(site=None):
+    site = site or get_site()
+    if site.materials is None and MATERIALS != "off":
+        with _deferred_lock:
+            if site.materials is None:
+                site.materials = load_materials(MATERIALS, site)
+    return site.materials
+
+
+def load_deferred(sites=None):
+    for site in (sites or get_sites()).values():
+        get_downtime_log(site)
+        get_lot_tracker(site)
+        get_rollups(site)
+        get_materials(site)
+
+
+# Stations, hierarchy and cycle times come from the data source, live state from the events
+def start_ingest(site):
+    if INGEST != "off":
+        site.ingest_service = IngestService(site.store, create_transport(INGEST))
+        downtime_log = get_downtime_log(site)
+        if downtime_log is not None:
+            site.ingest_service.listeners.append(DowntimeRecorder(downtime_log, site.ingest_service))
+        lot_tracker = get_lot_tracker(site)
+        if lot_tracker is not None:
+            site.ingest_service.listeners.append(LotRecorder(lot_tracker, site.ingest_service))
+        materials = get_materials(site)
+        if materials is not None:
+            site.ingest_service.listeners.append(MaterialRecorder(materials, site.ingest_service, site.store))
+        site.ingest_service.start_in_thread()
+
+
+def read_latest_store(site):
+    if site.ingest_service is not None:
+        return site.ingest_service.snapshot()
+    return load_store(site.source)
+
+
+# Store the alerts are evaluated on: the refreshed one in live mode, which also records
+# history and rollups while no page is open, and the loaded data otherwise
+def read_alert_store(site):
+    return refresh_store(site)[1] if LIVE_REFRESH_MS else site.store
+
+
+# Evaluate the alert rules on the site in a background thread. With shared state this runs
+# in the elected updater only, which publishes the alerts for every worker to read.
+def start_alerts(site):
+    if ALERT_RULES == "off":
+        return
+    engine = AlertEngine(parse_rules(ALERT_RULES), cooldown=ALERT_COOLDOWN)
+    publish_path = None
+    if site.alert_reader is not None:
+        publish_path = site.alert_reader.path
+        # Keep the alerts still open when a previous updater exited
+        engine.restore(site.alert_reader.current())
+    sinks = [log_events] + ([WebhookSink(ALERT_WEBHOOK)] if ALERT_WEBHOOK else [])
+    site.alert_worker = AlertWorker(engine, functools.partial(read_alert_store, site), ALERT_INTERVAL, sinks, publish_path)
+    site.alert_worker.start()
+
+
+# Work done by one process per site: by the elected updater when state is shared. That
+# process is the only one appending to the site's saved data, so it alone saves it on
+# exit rather than every worker writing the same directories.
+def start_updates(site):
+    start_ingest(site)
+    start_alerts(site)
+    atexit.register(save_site, site)
+
+
+# Write the site's data kept across restarts, including any loaded after the updates started
+def save_site(site):
+    for save in site.saves:
+        save()
+
+
+# Recent alerts of the site as {"version", "alerts"}, None with alerting off
+def get_alerts(site=None):
+    site = site or get_site()
+    if site.alert_reader is not None:
+        return site.alert_reader.current()
+    if site.alert_worker is not None:
+        return site.alert_worker.engine.snapshot()
+    return None
+
+
+# Data of a site: its store from the data source, the trend history per process step
+# (fed with a snapshot of the store on every refresh) and, with shared state, the reader
+# of what the elected updater publishes and the site's candidate for the election. Only
+# the elected updater reads the source, runs the ingest or saves the history from then
+# on; each site has its own directory and election.
+def load_site(site):
+    site.store = site.previous_store = load_store(site.source)
+    site.scalable = OVERVIEW_MODE == "scalable" or (
+        OVERVIEW_MODE == "auto" and len(site.store) > SCALABLE_OVERVIEW_THRESHOLD
+    )
 
+    history_dir = get_site_directory(HISTORY_DIR, site) if HISTORY_DIR else None
+    if history_dir and os.path.exists(os.path.join(history_dir, "index.json")):
+        site.history = HistoryStore.load(history_dir, snapshot_interval=HISTORY_INTERVAL)
+    else:
+        site.history = HistoryStore(snapshot_interval=HISTORY_INTERVAL)
+    site.history.append_snapshot(time.time(), site.store)
+    if history_dir:
+        site.saves.append(functools.partial(site.history.save, history_dir))
+
+    if SHARED_STATE:
+        shared_directory = get_site_directory(default_directory() if SHARED_STATE == "shm" else SHARED_STATE, site)
+        site.shared_reader = SharedStoreReader(shared_directory)
+        site.shared_updater = SharedStateUpdater(
+            shared_directory,
+            functools.partial(read_latest_store, site),
+            interval=max(LIVE_REFRESH_MS, 100) / 1000,
+            on_elected=functools.partial(start_updates, site),
+        )
+        if ALERT_RULES != "off":
+            site.alert_reader = AlertReader(os.path.join(shared_directory, ALERTS_FILE))
+
+
+_startup_lock = threading.RLock()
+
+
+# Load the sites of the app not loaded yet. Nothing is loaded on import: this runs in the
+# start-up hooks below, so importing the module (or a gunicorn master that preloads it)
+# only costs the imports.
+def load_sites(dash_app=None):
+    dash_app = dash_app or get_app()
+    with _startup_lock:
+        for site in dash_app.sites.values():
+            if site.store is None:
+                load_site(site)
+
+
+# Per-process start: the sites' data, the shared state election (or the ingest and alerts
+# when state is not shared) and the deferred data, built in the background so the worker
+# serves right away. Run once per process by gunicorn's post_worker_init hook, or on the
+# first request under servers without it.
+def start_worker(dash_app=None):
+    dash_app = dash_app or get_app()
+    with _startup_lock:
+        if dash_app.started:
+            return
+        load_sites(dash_app)
+        for site in dash_app.sites.values():
+            if site.shared_updater is not None:
+                site.shared_updater.try_start()
+                published = site.shared_reader.current()
+                if published is not None:
+                    site.store = site.previous_store = published
+            else:
+                start_updates(site)
+        threading.Thread(target=load_deferred, args=(dash_app.sites,), name="oee-deferred", daemon=True).start()
+        dash_app.started = True
+
+# Raw data behind the charts of the request's site, served as /export/<dataset>.<csv|parquet>
+# with step, lot, start and end filters (see data_export.py)
+def get_export_datasets():
+    site = get_site()
+    datasets = {
+        "processes": functools.partial(export_processes, site.store),
+        "history": functools.partial(export_history, site.history),
+    }
+    downtime_log = get_downtime_log(site)
+    if downtime_log is not None:
+        datasets["downtime"] = functools.partial(export_downtime, downtime_log)
+    lot_tracker = get_lot_tracker(site)
+    if lot_tracker is not None:
+        datasets["lots"] = functools.partial(export_lot_moves, lot_tracker)
+    return datasets
+
+
+# Serialised figures keyed on (builder, process step, data version), one cache per app.
+# Fingerprints are digests of the data, so sites and periods only share an entry when
+# their data is the same.
+def create_figure_cache():
+    figure_cache = FigureCache.from_spec(FIGURE_CACHE, max_bytes=FIGURE_CACHE_MB * 1024 * 1024)
+    instrument_figure_cache(figure_cache)
+    if figure_cache is not None and FAST_JSON:
+        figure_cache.serialise = figure_to_json
+        figure_cache.loads = loads
+    return figure_cache
+
+
+# Decorator for figure builders: build time is recorded for every call that reaches
+# the builder, i.e. every cache miss. Figures are cached in the cache of the app they
+# are built for.
+def cached_figure(builder):
+    timed = timed_builder(builder)
+    cached = {}
+
+    @functools.wraps(builder)
+    def wrapper(*args):
+        figure_cache = get_app().figure_cache
+        if figure_cache not in cached:
+            cached[figure_cache] = cached_builder(figure_cache, version=lambda: get_store().fingerprint())(timed)
+        return cached[figure_cache](*args)
+
+    return wrapper
+
+
+# Reload the site's data source (or take the ingest state) at most once per refresh interval,
+# shared by every session. Returns the store before the last change together with the current one.
+def refresh_store(site=None):
+    site = site or get_site()
+    with site.refresh_lock:
+        now = time.monotonic()
+        if now - site.last_refresh >= LIVE_REFRESH_MS / 1000:
+            site.last_refresh = now
+            if site.shared_reader is not None:
+                # Take over publishing if the updater's worker exited
+                site.shared_updater.try_start()
+                latest = site.shared_reader.current()
+                # Versions come from the updater and agree across workers
+                if latest is not None and latest.version != site.store.version:
+                    site.previous_store, site.store = site.store, latest
+            else:
+                latest = read_latest_store(site)
+                if latest.changed_columns(site.store):
+                    latest.version = site.store.version + 1
+                    site.previous_store, site.store = site.store, latest
+            site.history.append_snapshot(time.time(), site.store)
+            if site.rollups is not None:
+                site.rollups.add(time.time(), site.store)
+        return site.previous_store, site.store
+
+
+# Store the charts are built from: the site's current data, or the rollups of the period
+# selected for the request (see using_period)
+def get_store():
+    site = get_site()
+    period = current_period.get()
+    if period is None or get_rollups(site) is None:
+        return site.store
+    return site.rollups.period_store(site.store, *period)
+
+
+@cached_figure
 def create_oee_summary_chart():
+    store = get_store()
     fig = go.Figure()
 
     fig.add_trace(go.Bar(
-        x=[process["step"] for process in processes],
-        y=[process["oee"] for process in processes],
+        x=store.column("step"),
+        y=store.values("oee"),
         marker=dict(color="#008080"),
     ))
 
@@ -54,22 +546,24 @@ def create_oee_summary_chart():
     return fig
 
 
+@cached_figure
 def create_spider_chart():
+    store = get_store()
     # Data preparation
     categories = ['Availability', 'Performance', 'Quality']
     fig = go.Figure()
 
-    for process in processes:
-        values = [process['availability'], process['performance'], process['quality']]
-        
+    kpis = np.column_stack([store.values('availability'), store.values('performance'), store.values('quality')])
+
+    for step, values in zip(store.column('step'), kpis.tolist()):
         # Create hover text for each point
-        hover_text = [f"{category}: {value}%" for category, value in zip(categories, values)]
+        hover_text = [f"{category}: {value:g}%" for category, value in zip(categories, values)]
         
         fig.add_trace(go.Scatterpolar(
             r=values + [values[0]],  # Complete the loop
             theta=categories + [categories[0]],  # Complete the loop
             fill='toself',
-            name=process['step'],
+            name=step,
             hoverinfo='text',
             text=[', '.join(hover_text)] * len(values)  # Repeat hover text for each point
         ))
@@ -86,10 +580,115 @@ def create_spider_chart():
 
     return fig
 
+# Columns the clientside overview callbacks filter, sort and convert, sent once with the
+# overview and again only when they change
+def get_overview_data():
+    store = get_store()
+    data = {"step": store.column("step").tolist(), "status": store.column("status").tolist()}
+    for name in ("oee", "units", "run_time"):
+        data[name] = np.where(store.missing(name), None, store.values(name)).tolist()
+    return data
+
+
+# Which shift, day or week a period selector value shows, empty for the live values
+def get_period_label(value):
+    if value not in PERIODS or get_rollups() is None:
+        return ""
+    level, back = PERIODS[value]
+    rollups = get_rollups()
+    key = rollups.period_key(level, back)
+    label = shift_calendar.period_label(level, key)
+    return label if rollups.has_period(level, key) else f"{label} (nothing recorded)"
+
+
+# Selector between the live values and the periods of the rollups, read from the
+# precomputed sums without touching older data. Not shown when no rollups are kept.
+def create_period_selector(selector_id, label_id):
+    if ROLLUPS == "off":
+        return []
+    return [
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.RadioItems(
+                        id=selector_id,
+                        options=[LIVE_PERIOD, *PERIODS],
+                        value=LIVE_PERIOD,
+                        inline=True,
+                        inputStyle={"margin-left": "12px", "margin-right": "4px"},
+                    ),
+                    width="auto",
+                ),
+                dbc.Col(html.Div(id=label_id, className="text-muted"), width="auto"),
+            ],
+            justify="center",
+            className="mb-3",
+        )
+    ]
+
+
+# View controls of the overview charts, applied in the browser by applyOverviewView
+# and showSpiderTraces in assets/clientside.js
+def create_overview_controls():
+    store = get_store()
+    return dbc.Row(
+        [
+            dbc.Col([
+                html.Label("Status"),
+                dcc.RadioItems(
+                    id="overview-status-filter",
+                    options=[{"label": "All", "value": "all"}, {"label": "Running", "value": "Running"}, {"label": "Stopped", "value": "Stopped"}],
+                    value="all",
+                    inline=True,
+                    inputStyle={"margin-left": "12px", "margin-right": "4px"},
+                ),
+            ], width=3),
+            dbc.Col([
+                html.Label("Sort"),
+                dcc.Dropdown(
+                    id="overview-sort",
+                    options=[
+                        {"label": "Process order", "value": "order"},
+                        {"label": "Highest OEE", "value": "oee-desc"},
+                        {"label": "Lowest OEE", "value": "oee-asc"},
+                        {"label": "Name", "value": "step"},
+                    ],
+                    value="order",
+                    clearable=False,
+                ),
+            ], width=2),
+            dbc.Col([
+                html.Label("Units"),
+                dcc.RadioItems(
+                    id="overview-units",
+                    options=[{"label": "Total", "value": "total"}, {"label": "Per hour", "value": "per-hour"}],
+                    value="total",
+                    inline=True,
+                    inputStyle={"margin-left": "12px", "margin-right": "4px"},
+                ),
+            ], width=2),
+            dbc.Col([
+                html.Label("OEE target (%)"),
+                dcc.Input(id="overview-oee-target", type="number", min=0, max=100, placeholder="None", className="form-control"),
+            ], width=2),
+            dbc.Col([
+                html.Label("Spider chart"),
+                dcc.Dropdown(id="overview-spider-processes", options=store.column("step").tolist(), multi=True, placeholder="All processes"),
+            ], width=3),
+        ],
+        className="mb-4"
+    )
+
+
 # Function to create the main overview dashboard layout
 def create_overview_layout():
+    store = get_store()
     return dbc.Container([
       html.H3("Operations Status", className="my-4 text-center"),
+      # Data version these charts were built from, used by live mode to send only changes
+      dcc.Store(id="overview-data-version", data=store.version),
+      dcc.Store(id="overview-data", data=get_overview_data()),
+      *create_alert_panel(),
       # Row of process headings and badges
       dbc.Row(
         [
@@ -98,18 +697,21 @@ def create_overview_layout():
                     dbc.CardBody(
                         [
                             html.H5(process['step'], className="text-center mb-1", style={"whiteSpace": "normal", "wordWrap": "break-word"}),  # Process as heading
-                            dbc.Badge(process['status'], color=get_badge_color(process['status']), className="d-block mx-auto mt-2")
+                            dbc.Badge(process['status'], id={"type": "status-badge", "index": index}, color=get_badge_color(process['status']), className="d-block mx-auto mt-2")
                         ]
                     ),
                     className="mb-3"
                 ),
                 width=3  # Adjust width as needed
             )
-            for process in processes
+            for index, process in enumerate(store.records())
         ],
         style={"paddingTop": "20px"},
         className="mb-4"
     ),
+        *create_period_selector("overview-period", "overview-period-label"),
+        *create_plant_kpi_section(),
+        create_overview_controls(),
         dbc.Row(
                 [
                     dbc.Col(dcc.Graph(id='oee-summary-chart', figure=create_oee_summary_chart()), width=6),
@@ -132,6 +734,9 @@ def create_overview_layout():
             ],
             className="mb-4"
         ),
+        *create_lot_flow_section(),
+        *create_material_section(),
+        create_export_links(),
     ], fluid=True)
 
 
@@ -141,6 +746,7 @@ def calculate_material_percentages(material_used, waste_material):
     waste_material_percentage = 100 - material_used_percentage  # The rest is waste material
     return material_used_percentage, waste_material_percentage
 
+@cached_figure
 def create_material_pie_chart(material_used, waste_material):
     # Calculate percentages
     material_used_percentage, waste_material_percentage = calculate_material_percentages(material_used, waste_material)
@@ -149,8 +755,8 @@ def create_material_pie_chart(material_used, waste_material):
     values = [material_used_percentage, waste_material_percentage]
     labels = ['Material Used', 'Waste Material']
     hover_text = [
-        f"Material Used: {material_used} KG ({material_used_percentage:.2f}%)",
-        f"Waste Material: {waste_material} KG ({waste_material_percentage:.2f}%)"
+        f"Material Used: {material_used:g} KG ({material_used_percentage:.2f}%)",
+        f"Waste Material: {waste_material:g} KG ({waste_material_percentage:.2f}%)"
     ]
 
     fig = go.Figure(data=[go.Pie(
@@ -171,6 +777,7 @@ def create_material_pie_chart(material_used, waste_material):
 
     return fig
 
+@cached_figure
 def create_runtime_pie_chart(run_time, expected_time):
     # Handle case where either run_time or expected_time is None
     if run_time is None or expected_time is None:
@@ -185,8 +792,8 @@ def create_runtime_pie_chart(run_time, expected_time):
     values = [run_time_percentage, remaining_time_percentage]
     labels = ['Run Time', 'Remaining Time']
     hover_text = [
-        f"Run Time: {run_time} hours ({run_time_percentage:.2f}%)",
-        f"Remaining Time: {expected_time - run_time} hours ({remaining_time_percentage:.2f}%)"
+        f"Run Time: {run_time:g} hours ({run_time_percentage:.2f}%)",
+        f"Remaining Time: {expected_time - run_time:g} hours ({remaining_time_percentage:.2f}%)"
     ]
 
     fig = go.Figure(data=[go.Pie(
@@ -208,17 +815,45 @@ def create_runtime_pie_chart(run_time, expected_time):
     return fig
 
 
+# Gauge titles and the store columns they show
+METRIC_COLUMNS = {
+    "Availability": "availability",
+    "Performance": "performance",
+    "Quality": "quality",
+    "OEE": "oee",
+}
+
+
+GAUGE_COLORS = ["#ff0000", "#ff8000", "#ffff00", "#80ff00"]  # Red to green gradient
+
+
+# Indicator gauge settings shared by the single gauges and the gauge grids
+def get_indicator_gauge(shape="angular"):
+    return {
+        'shape': shape,
+        'axis': {'range': [0, 100], 'tickwidth': 1, 'tickcolor': "darkblue"},
+        'bar': {'color': "darkblue"},
+        'bgcolor': "white",
+        'borderwidth': 2,
+        'bordercolor': "gray",
+        'steps': [
+            {'range': [0, 25], 'color': GAUGE_COLORS[0]},  # Red
+            {'range': [25, 50], 'color': GAUGE_COLORS[1]},  # Orange
+            {'range': [50, 75], 'color': GAUGE_COLORS[2]},  # Yellow
+            {'range': [75, 100], 'color': GAUGE_COLORS[3]}  # Green
+        ],
+        'threshold': {
+            'line': {'color': "red", 'width': 4},
+            'thickness': 0.75,
+            'value': 100}}
+
+
+@cached_figure
 def create_metric_gauges(process):
     plot_bgcolor = "#def"
-    gauge_colors = ["#ff0000", "#ff8000", "#ffff00", "#80ff00"]  # Red to green gradient
 
-    metrics = {
-        "Availability": process['availability'],
-        "Performance": process['performance'],
-        "Quality": process['quality'],
-        "OEE": process['oee'],
-    }
-    
+    metrics = {metric: process[column] for metric, column in METRIC_COLUMNS.items()}
+
     gauges = []
     
     for metric, value in metrics.items():
@@ -228,22 +863,7 @@ def create_metric_gauges(process):
             number={'suffix': '%'},
             domain = {'x': [0, 1], 'y': [0, 1]},
             title = {'text': metric, 'font': {'size': 24}},
-            gauge = {
-                'axis': {'range': [0, 100], 'tickwidth': 1, 'tickcolor': "darkblue"},
-                'bar': {'color': "darkblue"},
-                'bgcolor': "white",
-                'borderwidth': 2,
-                'bordercolor': "gray",
-                'steps': [
-                    {'range': [0, 25], 'color': gauge_colors[0]},  # Red
-                    {'range': [25, 50], 'color': gauge_colors[1]},  # Orange
-                    {'range': [50, 75], 'color': gauge_colors[2]},  # Yellow
-                    {'range': [75, 100], 'color': gauge_colors[3]}  # Green
-                ],
-                'threshold': {
-                    'line': {'color': "red", 'width': 4},
-                    'thickness': 0.75,
-                    'value': 100}}))
+            gauge = get_indicator_gauge()))
 
         gauge.update_layout(
             height=240,
@@ -256,6 +876,175 @@ def create_metric_gauges(process):
     return gauges
 
 
+# Status line shown above the KPI grid of a single process
+def get_kpi_grid_title(process):
+    color = '#2bad4e' if process['status'] == 'Running' else '#f25829'
+    return f"Status: <b style='color:{color}'>{process['status']}</b> | Current Lot: {process['lot']}"
+
+
+# Function to create a single figure with the KPI indicators of several processes,
+# one row per process and one column per metric. A single process gets dial gauges,
+# several get compact bullet gauges.
+@cached_figure
+def create_kpi_indicator_grid(records):
+    single = len(records) == 1
+    fig = go.Figure()
+
+    for row, process in enumerate(records):
+        for column, (metric, name) in enumerate(METRIC_COLUMNS.items()):
+            fig.add_trace(go.Indicator(
+                mode="gauge+number",
+                value=process[name],
+                number={'suffix': '%', 'font': {'size': 20 if single else 14}},
+                domain={'row': row, 'column': column},
+                title={'text': metric if single else (f"{process['step']}<br>{metric}" if column == 0 else metric), 'font': {'size': 18 if single else 11}},
+                gauge=get_indicator_gauge("angular" if single else "bullet"),
+            ))
+
+    if single:
+        title = get_kpi_grid_title(records[0])
+        height = 260
+    else:
+        title = "KPI Overview"
+        height = 80 + 45 * len(records)
+
+    fig.update_layout(
+        grid={'rows': len(records), 'columns': len(METRIC_COLUMNS), 'pattern': "independent", 'xgap': 0.25, 'ygap': 0.35},
+        title={'text': title, 'x': 0.5},
+        height=height,
+        margin=dict(t=60, b=10, l=140 if not single else 30, r=30),
+    )
+
+    return fig
+
+
+# KPI indicators of the whole plant in one figure
+def create_plant_kpi_grid():
+    store = get_store()
+    return create_kpi_indicator_grid(store.records())
+
+
+# Color band of a 0-100 value, matching the gauge steps
+def get_gauge_band_color(value):
+    return GAUGE_COLORS[min(int(value // 25), 3)] if value is not None else "#e5e5e5"
+
+
+# Lightweight CSS half-circle gauge (styled in assets/gauges.css), no Plotly involved
+def create_html_gauge(label, value):
+    shown = max(0, min(100, value or 0))
+    return html.Div(
+        [
+            html.Div(className="kpi-gauge-arc", style={"--gauge-value": shown, "--gauge-color": get_gauge_band_color(value)}),
+            html.Div(f"{value:g}%" if value is not None else "N/A", className="kpi-gauge-value"),
+            html.Div(label, className="kpi-gauge-label"),
+        ],
+        className="kpi-gauge",
+    )
+
+
+# KPI gauges of every process on the overview, only in the compact gauge modes
+def create_plant_kpi_section():
+    store = get_store()
+    if GAUGE_MODE == "grid":
+        return [dbc.Row(dbc.Col(dcc.Graph(id="plant-kpi-grid", figure=create_plant_kpi_grid())), className="mb-4")]
+
+    if GAUGE_MODE == "html":
+        return [
+            dbc.Row(
+                [
+                    dbc.Col(html.H5(process['step'], className="text-center"), width=2),
+                    *[
+                        dbc.Col(create_html_gauge(metric, process[column]), width=2)
+                        for metric, column in METRIC_COLUMNS.items()
+                    ],
+                ],
+                className="mb-2",
+                justify="center",
+                align="center",
+            )
+            for process in store.records()
+        ]
+
+    return []
+
+
+# Row of KPI gauges at the top of a process tab, drawn according to GAUGE_MODE
+def create_gauge_row(process):
+    if GAUGE_MODE == "grid":
+        return dbc.Row(
+            dbc.Col(dcc.Graph(
+                id={"type": "process-gauge", "step": process['step'], "metric": "Grid"},
+                figure=create_kpi_indicator_grid([process]),
+            )),
+            className="mb-4",
+        )
+
+    if GAUGE_MODE == "html":
+        status = html.Div(
+            [
+                dbc.Badge(process['status'], color=get_badge_color(process['status']), className="fs-5"),
+                html.Div(f"Current Lot: {process['lot']}", className="kpi-gauge-label mt-2"),
+            ],
+            className="kpi-gauge",
+        )
+        gauges = [create_html_gauge(metric, process[column]) for metric, column in METRIC_COLUMNS.items()]
+        return dbc.Row(
+            [dbc.Col(item, width=2) for item in [status, *gauges]],
+            className="mb-4",
+            justify="center",
+            align="center",
+        )
+
+    # Generate the gauge chart for the process
+    gauge = create_gauge_charts(process)[0]  # Assuming a single gauge chart per process
+    gauges = create_metric_gauges(process)
+    gauges.insert(0, gauge)
+
+    return dbc.Row(
+            [
+                dbc.Col(
+                    dbc.Card(
+                        dbc.CardBody(
+                            dcc.Graph(id={"type": "process-gauge", "step": process['step'], "metric": name}, figure=gauge),
+                        ),
+                        className="mb-3",
+                        style={
+                            "border": "none",          # Hide the card outline
+                            "background-color": "transparent",  # Make background transparent
+                            "box-shadow": "none"       # Optional: Remove box shadow if present
+                        },# Adjust padding to control spacing
+                    ),
+                    width=2,  # Set width to evenly distribute space
+                )
+                for name, gauge in zip(["Status", *METRIC_COLUMNS], gauges)
+            ],
+            className="mb-4",
+            justify="center",  # Center the cards horizontally
+            align="center",    # Optional: Center the cards vertically
+            style={"margin-bottom": "10px"}
+        )
+
+
+# Target below which the KPI gauges of a process are drawn red, applied in the browser
+# by highlightGauges in assets/clientside.js. The HTML gauges have no target.
+def create_gauge_target(step):
+    if GAUGE_MODE == "html":
+        return []
+    return [
+        dbc.Row(
+            dbc.Col(
+                dbc.InputGroup([
+                    dbc.InputGroupText("KPI target (%)"),
+                    dbc.Input(id={"type": "gauge-target", "step": step}, type="number", min=0, max=100, placeholder="None"),
+                ], size="sm"),
+                width=3,
+            ),
+            justify="center",
+            className="mb-4",
+        )
+    ]
+
+
 # Define a function to create a card with "Not Information Available" message
 def create_no_data_card():
     return dbc.Card(
@@ -280,12 +1069,8 @@ def create_material_pie_chart_or_placeholder(material_used, waste_material):
         return dcc.Graph(figure=create_material_pie_chart(material_used, waste_material))
     
 
-def create_process_layout(process):
-    # Generate the gauge chart for the process
-    gauge = create_gauge_charts(process)[0]  # Assuming a single gauge chart per process
-    gauges = create_metric_gauges(process)
-    gauges.insert(0, gauge)
-    
+# Gauges, pie charts and cards of a process tab, for the live values or those of a period
+def create_process_kpis(process):
     # Create runtime pie chart or placeholder card
     if process['run_time'] is not None and process['expected_time'] is not None:
         runtime_pie_chart = dcc.Graph(figure=create_runtime_pie_chart(process['run_time'], process['expected_time']))
@@ -310,8 +1095,8 @@ def create_process_layout(process):
 
      # Create material pie chart or placeholder
     material_pie_chart = create_material_pie_chart_or_placeholder(
-        process.get('material_used', 0),
-        process.get('waste_material', 0)
+        process.get('material_used') or 0,
+        process.get('waste_material') or 0
     )
 
     # Create downtime card
@@ -319,7 +1104,7 @@ def create_process_layout(process):
         dbc.CardBody(
             html.Div([
                 html.H5("Downtime", className="text-center mb-1"),
-                html.P(f"{process['downtime'] if process['downtime'] is not None else 'N/A'}%", className="text-center", style={"fontSize": "24px", "fontWeight": "bold"})
+                html.P(f"{process['downtime']:g}%" if process['downtime'] is not None else "N/A%", className="text-center", style={"fontSize": "24px", "fontWeight": "bold"})
             ])
         ),
         className="mb-3"
@@ -331,7 +1116,7 @@ def create_process_layout(process):
             html.Div([
                 html.H5("Failure Rate", className="text-center mb-1"),
                 html.P(
-                    f"{process['failure_rate']}%" if process['failure_rate'] is not None else "No Information is Available", 
+                    f"{process['failure_rate']:g}%" if process['failure_rate'] is not None else "No Information is Available", 
                     className="text-center", 
                     style={"fontSize": "24px", "fontWeight": "bold"}
                 )
@@ -340,33 +1125,9 @@ def create_process_layout(process):
         className="mb-3"
     )
 
-    return dbc.Container([
-        html.H4(f"Details on {process['step']}", className="my-4 text-center"),
+    return [
         # Row of five gauges
-        dbc.Row(
-            [
-                dbc.Col(
-                    dbc.Card(
-                        dbc.CardBody(
-                            dcc.Graph(figure=gauge),
-                            
-                        ),
-                        className="mb-3",
-                        style={
-                            "border": "none",          # Hide the card outline
-                            "background-color": "transparent",  # Make background transparent
-                            "box-shadow": "none"       # Optional: Remove box shadow if present
-                        },# Adjust padding to control spacing
-                    ),
-                    width=2,  # Set width to evenly distribute space
-                )
-                for gauge in gauges
-            ],
-            className="mb-4",
-            justify="center",  # Center the cards horizontally
-            align="center",    # Optional: Center the cards vertically
-            style={"margin-bottom": "10px"}
-        ),
+        create_gauge_row(process),
         dbc.Row(
             [
                 dbc.Col(
@@ -392,22 +1153,238 @@ def create_process_layout(process):
                 dbc.Col(failure_rate_card, width=4),
             ],
             className="mb-4"
-        )
+        ),
+    ]
+
+
+def create_process_layout(process):
+    return dbc.Container([
+        html.H4(f"Details on {process['step']}", className="my-4 text-center"),
+        *create_period_selector({"type": "process-period", "step": process['step']}, {"type": "process-period-label", "step": process['step']}),
+        *create_gauge_target(process['step']),
+        html.Div(create_process_kpis(process), id={"type": "process-kpis", "step": process['step']}),
+        # Trend of the main KPIs over a selectable range
+        dbc.Row(
+            dbc.Col([
+                dcc.RadioItems(
+                    id={"type": "trend-range", "step": process['step']},
+                    options=list(TREND_RANGES),
+                    value="24h",
+                    inline=True,
+                    className="text-center",
+                    inputStyle={"margin-left": "12px", "margin-right": "4px"},
+                ),
+                dcc.Graph(id={"type": "trend-chart", "step": process['step']}, figure=create_trend_chart(process['step'], "24h")),
+            ]),
+            className="mb-4"
+        ),
+        *create_downtime_section(process['step']),
     ], fluid=True)
 
 
-# Prepare data for chart
-steps = [item["step"] for item in processes]
-downtimes = [item["downtime"] for item in processes]
-uptimes = [100 - downtime for downtime in downtimes]
+# Function to create the KPI trend chart of a process over one of TREND_RANGES
+def create_trend_chart(step, range_key):
+    end = time.time()
+    start = end - TREND_RANGES[range_key]
+
+    fig = go.Figure()
+    for metric, name in (("oee", "OEE"), ("availability", "Availability"), ("downtime", "Downtime")):
+        timestamps, values, resolution = get_site().history.query(step, metric, start, end + 1, max_points=TREND_MAX_POINTS)
+        fig.add_trace(go.Scatter(
+            x=timestamps.astype("datetime64[s]"),
+            y=values,
+            mode='lines+markers' if len(values) < 50 else 'lines',
+            name=name,
+        ))
+
+    fig.update_layout(
+        title=f"KPI Trend ({range_key}, {resolution} resolution)",
+        xaxis=dict(title="Time", range=[np.datetime64(int(start), "s"), np.datetime64(int(end), "s")]),
+        yaxis=dict(title="Percentage (%)"),
+        height=400,
+    )
+
+    return fig
+
+
+def register_trend_callbacks(app):
+    @app.callback(
+        Output({"type": "trend-chart", "step": MATCH}, "figure"),
+        Input({"type": "trend-range", "step": MATCH}, "value"),
+        prevent_initial_call=True,
+    )
+    def update_trend_chart(range_key):
+        return create_trend_chart(dash.callback_context.outputs_list["id"]["step"], range_key)
+
+
+# Durations as hours and minutes, e.g. "2h 05m", "14m" or "40s"
+def format_duration(seconds):
+    if seconds is None:
+        return "N/A"
+    minutes = int(seconds // 60)
+    if minutes >= 60:
+        return f"{minutes // 60}h {minutes % 60:02d}m"
+    return f"{minutes}m" if minutes else f"{int(seconds)}s"
+
+
+# First and last shift of one of DOWNTIME_RANGES, ending with the current shift; day
+# ranges start with the first shift of their first production day
+def get_downtime_shifts(range_key):
+    level, count = DOWNTIME_RANGES[range_key]
+    last_shift = shift_calendar.shift_of(time.time())
+    if level == "shift":
+        return last_shift - count + 1, last_shift
+    first_day = shift_calendar.day_of_shift(last_shift) - count + 1
+    return first_day * len(shift_calendar.names), last_shift
+
+
+# Downtime analysis rows of a process tab: range selector, reason Pareto and failure statistics
+def create_downtime_section(step):
+    if get_downtime_log() is None:
+        return []
+    return [
+        html.H5("Downtime Analysis", className="mt-2 text-center"),
+        dbc.Row(
+            dbc.Col(
+                dcc.RadioItems(
+                    id={"type": "downtime-range", "step": step},
+                    options=list(DOWNTIME_RANGES),
+                    value="7d",
+                    inline=True,
+                    className="text-center",
+                    inputStyle={"margin-left": "12px", "margin-right": "4px"},
+                )
+            ),
+        ),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(id={"type": "downtime-pareto", "step": step}, figure=create_downtime_pareto_chart(step, "7d")), width=6),
+                dbc.Col(html.Div(create_downtime_details(step, "7d"), id={"type": "downtime-details", "step": step}), width=6),
+            ],
+            className="mb-4"
+        ),
+    ]
+
+
+# Function to create the Pareto chart of lost hours per downtime reason, with the cumulative share
+def create_downtime_pareto_chart(step, range_key):
+    downtime_log = get_downtime_log()
+    machine = downtime_log.machine_index(step)
+    fig = go.Figure()
+    if machine is not None:
+        pareto = downtime_log.pareto(machine, *get_downtime_shifts(range_key))
+        fig.add_trace(go.Bar(
+            x=pareto["reasons"],
+            y=pareto["durations"] / 3600,
+            customdata=pareto["counts"],
+            name="Downtime",
+            marker_color="#d62728",
+            hovertemplate="<b>%{x}</b><br>%{y:.2f} h in %{customdata} stops<extra></extra>",
+        ))
+        fig.add_trace(go.Scatter(
+            x=pareto["reasons"],
+            y=pareto["cumulative"],
+            name="Cumulative",
+            mode="lines+markers",
+            yaxis="y2",
+            marker_color="#1f77b4",
+            hovertemplate="%{y:.1f}%<extra></extra>",
+        ))
+
+    fig.update_layout(
+        title=f"Downtime by Reason ({range_key})",
+        yaxis=dict(title="Hours"),
+        yaxis2=dict(title="Cumulative (%)", overlaying="y", side="right", range=[0, 105]),
+        showlegend=False,
+        height=400,
+    )
+
+    return fig
+
+
+# MTBF, MTTR and failure cards above a table of the longest stops
+def create_downtime_details(step, range_key):
+    downtime_log = get_downtime_log()
+    machine = downtime_log.machine_index(step)
+    if machine is None:
+        return html.P("No Downtime Events are Recorded for this Process", className="text-center", style={"fontSize": "18px", "fontWeight": "bold"})
+    first_shift, last_shift = get_downtime_shifts(range_key)
+    now = time.time()
+    reliability = downtime_log.reliability(machine, first_shift, last_shift, now)
+    losses = downtime_log.top_losses(machine, first_shift, last_shift, n=10, now=now)
+
+    cards = dbc.Row(
+        [
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody(
+                        html.Div([
+                            html.H6(label, className="text-center mb-1"),
+                            html.P(value, className="text-center mb-0", style={"fontSize": "20px", "fontWeight": "bold"})
+                        ])
+                    ),
+                    className="mb-3"
+                ),
+                width=3
+            )
+            for label, value in (
+                ("MTBF", format_duration(reliability["mtbf"])),
+                ("MTTR", format_duration(reliability["mttr"])),
+                ("Failures", str(reliability["failures"])),
+                ("Planned Stops", format_duration(reliability["planned_downtime"])),
+            )
+        ]
+    )
+
+    table = dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th("Start"), html.Th("Duration"), html.Th("Reason"), html.Th("Lot")])),
+            html.Tbody([
+                html.Tr([
+                    html.Td(time.strftime("%Y-%m-%d %H:%M", time.localtime(loss["start"]))),
+                    html.Td(format_duration(loss["duration"])),
+                    html.Td(loss["reason"]),
+                    html.Td(loss["lot"] if loss["lot"] is not None else "-"),
+                ])
+                for loss in losses
+            ]),
+        ],
+        bordered=True,
+        hover=True,
+        size="sm",
+        className="mb-0",
+    )
+
+    return [cards, html.H6("Longest Stops", className="text-center"), table]
+
+
+def register_downtime_callbacks(app):
+    @app.callback(
+        Output({"type": "downtime-pareto", "step": MATCH}, "figure"),
+        Output({"type": "downtime-details", "step": MATCH}, "children"),
+        Input({"type": "downtime-range", "step": MATCH}, "value"),
+        prevent_initial_call=True,
+    )
+    def update_downtime_analysis(range_key):
+        step = dash.callback_context.outputs_list[0]["id"]["step"]
+        return create_downtime_pareto_chart(step, range_key), create_downtime_details(step, range_key)
+
+
+# Hover of the uptime and downtime bars. Each trace shows its own value from x and the
+# other one from customdata, so no per-bar strings are sent. Hover-only values travel
+# as float32, which halves their typed array.
+UPTIME_HOVER_TEMPLATE = "<b>%{y}</b><br>Uptime: %{x:.6~g}%<br>Downtime: %{customdata:.6~g}%<extra></extra>"
+DOWNTIME_HOVER_TEMPLATE = "<b>%{y}</b><br>Uptime: %{customdata:.6~g}%<br>Downtime: %{x:.6~g}%<extra></extra>"
+
 
 # Create stacked horizontal bar chart
+@cached_figure
 def create_downtime_uptime_chart():
-    hover_text = [
-        f"<b>{step}</b><br>Uptime: {uptime}%<br>Downtime: {downtime}%"
-        for step, downtime, uptime in zip(steps, downtimes, uptimes)
-    ]
-    
+    store = get_store()
+    steps = store.column("step")
+    downtimes = store.values("downtime")
+    uptimes = 100 - downtimes
+
     fig = go.Figure()
 
     # Add uptime as a percentage
@@ -417,8 +1394,8 @@ def create_downtime_uptime_chart():
         name='Uptime',
         orientation='h',
         marker=dict(color='green'),
-        hoverinfo='text',
-        hovertext=hover_text
+        customdata=downtimes.astype(np.float32),
+        hovertemplate=UPTIME_HOVER_TEMPLATE,
     ))
 
     # Add downtime as a percentage
@@ -428,8 +1405,8 @@ def create_downtime_uptime_chart():
         name='Downtime',
         orientation='h',
         marker=dict(color='red'),
-        hoverinfo='text',
-        hovertext=hover_text
+        customdata=uptimes.astype(np.float32),
+        hovertemplate=DOWNTIME_HOVER_TEMPLATE,
     ))
 
     fig.update_layout(
@@ -443,14 +1420,8 @@ def create_downtime_uptime_chart():
     return fig
 
 
-# Function to create gauge charts
-def create_gauge_charts(process):
-    plot_bgcolor = "#def"
-    quadrant_colors = ['#ffffff', "#f25829", "#f2a529", "#2bad4e"]
-    quadrant_text = ["", "<b>Stopped</b>", "", "<b>Running</b>"]
-    n_quadrants = len(quadrant_colors) - 1
-
-    status = process['status']
+# End point of the status dial hand, pointing at "Running" or "Stopped"
+def get_status_hand_position(status):
     if status == 'Running':
         current_value = 10
     else:
@@ -460,6 +1431,18 @@ def create_gauge_charts(process):
     max_value = 50
     hand_length = np.sqrt(2) / 4
     hand_angle = np.pi * (1 - (max(min_value, min(max_value, current_value)) - min_value) / (max_value - min_value))
+    return 0.5 + hand_length * np.cos(hand_angle), 0.5 + hand_length * np.sin(hand_angle)
+
+
+# Function to create gauge charts
+@cached_figure
+def create_gauge_charts(process):
+    plot_bgcolor = "#def"
+    quadrant_colors = ['#ffffff', "#f25829", "#f2a529", "#2bad4e"]
+    quadrant_text = ["", "<b>Stopped</b>", "", "<b>Running</b>"]
+    n_quadrants = len(quadrant_colors) - 1
+
+    hand_x, hand_y = get_status_hand_position(process['status'])
 
     gauge = go.Figure(
         data=[
@@ -503,8 +1486,8 @@ def create_gauge_charts(process):
                 ),
                 go.layout.Shape(
                     type="line",
-                    x0=0.5, x1=0.5 + hand_length * np.cos(hand_angle),
-                    y0=0.5, y1=0.5 + hand_length * np.sin(hand_angle),
+                    x0=0.5, x1=hand_x,
+                    y0=0.5, y1=hand_y,
                     line=dict(color="#333", width=4)
                 ),
             ],
@@ -513,46 +1496,78 @@ def create_gauge_charts(process):
 
     return [gauge]
 
-# Function to create the stacked bar chart with hover text
-def create_stacked_bar_chart():
-    steps = [process['step'] for process in processes]
-    run_time_percentages = [(process['run_time'] / process['expected_time']) * 100 if process['expected_time'] else 0 for process in processes]
-    remaining_time_percentages = [100 - run_time for run_time in run_time_percentages]
+# Run time as a percentage of expected time, 0 where either is unknown
+def get_run_time_percentages():
+    store = get_store()
+    run_time_percentages, _ = percent(store.values('run_time', fill=np.nan), store.values('expected_time', fill=np.nan))
+    return run_time_percentages
+
+
+# Hover of the progress bars, filled from customdata columns
+# (run time, expected time, remaining time, progress)
+PROGRESS_HOVER_TEMPLATE = (
+    "<b>%{y}</b><br>"
+    "Current Run Time: %{customdata[0]:.6~g}h<br>"
+    "Expected Run Time: %{customdata[1]:.6~g}h<br>"
+    "Remaining Time: %{customdata[2]:.6~g}h<br>"
+    "Progress: %{customdata[3]:.2f}%<extra></extra>"
+)
+
+
+# Bar lengths and hover data of the progress chart. Processes without a run time are
+# drawn by a separate grey trace hovering "N/A", so the other traces share one template.
+def get_progress_bars(run_time_percentages):
+    store = get_store()
+    missing = store.missing('run_time')
+    run_time = store.values('run_time')
+    expected_time = store.values('expected_time')
+    return {
+        "current": np.where(missing, np.nan, run_time_percentages),
+        "remaining": np.where(missing, np.nan, 100 - run_time_percentages),
+        "customdata": np.column_stack((run_time, expected_time, expected_time - run_time, run_time_percentages)).astype(np.float32),
+        "missing_steps": store.column('step')[missing],
+    }
 
-    # Hover text for each bar
-    hover_text = [
-        f"<b>{process['step']}</b><br>"
-        f"Current Run Time: {process['run_time']}h<br>"
-        f"Expected Run Time: {process['expected_time']}h<br>"
-        f"Remaining Time: {process['expected_time'] - process['run_time']}h<br>"
-        f"Progress: {run_time:.2f}%"
-        if process['run_time'] is not None else "N/A"
-        for process, run_time in zip(processes, run_time_percentages)
-    ]
 
+# Function to create the stacked bar chart with hover text
+@cached_figure
+def create_stacked_bar_chart():
+    store = get_store()
+    steps = store.column('step')
+    bars = get_progress_bars(get_run_time_percentages())
 
     fig = go.Figure()
 
     # Add current run time as a percentage
     fig.add_trace(go.Bar(
         y=steps,
-        x=run_time_percentages,
+        x=bars["current"],
         name='Current Run Time (%)',
         orientation='h',
         marker=dict(color='green'),
-        hoverinfo='text',
-        hovertext=hover_text
+        customdata=bars["customdata"],
+        hovertemplate=PROGRESS_HOVER_TEMPLATE,
     ))
 
     # Add remaining time as a percentage
     fig.add_trace(go.Bar(
         y=steps,
-        x=remaining_time_percentages,
+        x=bars["remaining"],
         name='Remaining Time to Expected (%)',
         orientation='h',
         marker=dict(color='lightgrey'),
-        hoverinfo='text',
-        hovertext=hover_text
+        customdata=bars["customdata"],
+        hovertemplate=PROGRESS_HOVER_TEMPLATE,
+    ))
+
+    # Processes without run time data
+    fig.add_trace(go.Bar(
+        y=bars["missing_steps"],
+        x=np.full(len(bars["missing_steps"]), 100.0),
+        orientation='h',
+        marker=dict(color='lightgrey'),
+        hovertemplate="<b>%{y}</b><br>N/A<extra></extra>",
+        showlegend=False,
     ))
 
     fig.update_layout(
@@ -566,12 +1581,14 @@ def create_stacked_bar_chart():
     return fig
 
 # Function to create the units produced bar chart
+@cached_figure
 def create_units_bar_chart():
+    store = get_store()
     return go.Figure(
         data=[
             go.Bar(
-                x=[process["step"] for process in processes],
-                y=[process["units"] for process in processes],
+                x=store.column("step"),
+                y=store.values("units"),
                 marker=dict(color="#008080"),
             ),
         ],
@@ -583,18 +1600,20 @@ def create_units_bar_chart():
     )
 
 # Function to create the downtime and failure rate comparison chart
+@cached_figure
 def create_downtime_failure_chart():
+    store = get_store()
     return go.Figure(
         data=[
             go.Bar(
-                x=[process["step"] for process in processes],
-                y=[process["downtime"] for process in processes],
+                x=store.column("step"),
+                y=store.values("downtime"),
                 name="Downtime",
                 marker=dict(color="#008080"),
             ),
             go.Bar(
-                x=[process["step"] for process in processes],
-                y=[process["failure_rate"] if process["failure_rate"] is not None else 0 for process in processes],
+                x=store.column("step"),
+                y=store.values("failure_rate"),
                 name="Failure Rate",
                 marker=dict(color="#FF8C00"),
             ),
@@ -607,19 +1626,1391 @@ def create_downtime_failure_chart():
         ),
     )
 
-# App Layout with tabs
-app.layout = html.Div([
-    html.H3("Process Monitoring Dashboard", className="my-4 text-center"),
-    dcc.Tabs([
-        dcc.Tab(label="Overall", children=create_overview_layout()),
-        # Create individual tabs for each process
-        *[
-            dcc.Tab(label=process["step"], children=create_process_layout(process))
-            for process in processes
+
+# Lot flow along the routes: a Sankey of lot moves next to WIP, cycle time and the
+# stations holding up their routes. With more than one route the stations of the same
+# stage are drawn as one node.
+def create_lot_flow_section():
+    lot_tracker = get_lot_tracker()
+    if lot_tracker is None:
+        return []
+    return [
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(id="lot-flow-chart", figure=create_lot_flow_chart()), width=8),
+                dbc.Col(html.Div(create_lot_flow_summary(), id="lot-flow-summary"), width=4),
+            ],
+            className="mb-4"
+        ),
+        # Tracker version the lot flow was built from, live mode rebuilds it when it changes
+        dcc.Store(id="lot-flow-version", data=lot_tracker.version),
+    ]
+
+
+def create_lot_flow_chart():
+    lot_tracker = get_lot_tracker()
+    by_stage = len(lot_tracker.routes["names"]) > 1
+    flows = lot_tracker.flows(by_stage=by_stage)
+
+    fig = go.Figure(go.Sankey(
+        arrangement="snap",
+        node=dict(
+            label=flows["labels"],
+            customdata=flows["wip"],
+            hovertemplate="<b>%{label}</b><br>%{value} lots<br>WIP: %{customdata}<extra></extra>",
+            pad=12,
+        ),
+        link=dict(source=flows["source"], target=flows["target"], value=flows["value"]),
+    ))
+    fig.update_layout(
+        title=f"Lot Flow by Stage ({len(lot_tracker.routes['names'])} Routes)" if by_stage else "Lot Flow",
+        height=450,
+    )
+
+    return fig
+
+
+# WIP, throughput and cycle time cards above the stations with the most lots queued in front of them
+def create_lot_flow_summary(n=5):
+    lot_tracker = get_lot_tracker()
+    summary = lot_tracker.route_summary()
+    bottlenecks = lot_tracker.bottlenecks()
+    completed = summary["completed"].sum()
+    cycle_times = np.nan_to_num(summary["cycle_time"]) * summary["completed"]
+    mean_cycle_time = cycle_times.sum() / completed if completed else None
+
+    cards = dbc.Row(
+        [
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody(
+                        html.Div([
+                            html.H6(label, className="text-center mb-1"),
+                            html.P(value, className="text-center mb-0", style={"fontSize": "20px", "fontWeight": "bold"})
+                        ])
+                    ),
+                    className="mb-3"
+                ),
+                width=4
+            )
+            for label, value in (
+                ("Lots in WIP", f"{summary['wip'].sum():,}"),
+                ("Completed", f"{completed:,}"),
+                ("Cycle Time", format_duration(mean_cycle_time)),
+            )
+        ]
+    )
+
+    stations = bottlenecks["station"]
+    rows = rank_rows(bottlenecks["waiting"].astype(np.float64), n, rows=stations >= 0)
+    table = dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th("Bottleneck"), html.Th("Route"), html.Th("Processing"), html.Th("Waiting")])),
+            html.Tbody([
+                html.Tr([
+                    html.Td(lot_tracker.stations[stations[row]]),
+                    html.Td(bottlenecks["route"][row]),
+                    html.Td(format_duration(bottlenecks["process_time"][row])),
+                    html.Td(int(bottlenecks["waiting"][row])),
+                ])
+                for row in rows.tolist()
+            ]),
+        ],
+        bordered=True,
+        hover=True,
+        size="sm",
+        className="mb-0",
+    )
+
+    return [cards, table]
+
+
+# Material analysis of the plant: yield, scrap rate and cost cards, a Pareto of scrap cost
+# per process or lot and the yield trend, over one of MATERIAL_RANGES
+def create_material_section():
+    materials = get_materials()
+    if materials is None:
+        return []
+    radio_style = {"margin-left": "12px", "margin-right": "4px"}
+    return [
+        html.H5("Material Yield and Scrap", className="mt-2 text-center"),
+        dbc.Row(
+            [
+                dbc.Col(dcc.RadioItems(id="material-range", options=list(MATERIAL_RANGES), value="7d", inline=True, inputStyle=radio_style), width=4),
+                dbc.Col(
+                    dcc.RadioItems(
+                        id="material-pareto-by",
+                        options=[{"label": "Scrap by process", "value": "process"}, {"label": "Scrap by lot", "value": "lot"}],
+                        value="process",
+                        inline=True,
+                        inputStyle=radio_style,
+                    ),
+                    width=4,
+                ),
+                dbc.Col(dcc.RadioItems(id="material-trend-by", options=list(MATERIAL_TREND_GROUPS), value="Shift", inline=True, inputStyle=radio_style), width=4),
+            ],
+            className="mb-2"
+        ),
+        html.Div(create_material_cards("7d"), id="material-cards"),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(id="material-pareto-chart", figure=create_scrap_pareto_chart("7d", "process")), width=6),
+                dbc.Col(dcc.Graph(id="material-trend-chart", figure=create_yield_trend_chart("7d", "Shift")), width=6),
+            ],
+            className="mb-4"
+        ),
+        # Ledger version the analysis was built from, live mode rebuilds it when it changes
+        dcc.Store(id="material-version", data=materials.version),
+        *([dcc.Interval(id="material-interval", interval=MATERIAL_REFRESH * 1000)] if LIVE_REFRESH_MS else []),
+    ]
+
+
+def get_material_window(range_key):
+    now = time.time()
+    return now - MATERIAL_RANGES[range_key], now + 1
+
+
+# Plant yield, scrap rate, scrap cost and material per unit over the range
+def create_material_cards(range_key):
+    totals = get_materials().station_totals(*get_material_window(range_key)).sum(axis=0)
+    metrics = material_metrics(totals)
+    return dbc.Row(
+        [
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody(
+                        html.Div([
+                            html.H6(label, className="text-center mb-1"),
+                            html.P(value, className="text-center mb-0", style={"fontSize": "20px", "fontWeight": "bold"})
+                        ])
+                    ),
+                    className="mb-3"
+                ),
+                width=3
+            )
+            for label, value in (
+                ("Yield", "N/A" if np.isnan(metrics["yield"]) else f"{metrics['yield']:.1f}%"),
+                ("Scrap Rate", "N/A" if np.isnan(metrics["scrap_rate"]) else f"{metrics['scrap_rate']:.2f}%"),
+                ("Scrap Cost", f"{metrics['scrap_cost']:,.0f}"),
+                ("Material per Unit", "N/A" if np.isnan(metrics["material_per_unit"]) else f"{metrics['material_per_unit']:.3g} kg"),
+            )
+        ]
+    )
+
+
+# Pareto of the cost of wasted material per process or lot, the costliest
+# MATERIAL_PARETO_BARS with their cumulative share of the plant's scrap cost
+def create_scrap_pareto_chart(range_key, by):
+    materials = get_materials()
+    if by == "lot":
+        lots, sums = materials.lot_totals(*get_material_window(range_key))
+        names = np.array([f"Lot {lot}" for lot in lots.tolist()], dtype=object)
+    else:
+        sums = materials.station_totals(*get_material_window(range_key))
+        names = np.array(materials.stations, dtype=object)
+    metrics = material_metrics(sums)
+    costs = metrics["scrap_cost"]
+    rows = rank_rows(costs, MATERIAL_PARETO_BARS, rows=costs > 0)
+    total = costs.sum()
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=names[rows],
+        y=costs[rows],
+        customdata=np.stack([metrics["waste"][rows], metrics["scrap_rate"][rows]], axis=-1),
+        name="Scrap cost",
+        marker_color="#d62728",
+        hovertemplate="<b>%{x}</b><br>Cost: %{y:,.0f}<br>%{customdata[0]:,.1f} kg wasted (%{customdata[1]:.2f}%)<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        x=names[rows],
+        y=np.cumsum(costs[rows]) * 100 / total if total else np.zeros(len(rows)),
+        name="Cumulative",
+        mode="lines+markers",
+        yaxis="y2",
+        marker_color="#1f77b4",
+        hovertemplate="%{y:.1f}% of the scrap cost<extra></extra>",
+    ))
+    fig.update_layout(
+        title=f"Scrap Cost by {'Lot' if by == 'lot' else 'Process'} ({range_key})",
+        yaxis=dict(title="Scrap cost"),
+        yaxis2=dict(title="Cumulative (%)", overlaying="y", side="right", range=[0, 105]),
+        xaxis=dict(type="category"),
+        showlegend=False,
+        height=400,
+    )
+
+    return fig
+
+
+# Plant yield and scrap rate per hour, or per shift, day or week of the shift calendar
+def create_yield_trend_chart(range_key, group):
+    level = MATERIAL_TREND_GROUPS[group]
+    key_of = None if level is None else lambda starts: np.array([shift_calendar.period_key(level, start) for start in starts.tolist()])
+    keys, sums = get_materials().trend(*get_material_window(range_key), key_of=key_of)
+    metrics = material_metrics(sums)
+    starts = keys if level is None else np.array([shift_calendar.period_bounds(level, key)[0] for key in keys.tolist()])
+    x = starts.astype(np.int64).astype("datetime64[s]")
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=metrics["yield"],
+        name="Yield",
+        mode="lines+markers" if level else "lines",
+        line=dict(color="#2ca02c"),
+        hovertemplate="%{x}<br>Yield: %{y:.2f}%<extra></extra>",
+    ))
+    fig.add_trace(go.Bar(
+        x=x,
+        y=metrics["scrap_rate"],
+        name="Scrap rate",
+        yaxis="y2",
+        marker_color="#d62728",
+        opacity=0.4,
+        hovertemplate="%{x}<br>Scrap rate: %{y:.2f}%<extra></extra>",
+    ))
+    fig.update_layout(
+        title=f"Yield per {group} ({range_key})",
+        yaxis=dict(title="Yield (%)"),
+        yaxis2=dict(title="Scrap rate (%)", overlaying="y", side="right", rangemode="tozero"),
+        legend=dict(orientation="h", y=-0.15),
+        height=400,
+    )
+
+    return fig
+
+
+# Alert panel of the overview, refreshed from the alerts every ALERT_INTERVAL seconds
+def create_alert_panel():
+    alerts = get_alerts()
+    if alerts is None:
+        return []
+    return [
+        dbc.Card(
+            [
+                dbc.CardHeader(html.H5("Alerts", className="mb-0")),
+                dbc.CardBody(create_alert_table(alerts["alerts"]), id="alert-panel"),
+            ],
+            className="mb-4"
+        ),
+        # Alerts version the panel was built from, only changed alerts rebuild it
+        dcc.Store(id="alert-version", data=alerts["version"]),
+        dcc.Interval(id="alert-interval", interval=ALERT_INTERVAL * 1000),
+    ]
+
+
+# Open alerts, the most severe and newest first, then the latest cleared ones
+def create_alert_table(alerts, n=ALERT_PANEL_ROWS):
+    open_alerts = sorted(
+        (alert for alert in alerts if alert["cleared"] is None),
+        key=lambda alert: (alert["severity"] != "danger", -alert["started"]),
+    )
+    if not alerts:
+        return html.P("No alerts", className="text-muted mb-0")
+    rows = (open_alerts + [alert for alert in alerts if alert["cleared"] is not None])[:n]
+    table = dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th("Status"), html.Th("Process"), html.Th("Alert"), html.Th("Started"), html.Th("Duration")])),
+            html.Tbody([
+                html.Tr(
+                    [
+                        html.Td(dbc.Badge("Cleared", color="secondary") if alert["cleared"] else dbc.Badge(alert["severity"].title(), color=alert["severity"])),
+                        html.Td(alert["step"]),
+                        html.Td(alert["message"]),
+                        html.Td(time.strftime("%H:%M:%S", time.localtime(alert["started"]))),
+                        html.Td(format_duration(alert["cleared"] - alert["started"]) if alert["cleared"] else "Ongoing"),
+                    ],
+                    className="text-muted" if alert["cleared"] else None,
+                )
+                for alert in rows
+            ]),
+        ],
+        bordered=True,
+        hover=True,
+        size="sm",
+        className="mb-0",
+    )
+    summary = f"{len(open_alerts)} open" + (f", {len(alerts) - len(open_alerts)} cleared recently" if len(alerts) > len(open_alerts) else "")
+    return [html.P(summary, className="mb-2"), table]
+
+
+# Download links of the raw data exports, relative so they stay under the site's prefix
+def create_export_links():
+    formats = [file_format for file_format in EXPORT_FORMATS if file_format != "parquet" or pyarrow is not None]
+    links = []
+    for dataset in get_export_datasets():
+        links.append(html.Span(dataset.title(), className="ms-3 me-1"))
+        links += [html.A(file_format.upper(), href=f"export/{dataset}.{file_format}", className="me-1") for file_format in formats]
+    return dbc.Row(dbc.Col(html.Div([html.Span("Raw data:", className="fw-bold"), *links])), className="mb-4")
+
+
+# Hierarchy levels of the scalable overview, from the top down
+HIERARCHY = ("plant", "area", "line")
+# Metrics offered by the ranked overview chart
+RANKED_METRICS = {
+    "oee": "OEE (%)",
+    "availability": "Availability (%)",
+    "performance": "Performance (%)",
+    "quality": "Quality (%)",
+    "units": "Units Produced",
+    "downtime": "Downtime (%)",
+    "failure_rate": "Failure Rate (%)",
+}
+
+
+# Rows inside the selected plant/area/line, None selections match everything
+def get_hierarchy_rows(plant, area, line):
+    store = get_store()
+    rows = np.ones(len(store), dtype=bool)
+    for level, value in zip(HIERARCHY, (plant, area, line)):
+        if value:
+            rows &= store.column(level) == value
+    return rows
+
+
+def get_hierarchy_options(level, rows):
+    store = get_store()
+    values = np.unique(store.column(level)[rows].astype(str))
+    return [{"label": value, "value": value} for value in values.tolist() if value]
+
+
+# Overview for thousands of stations: everything below the filters is rendered per
+# request by callbacks from column slices, never one component per station
+def create_scalable_overview_layout():
+    store = get_store()
+    all_rows = np.ones(len(store), dtype=bool)
+    return dbc.Container([
+        html.H3("Operations Status", className="my-4 text-center"),
+        dcc.Store(id="scalable-overview-version", data=store.version),
+        *create_alert_panel(),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Dropdown(id="overview-plant", options=get_hierarchy_options("plant", all_rows), placeholder="All plants"), width=4),
+                dbc.Col(dcc.Dropdown(id="overview-area", placeholder="All areas"), width=4),
+                dbc.Col(dcc.Dropdown(id="overview-line", placeholder="All lines"), width=4),
+            ],
+            className="mb-4"
+        ),
+        *create_period_selector("overview-period", "overview-period-label"),
+        dbc.Row(dbc.Col(html.Div(id="overview-summary")), className="mb-4"),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Dropdown(id="ranked-metric", options=[{"label": label, "value": metric} for metric, label in RANKED_METRICS.items()], value="oee", clearable=False), width=4),
+                dbc.Col(dcc.RadioItems(id="ranked-order", options=[{"label": "Bottom", "value": "bottom"}, {"label": "Top", "value": "top"}], value="bottom", inline=True, inputStyle={"margin-left": "12px", "margin-right": "4px"}), width=4),
+                dbc.Col(dcc.Dropdown(id="ranked-count", options=[10, 20, 50], value=20, clearable=False), width=4),
+            ],
+            className="mb-2"
+        ),
+        dbc.Row(dbc.Col(dcc.Graph(id="ranked-chart")), className="mb-4"),
+        *create_lot_flow_section(),
+        *create_material_section(),
+        dbc.Row(
+            [
+                dbc.Col(html.H5("Stations"), width=4),
+                dbc.Col(
+                    dcc.Dropdown(
+                        id="status-grid-sort",
+                        options=[
+                            {"label": "Stopped first, then lowest OEE", "value": "status"},
+                            {"label": "Lowest OEE", "value": "oee-asc"},
+                            {"label": "Highest OEE", "value": "oee-desc"},
+                            {"label": "Name", "value": "step"},
+                        ],
+                        value="status",
+                        clearable=False,
+                    ),
+                    width=4,
+                ),
+            ],
+            className="mb-2"
+        ),
+        html.Div(id="status-grid"),
+        dbc.Pagination(id="status-grid-page", max_value=1, active_page=1, fully_expanded=False, className="justify-content-center"),
+        create_export_links(),
+    ], fluid=True)
+
+
+# Table of per-group aggregates for the level below the current selection
+def create_hierarchy_summary(rows, level):
+    store = get_store()
+    summary = summarise_by(store, level, rows)
+    header = html.Thead(html.Tr([html.Th(level.title()), html.Th("Stations"), html.Th("Running"), html.Th("Avg OEE"), html.Th("Avg Availability"), html.Th("Avg Downtime"), html.Th("Units")]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(group or "Unassigned"),
+            html.Td(stations),
+            html.Td(running),
+            html.Td(f"{oee:.1f}%"),
+            html.Td(f"{availability:.1f}%"),
+            html.Td(f"{downtime:.1f}%"),
+            html.Td(units),
+        ])
+        for group, stations, running, oee, availability, downtime, units in zip(
+            summary["group"].tolist(), summary["stations"].tolist(), summary["running"].tolist(),
+            summary["oee"].tolist(), summary["availability"].tolist(), summary["downtime"].tolist(),
+            summary["units"].tolist(),
+        )
+    ])
+    return dbc.Table([header, body], bordered=True, hover=True, size="sm", className="text-center")
+
+
+# Bar chart of the top or bottom n stations by a metric
+def create_ranked_bar_chart(rows, metric, n, order):
+    store = get_store()
+    present = rows & ~store.missing(metric)
+    selected = rank_rows(store.values(metric), n, largest=order == "top", rows=present)
+    colors = np.where(store.column("status")[selected] == "Running", "#008080", "#d62728")
+
+    fig = go.Figure(go.Bar(
+        x=store.column("step")[selected],
+        y=store.values(metric)[selected],
+        marker=dict(color=colors),
+    ))
+    fig.update_layout(
+        title=f"{order.title()} {len(selected)} of {int(present.sum())} Stations by {RANKED_METRICS[metric]}",
+        xaxis=dict(title="Process Steps"),
+        yaxis=dict(title=RANKED_METRICS[metric]),
+        height=450,
+    )
+    return fig
+
+
+# One page of status cards, sorted server-side
+def create_status_grid_page(rows, sort, page):
+    store = get_store()
+    candidates = np.flatnonzero(rows)
+    oee = store.values("oee")[candidates]
+    if sort == "status":
+        order = np.lexsort((oee, store.column("status")[candidates] == "Running"))
+    elif sort == "oee-asc":
+        order = np.argsort(oee, kind="stable")
+    elif sort == "oee-desc":
+        order = np.argsort(-oee, kind="stable")
+    else:
+        order = np.argsort(store.column("step")[candidates].astype(str), kind="stable")
+
+    start = (page - 1) * STATUS_GRID_PAGE_SIZE
+    page_rows = candidates[order[start:start + STATUS_GRID_PAGE_SIZE]]
+    return dbc.Row(
+        [
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody(
+                        [
+                            html.H6(process['step'], className="text-center mb-1", style={"whiteSpace": "normal", "wordWrap": "break-word"}),
+                            html.Div(process['line'] or "", className="text-center text-muted small"),
+                            dbc.Badge(f"{process['status']} | OEE {process['oee']:g}%", color=get_badge_color(process['status']), className="d-block mx-auto mt-2")
+                        ]
+                    ),
+                    className="mb-3"
+                ),
+                width=2
+            )
+            for process in (store.record(index) for index in page_rows.tolist())
+        ]
+    )
+
+
+# Process tab used instead of one tab per process on large plants
+def create_process_picker_layout():
+    return dbc.Container([
+        dcc.Dropdown(id="process-picker", placeholder="Search for a process step...", className="my-4"),
+        html.Div(id="process-picker-content"),
+    ], fluid=True)
+
+
+# Hierarchy filters, summary, ranked chart, status grid and process search of the scalable
+# overview. Registered unless every site uses the classic one: sites choose by size.
+def register_scalable_overview_callbacks(app):
+    @app.callback(
+        Output("overview-area", "options"),
+        Output("overview-area", "value"),
+        Input("overview-plant", "value"),
+    )
+    def update_area_options(plant):
+        return get_hierarchy_options("area", get_hierarchy_rows(plant, None, None)), None
+
+    @app.callback(
+        Output("overview-line", "options"),
+        Output("overview-line", "value"),
+        Input("overview-plant", "value"),
+        Input("overview-area", "value"),
+    )
+    def update_line_options(plant, area):
+        return get_hierarchy_options("line", get_hierarchy_rows(plant, area, None)), None
+
+    @app.callback(
+        Output("overview-summary", "children"),
+        Output("ranked-chart", "figure"),
+        Input("overview-plant", "value"),
+        Input("overview-area", "value"),
+        Input("overview-line", "value"),
+        Input("ranked-metric", "value"),
+        Input("ranked-order", "value"),
+        Input("ranked-count", "value"),
+        *([Input("overview-period", "value")] if ROLLUPS != "off" else []),
+    )
+    def update_overview_summary(plant, area, line, metric, order, n, period=LIVE_PERIOD):
+        with using_period(PERIODS.get(period)):
+            rows = get_hierarchy_rows(plant, area, line)
+            # Aggregate one level below the deepest selection
+            depth = sum(1 for value in (plant, area, line) if value)
+            level = HIERARCHY[min(depth, len(HIERARCHY) - 1)]
+            return create_hierarchy_summary(rows, level), create_ranked_bar_chart(rows, metric, n, order)
+
+    @app.callback(
+        Output("status-grid", "children"),
+        Output("status-grid-page", "max_value"),
+        Input("overview-plant", "value"),
+        Input("overview-area", "value"),
+        Input("overview-line", "value"),
+        Input("status-grid-sort", "value"),
+        Input("status-grid-page", "active_page"),
+    )
+    def update_status_grid(plant, area, line, sort, page):
+        rows = get_hierarchy_rows(plant, area, line)
+        n_pages = max(1, -(-int(rows.sum()) // STATUS_GRID_PAGE_SIZE))
+        return create_status_grid_page(rows, sort, min(page or 1, n_pages)), n_pages
+
+    @app.callback(
+        Output("process-picker", "options"),
+        Input("process-picker", "search_value"),
+        State("process-picker", "value"),
+    )
+    def update_process_picker_options(search_value, value):
+        store = get_site().store
+        # Only matching steps are sent, never the full list of stations
+        steps = store.column("step").astype(str)
+        if search_value:
+            matches = steps[np.char.find(np.char.lower(steps), search_value.lower()) >= 0]
+        else:
+            matches = steps
+        options = matches[:50].tolist()
+        if value and value not in options:
+            options.append(value)
+        return options
+
+    @app.callback(
+        Output("process-picker-content", "children"),
+        Input("process-picker", "value"),
+        prevent_initial_call=True,
+    )
+    def show_picked_process(step):
+        store = get_site().store
+        index = store.index_of(step) if step else None
+        if index is None:
+            raise PreventUpdate
+        return create_process_layout(store.record(index))
+
+    if LIVE_REFRESH_MS:
+        # Keep the visible summary, chart and grid page fresh in live mode
+        @app.callback(
+            Output("overview-summary", "children", allow_duplicate=True),
+            Output("ranked-chart", "figure", allow_duplicate=True),
+            Output("status-grid", "children", allow_duplicate=True),
+            Output("status-grid-page", "max_value", allow_duplicate=True),
+            Output("scalable-overview-version", "data"),
+            Input("live-interval", "n_intervals"),
+            State("scalable-overview-version", "data"),
+            State("overview-plant", "value"),
+            State("overview-area", "value"),
+            State("overview-line", "value"),
+            State("ranked-metric", "value"),
+            State("ranked-order", "value"),
+            State("ranked-count", "value"),
+            State("status-grid-sort", "value"),
+            State("status-grid-page", "active_page"),
+            *([State("overview-period", "value")] if ROLLUPS != "off" else []),
+            prevent_initial_call=True,
+        )
+        def refresh_scalable_overview(n_intervals, client_version, plant, area, line, metric, order, n, sort, page, period=LIVE_PERIOD):
+            _, current = refresh_store()
+            if client_version == current.version:
+                raise PreventUpdate
+            summary, ranked_chart = update_overview_summary(plant, area, line, metric, order, n, period)
+            grid, n_pages = update_status_grid(plant, area, line, sort, page)
+            return summary, ranked_chart, grid, n_pages, current.version
+
+
+# Simulations of the what-if tab, run in a process pool started on first use
+simulator = Simulator(SIMULATION_WORKERS) if SIMULATION else None
+if simulator is not None:
+    atexit.register(simulator.shutdown)
+
+
+# Station parameters of a route for the simulation, with the repair times of the last
+# 30 days of the downtime log
+def get_simulation_parameters(route):
+    store = get_store()
+    mttr = np.full(len(store), np.nan)
+    downtime_log = get_downtime_log()
+    if downtime_log is not None:
+        first_shift, last_shift = get_downtime_shifts("30d")
+        for station in np.flatnonzero(get_routes(store)["route"] == route).tolist():
+            machine = downtime_log.machine_index(store.column("step")[station])
+            if machine is not None:
+                mttr[station] = downtime_log.reliability(machine, first_shift, last_shift)["mttr"] or np.nan
+    return chain_parameters(store, route, mttr)
+
+
+def get_route_step_options(route):
+    steps = chain_parameters(get_store(), route)["steps"]
+    return [{"label": step, "value": position} for position, step in enumerate(steps)]
+
+
+# What-if tab: Monte Carlo shifts of one route as it is and with one station faster or
+# more or less available, side by side
+def create_simulation_layout():
+    routes = get_routes(get_store())["names"]
+    shift_hours = round(shift_calendar.lengths[0] / 3600, 2)
+    input_style = {"width": "100%"}
+    return dbc.Container([
+        html.H3("What-if Simulation", className="my-4 text-center"),
+        dbc.Row(
+            [
+                dbc.Col([html.Label("Route"), dcc.Dropdown(id="simulation-route", options=[{"label": name, "value": route} for route, name in enumerate(routes)], value=0, clearable=False)], width=3),
+                dbc.Col([html.Label("Station to change"), dcc.Dropdown(id="simulation-step", options=get_route_step_options(0), value=0, clearable=False)], width=3),
+                dbc.Col([html.Label("Faster by (%)"), dcc.Input(id="simulation-speed", type="number", value=10, min=-90, style=input_style)], width=1),
+                dbc.Col([html.Label("Availability (%)"), dcc.Input(id="simulation-availability", type="number", placeholder="As is", min=1, max=100, style=input_style)], width=1),
+                dbc.Col([html.Label("Shift (h)"), dcc.Input(id="simulation-hours", type="number", value=shift_hours, min=0.5, max=24, style=input_style)], width=1),
+                dbc.Col([html.Label("Replications"), dcc.Input(id="simulation-replications", type="number", value=SIMULATION_REPLICATIONS, min=10, max=SIMULATION_MAX_REPLICATIONS, step=10, style=input_style)], width=1),
+                dbc.Col(dbc.Button("Run", id="simulation-run", color="primary", className="mt-4"), width=2),
+            ],
+            className="mb-2"
+        ),
+        html.P(
+            f"Each shift starts with an empty route. A new unit is released whenever fewer than {WIP_PER_STATION} per "
+            "station are in it. Cycle times come from the run time per unit and failures from the availability and "
+            "the repair times in the downtime log. The bottleneck is the station active the longest, "
+            "processing or under repair.",
+            className="text-muted small",
+        ),
+        dcc.Loading(html.Div(id="simulation-results")),
+    ], fluid=True)
+
+
+# Cards comparing the two runs above the throughput, WIP and bottleneck charts
+def create_simulation_results(steps, changed_step, results):
+    baseline, scenario = (summarise_simulation(result, len(steps)) for result in results)
+    names = ("As is", f"{changed_step} changed")
+    change = (scenario["throughput"] - baseline["throughput"]) * 100 / baseline["throughput"] if baseline["throughput"] else None
+
+    def bottleneck(summary):
+        return steps[int(summary["bottleneck_share"].argmax())]
+
+    cards = dbc.Row(
+        [
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody(
+                        html.Div([
+                            html.H6(label, className="text-center mb-1"),
+                            html.P(value, className="text-center mb-0", style={"fontSize": "20px", "fontWeight": "bold"})
+                        ])
+                    ),
+                    className="mb-3"
+                ),
+                width=3
+            )
+            for label, value in (
+                ("Throughput per Shift", f"{baseline['throughput']:.1f} → {scenario['throughput']:.1f}" + (f" ({change:+.1f}%)" if change is not None else "")),
+                ("Mean WIP", f"{baseline['wip']:.1f} → {scenario['wip']:.1f}"),
+                ("Bottleneck", bottleneck(baseline) if bottleneck(baseline) == bottleneck(scenario) else f"{bottleneck(baseline)} → {bottleneck(scenario)}"),
+                ("Bottleneck Shifts per Shift", f"{baseline['bottleneck_shifts']:.2f} → {scenario['bottleneck_shifts']:.2f}"),
+            )
+        ]
+    )
+
+    colors = ("#7f7f7f", "#1f77b4")
+    throughput = go.Figure([
+        go.Histogram(x=result["throughput"], name=name, marker_color=color, opacity=0.6)
+        for name, color, result in zip(names, colors, results)
+    ])
+    throughput.update_layout(
+        title=f"Throughput per Shift ({len(results[0]['throughput'])} Replications)",
+        barmode="overlay",
+        xaxis=dict(title="Units"),
+        yaxis=dict(title="Replications"),
+        legend=dict(orientation="h", y=-0.2),
+        height=400,
+    )
+
+    def station_chart(title, key, axis_title, hover):
+        fig = go.Figure([
+            go.Bar(x=steps, y=summary[key], name=name, marker_color=color, hovertemplate=hover)
+            for name, color, summary in zip(names, colors, (baseline, scenario))
+        ])
+        fig.update_layout(title=title, barmode="group", yaxis=dict(title=axis_title), xaxis=dict(type="category"), legend=dict(orientation="h", y=-0.3), height=400)
+        return fig
+
+    return [
+        cards,
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(figure=throughput), width=6),
+                dbc.Col(dcc.Graph(figure=station_chart("WIP by Station", "station_wip", "Units", "<b>%{x}</b><br>%{y:.2f} units<extra></extra>")), width=6),
+            ],
+            className="mb-4"
+        ),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Graph(figure=station_chart("Active Time by Station", "active", "Active (%)", "<b>%{x}</b><br>%{y:.1f}% processing or under repair<extra></extra>")), width=6),
+                dbc.Col(dcc.Graph(figure=station_chart("Bottleneck by Hour", "window_bottleneck_share", "Hours as bottleneck (%)", "<b>%{x}</b><br>Bottleneck %{y:.1f}% of the hours<extra></extra>")), width=6),
+            ],
+            className="mb-4"
+        ),
+    ]
+
+
+def register_simulation_callbacks(app):
+    @app.callback(
+        Output("simulation-step", "options"),
+        Output("simulation-step", "value"),
+        Input("simulation-route", "value"),
+        prevent_initial_call=True,
+    )
+    def update_simulation_steps(route):
+        return get_route_step_options(route), 0
+
+    @app.callback(
+        Output("simulation-results", "children"),
+        Input("simulation-run", "n_clicks"),
+        State("simulation-route", "value"),
+        State("simulation-step", "value"),
+        State("simulation-speed", "value"),
+        State("simulation-availability", "value"),
+        State("simulation-hours", "value"),
+        State("simulation-replications", "value"),
+        prevent_initial_call=True,
+    )
+    def run_simulation(n_clicks, route, position, speed, availability, hours, replications):
+        if None in (route, position, hours, replications) or hours <= 0 or (speed or 0) <= -100:
+            return html.P("Choose a station, a shift length and a number of replications", className="text-danger")
+        parameters = get_simulation_parameters(route)
+        scenario = apply_scenario(parameters, position, speed or 0, availability)
+        replications = min(max(int(replications), 2), SIMULATION_MAX_REPLICATIONS)
+        results = [simulator.run(chosen, hours * 3600, replications) for chosen in (parameters, scenario)]
+        return create_simulation_results(parameters["steps"], parameters["steps"][position], results)
+
+
+# Tab 0 is the overview, tab i is store.record(i - 1), or the process search on large plants
+# (decided per site), and the what-if simulation last
+def create_tab_content(index):
+    site = get_site()
+    if SIMULATION and index == len(get_tab_labels()) - 1:
+        return create_simulation_layout()
+    if index == 0:
+        return create_scalable_overview_layout() if site.scalable else create_overview_layout()
+    if site.scalable:
+        return create_process_picker_layout()
+    return create_process_layout(site.store.record(index - 1))
+
+
+def get_tab_labels():
+    site = get_site()
+    if site.scalable:
+        labels = ["Overall", "Process Details"]
+    else:
+        labels = ["Overall"] + site.store.column("step").tolist()
+    return labels + ["What-if"] if SIMULATION else labels
+
+
+def create_tabs():
+    labels = get_tab_labels()
+
+    if not LAZY_TABS:
+        return dcc.Tabs([
+            dcc.Tab(label=label, children=create_tab_content(index))
+            for index, label in enumerate(labels)
+        ])
+
+    # Only the empty shell is sent with the layout, contents come from render_lazy_tabs
+    return html.Div([
+        dcc.Store(id="rendered-tabs", data=[]),
+        # Tabs to build, set in the browser by requestTabs only when a tab that was not
+        # rendered yet is selected
+        dcc.Store(id="tab-request"),
+        dcc.Store(id="tab-settings", data={"prefetch": PREFETCH_TABS, "tabs": len(labels)}),
+        dcc.Tabs(
+            id="process-tabs",
+            value="tab-0",
+            children=[
+                dcc.Tab(
+                    label=label,
+                    value=f"tab-{index}",
+                    children=html.Div(id={"type": "tab-content", "index": index}),
+                )
+                for index, label in enumerate(labels)
+            ],
+        ),
+    ])
+
+
+def register_tab_callbacks(app):
+    app.clientside_callback(
+        ClientsideFunction(namespace="oee", function_name="requestTabs"),
+        Output("tab-request", "data"),
+        Input("process-tabs", "value"),
+        State("rendered-tabs", "data"),
+        State("tab-settings", "data"),
+    )
+
+    @app.callback(
+        Output({"type": "tab-content", "index": ALL}, "children"),
+        Output("rendered-tabs", "data"),
+        Input("tab-request", "data"),
+        State("rendered-tabs", "data"),
+        prevent_initial_call=True,
+    )
+    def render_lazy_tabs(requested, rendered):
+        indices = [output["id"]["index"] for output in dash.callback_context.outputs_list[0]]
+
+        # Build the selected tab and its neighbours, skipping anything already sent by an
+        # earlier request that crossed this one
+        to_build = [index for index in requested or [] if index in indices and index not in rendered]
+        if not to_build:
+            raise PreventUpdate
+
+        children = [
+            create_tab_content(index) if index in to_build else dash.no_update
+            for index in indices
+        ]
+        return children, rendered + to_build
+
+
+# Overview chart ids and the builders that create them
+OVERVIEW_CHARTS = {
+    "oee-summary-chart": create_oee_summary_chart,
+    "spider-chart": create_spider_chart,
+    "downtime-uptime-chart": create_downtime_uptime_chart,
+    "stacked-bar-chart": create_stacked_bar_chart,
+    "units-bar-chart": create_units_bar_chart,
+    "downtime-failure-chart": create_downtime_failure_chart,
+}
+if GAUGE_MODE == "grid":
+    OVERVIEW_CHARTS["plant-kpi-grid"] = create_plant_kpi_grid
+
+# Overview view controls, run in the browser. The figures are also outputs of the live
+# update, whose patches keep addressing the traces in store order.
+OVERVIEW_VIEW_CHARTS = ["oee-summary-chart", "downtime-uptime-chart", "stacked-bar-chart", "units-bar-chart", "downtime-failure-chart"]
+
+
+def register_overview_view_callbacks(app):
+    app.clientside_callback(
+        ClientsideFunction(namespace="oee", function_name="applyOverviewView"),
+        [Output(name, "figure", allow_duplicate=True) for name in OVERVIEW_VIEW_CHARTS],
+        Input("overview-status-filter", "value"),
+        Input("overview-sort", "value"),
+        Input("overview-units", "value"),
+        Input("overview-oee-target", "value"),
+        Input("overview-data", "data"),
+        [State(name, "figure") for name in OVERVIEW_VIEW_CHARTS],
+        prevent_initial_call=True,
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="oee", function_name="showSpiderTraces"),
+        Output("spider-chart", "figure", allow_duplicate=True),
+        Input("overview-spider-processes", "value"),
+        State("spider-chart", "figure"),
+        prevent_initial_call=True,
+    )
+
+
+# Period selectors of the overview and process tabs
+def register_period_callbacks(app):
+    @app.callback(
+        Output("overview-period-label", "children"),
+        Input("overview-period", "value"),
+        prevent_initial_call=True,
+    )
+    def update_overview_period_label(value):
+        return get_period_label(value)
+
+    # Overview charts of the selected period, or the live ones again. The clientside view
+    # controls are applied again on the new figures once overview-data arrives.
+    @app.callback(
+        [Output(name, "figure", allow_duplicate=True) for name in OVERVIEW_CHARTS],
+        Output("overview-data", "data", allow_duplicate=True),
+        Output("overview-data-version", "data", allow_duplicate=True),
+        Input("overview-period", "value"),
+        prevent_initial_call=True,
+    )
+    def show_overview_period(value):
+        with using_period(PERIODS.get(value)):
+            return *(builder() for builder in OVERVIEW_CHARTS.values()), get_overview_data(), get_store().version
+
+    @app.callback(
+        Output({"type": "process-kpis", "step": MATCH}, "children"),
+        Output({"type": "process-period-label", "step": MATCH}, "children"),
+        Input({"type": "process-period", "step": MATCH}, "value"),
+        prevent_initial_call=True,
+    )
+    def show_process_period(value):
+        step = dash.callback_context.outputs_list[0]["id"]["step"]
+        with using_period(PERIODS.get(value)):
+            store = get_store()
+            index = store.index_of(step)
+            if index is None:
+                raise PreventUpdate
+            return create_process_kpis(store.record(index)), get_period_label(value)
+
+
+def register_gauge_callbacks(app):
+    app.clientside_callback(
+        ClientsideFunction(namespace="oee", function_name="highlightGauges"),
+        Output({"type": "process-gauge", "step": MATCH, "metric": ALL}, "figure", allow_duplicate=True),
+        Input({"type": "gauge-target", "step": MATCH}, "value"),
+        # Live updates change the gauge values, the highlight follows them
+        *([Input("gauge-data-version", "data")] if LIVE_REFRESH_MS else []),
+        State({"type": "process-gauge", "step": MATCH, "metric": ALL}, "figure"),
+        prevent_initial_call=True,
+    )
+
+
+# Live updates of the overview, lot flow and gauges, each sending only what changed since
+# the version the client has
+def register_live_callbacks(app):
+    # Patches for the overview charts covering only the columns in `changed`,
+    # `previous` is the store the client has or None when everything must be resent
+    def get_overview_patches(changed, previous):
+        store = get_site().store
+        patches = {name: dash.no_update for name in OVERVIEW_CHARTS}
+
+        if "step" in changed:
+            # The set of processes changed, the charts have to be rebuilt from scratch
+            return {name: builder() for name, builder in OVERVIEW_CHARTS.items()}
+
+        if "oee" in changed:
+            patch = Patch()
+            patch["data"][0]["y"] = typed_array(store.values("oee"))
+            patches["oee-summary-chart"] = patch
+
+        spider_rows = np.full(len(store), previous is None)
+        for name in ("availability", "performance", "quality"):
+            if name in changed and previous is not None:
+                spider_rows |= store.values(name) != previous.values(name)
+        if spider_rows.any():
+            patch = Patch()
+            for index in np.flatnonzero(spider_rows).tolist():
+                values = [store.values(name)[index].item() for name in ("availability", "performance", "quality")]
+                patch["data"][index]["r"] = values + [values[0]]
+            patches["spider-chart"] = patch
+
+        if "downtime" in changed:
+            downtimes = store.values("downtime")
+            uptimes = 100 - downtimes
+            patch = Patch()
+            patch["data"][0]["x"] = typed_array(uptimes)
+            patch["data"][1]["x"] = typed_array(downtimes)
+            patch["data"][0]["customdata"] = typed_array(downtimes.astype(np.float32))
+            patch["data"][1]["customdata"] = typed_array(uptimes.astype(np.float32))
+            patches["downtime-uptime-chart"] = patch
+
+        if {"run_time", "expected_time"} & changed:
+            bars = get_progress_bars(get_run_time_percentages())
+            patch = Patch()
+            patch["data"][0]["x"] = typed_array(bars["current"])
+            patch["data"][1]["x"] = typed_array(bars["remaining"])
+            patch["data"][0]["customdata"] = typed_array(bars["customdata"])
+            patch["data"][1]["customdata"] = typed_array(bars["customdata"])
+            patch["data"][2]["y"] = bars["missing_steps"]
+            patch["data"][2]["x"] = typed_array(np.full(len(bars["missing_steps"]), 100.0))
+            patches["stacked-bar-chart"] = patch
+
+        if "units" in changed:
+            patch = Patch()
+            patch["data"][0]["y"] = typed_array(store.values("units"))
+            patches["units-bar-chart"] = patch
+
+        if {"downtime", "failure_rate"} & changed:
+            patch = Patch()
+            patch["data"][0]["y"] = typed_array(store.values("downtime"))
+            patch["data"][1]["y"] = typed_array(store.values("failure_rate"))
+            patches["downtime-failure-chart"] = patch
+
+        if "plant-kpi-grid" in OVERVIEW_CHARTS and set(METRIC_COLUMNS.values()) & changed:
+            patch = Patch()
+            for column, name in enumerate(METRIC_COLUMNS.values()):
+                values = store.values(name)
+                rows = np.arange(len(store)) if previous is None else np.flatnonzero(values != previous.values(name))
+                for row in rows.tolist():
+                    patch["data"][row * len(METRIC_COLUMNS) + column]["value"] = values[row].item()
+            patches["plant-kpi-grid"] = patch
+
+        return patches
+
+    # Columns that changed since the version the client last saw, and the store to diff against
+    def get_changed_columns(client_version, previous, current):
+        if client_version == previous.version:
+            return set(current.changed_columns(previous)), previous
+        # The client missed more than one update, resend every column and row
+        return set(COLUMNS), None
+
+    @app.callback(
+        [Output(name, "figure") for name in OVERVIEW_CHARTS],
+        Output({"type": "status-badge", "index": ALL}, "children"),
+        Output({"type": "status-badge", "index": ALL}, "color"),
+        Output("overview-data-version", "data"),
+        Output("overview-data", "data"),
+        Input("live-interval", "n_intervals"),
+        State("overview-data-version", "data"),
+        *([State("overview-period", "value")] if ROLLUPS != "off" else []),
+        prevent_initial_call=True,
+    )
+    def update_overview(n_intervals, client_version, period=LIVE_PERIOD):
+        previous, current = refresh_store()
+        n_badges = len(dash.callback_context.outputs_list[len(OVERVIEW_CHARTS)])
+        badge_text = [dash.no_update] * n_badges
+        badge_colors = [dash.no_update] * n_badges
+
+        if period != LIVE_PERIOD:
+            # The charts show a period: rebuilt while it is running, closed ones never change
+            with using_period(PERIODS[period]):
+                store = get_store()
+                if client_version == store.version:
+                    raise PreventUpdate
+                figures = [builder() for builder in OVERVIEW_CHARTS.values()]
+                return *figures, badge_text, badge_colors, store.version, get_overview_data()
+
+        if client_version == current.version:
+            raise PreventUpdate
+
+        changed, previous = get_changed_columns(client_version, previous, current)
+        patches = get_overview_patches(changed, previous)
+
+        if "status" in changed and n_badges == len(current):
+            statuses = current.column("status")
+            rows = np.arange(n_badges) if previous is None else np.flatnonzero(statuses != previous.column("status"))
+            for index in rows.tolist():
+                badge_text[index] = statuses[index]
+                badge_colors[index] = get_badge_color(statuses[index])
+
+        view_columns = {"step", "status", "oee", "units", "run_time"}
+        overview_data = get_overview_data() if view_columns & changed else dash.no_update
+        return *patches.values(), badge_text, badge_colors, current.version, overview_data
+
+    if LOT_TRACKING != "off":
+        @app.callback(
+            Output("lot-flow-chart", "figure"),
+            Output("lot-flow-summary", "children"),
+            Output("lot-flow-version", "data"),
+            Input("live-interval", "n_intervals"),
+            State("lot-flow-version", "data"),
+            prevent_initial_call=True,
+        )
+        def update_lot_flow(n_intervals, client_version):
+            version = get_lot_tracker().version
+            if client_version == version:
+                raise PreventUpdate
+            return create_lot_flow_chart(), create_lot_flow_summary(), version
+
+    @app.callback(
+        Output({"type": "process-gauge", "step": ALL, "metric": ALL}, "figure"),
+        Output("gauge-data-version", "data"),
+        Input("live-interval", "n_intervals"),
+        State("gauge-data-version", "data"),
+        *([State({"type": "process-period", "step": ALL}, "value")] if ROLLUPS != "off" else []),
+        prevent_initial_call=True,
+    )
+    def update_process_gauges(n_intervals, client_version, periods=()):
+        previous, current = refresh_store()
+        if client_version == current.version:
+            raise PreventUpdate
+
+        changed, previous = get_changed_columns(client_version, previous, current)
+        # Gauges of tabs showing a period keep its values
+        period_steps = {
+            state["id"]["step"]
+            for state in (dash.callback_context.states_list[1] if periods else [])
+            if state.get("value", LIVE_PERIOD) != LIVE_PERIOD
+        }
+        figures = []
+        for output in dash.callback_context.outputs_list[0]:
+            step, metric = output["id"]["step"], output["id"]["metric"]
+            if step in period_steps:
+                figures.append(dash.no_update)
+                continue
+            index = current.index_of(step)
+            if metric == "Grid":
+                columns = [*METRIC_COLUMNS.values(), "status", "lot"]
+            elif metric in METRIC_COLUMNS:
+                columns = [METRIC_COLUMNS[metric]]
+            else:
+                columns = ["status", "lot"]
+            record = current.record(index) if index is not None else None
+            if record is None or not changed & set(columns) or (
+                previous is not None
+                and index < len(previous)
+                and all(previous.record(index)[column] == record[column] for column in columns)
+            ):
+                figures.append(dash.no_update)
+                continue
+
+            patch = Patch()
+            if metric == "Status":
+                hand_x, hand_y = get_status_hand_position(record["status"])
+                patch["layout"]["shapes"][1]["x1"] = hand_x
+                patch["layout"]["shapes"][1]["y1"] = hand_y
+                patch["layout"]["annotations"][1]["text"] = f"<br><b>Current Lot: {record['lot']}</b>"
+            elif metric == "Grid":
+                for position, column in enumerate(METRIC_COLUMNS.values()):
+                    patch["data"][position]["value"] = record[column]
+                patch["layout"]["title"]["text"] = get_kpi_grid_title(record)
+            else:
+                patch["data"][0]["value"] = record[columns[0]]
+            figures.append(patch)
+
+        return figures, current.version
+
+
+def register_alert_callbacks(app):
+    @app.callback(
+        Output("alert-panel", "children"),
+        Output("alert-version", "data"),
+        Input("alert-interval", "n_intervals"),
+        State("alert-version", "data"),
+        prevent_initial_call=True,
+    )
+    def update_alert_panel(n_intervals, client_version):
+        alerts = get_alerts()
+        if alerts is None or alerts["version"] == client_version:
+            raise PreventUpdate
+        return create_alert_table(alerts["alerts"]), alerts["version"]
+
+
+def register_material_callbacks(app):
+    @app.callback(
+        Output("material-cards", "children"),
+        Output("material-pareto-chart", "figure"),
+        Output("material-trend-chart", "figure"),
+        Output("material-version", "data"),
+        Input("material-range", "value"),
+        Input("material-pareto-by", "value"),
+        Input("material-trend-by", "value"),
+        *([Input("material-interval", "n_intervals")] if LIVE_REFRESH_MS else []),
+        State("material-version", "data"),
+        prevent_initial_call=True,
+    )
+    def update_material_analysis(range_key, by, group, *args):
+        client_version = args[-1]
+        version = get_materials().version
+        if dash.callback_context.triggered_id == "material-interval" and client_version == version:
+            raise PreventUpdate
+        return create_material_cards(range_key), create_scrap_pareto_chart(range_key, by), create_yield_trend_chart(range_key, group), version
+
+
+# Cross-site roll-up on / when several sites are served. Every row comes from the site's
+# precomputed summary, the roll-up never reads the stations of every site.
+def format_percent(value):
+    return f"{value:.1f}%" if value is not None else "-"
+
+
+def get_site_summaries():
+    if LIVE_REFRESH_MS:
+        # Each site reloads at most once per refresh interval, shared with its own pages
+        for site in get_sites().values():
+            refresh_store(site)
+    return [(site, site.summary()) for site in get_sites().values()]
+
+
+def create_rollup_chart(summaries):
+    titles = [site.title for site, _ in summaries]
+    fig = go.Figure()
+    for name, label in (("oee", "OEE"), ("availability", "Availability"), ("performance", "Performance"), ("quality", "Quality")):
+        fig.add_trace(go.Bar(x=titles, y=[summary[name] for _, summary in summaries], name=label))
+    fig.update_layout(
+        title="KPIs by Site",
+        barmode="group",
+        xaxis=dict(title="Site"),
+        yaxis=dict(title="Percentage (%)", range=[0, 100]),
+        height=450,
+    )
+    return fig
+
+
+def create_rollup_content():
+    summaries = get_site_summaries()
+    total = combine_summaries([summary for _, summary in summaries])
+    cards = dbc.Row(
+        [
+            dbc.Col(dbc.Card(dbc.CardBody([html.H6(label, className="text-muted"), html.H4(value)]), className="text-center"), width=3)
+            for label, value in (
+                ("Sites", len(summaries)),
+                ("Stations Running", f"{total['running']} / {total['stations']}"),
+                ("OEE Across Sites", format_percent(total["oee"])),
+                ("Units Produced", f"{total['units']:,}"),
+            )
         ],
+        className="mb-4",
+    )
+    header = html.Thead(html.Tr([html.Th(name) for name in ("Site", "Stations", "Running", "OEE", "Availability", "Performance", "Quality", "Downtime", "Units")]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(html.A(site.title, href=site.path)),
+            html.Td(summary["stations"]),
+            html.Td(summary["running"]),
+            *(html.Td(format_percent(summary[name])) for name in ("oee", "availability", "performance", "quality", "downtime")),
+            html.Td(f"{summary['units']:,}"),
+        ])
+        for site, summary in summaries
     ])
-])
+    return [
+        cards,
+        dcc.Graph(id="rollup-chart", figure=create_rollup_chart(summaries)),
+        dbc.Table([header, body], bordered=True, hover=True, size="sm", className="text-center"),
+        # Data versions the roll-up was built from, live mode rebuilds it when one changes
+        dcc.Store(id="rollup-versions", data=[summary["version"] for _, summary in summaries]),
+    ]
+
+
+def create_rollup_layout():
+    return dbc.Container([
+        html.H3("Process Monitoring: All Sites", className="my-4 text-center"),
+        html.Div(create_rollup_content(), id="rollup-content"),
+        *([dcc.Interval(id="rollup-interval", interval=LIVE_REFRESH_MS)] if LIVE_REFRESH_MS else []),
+    ], fluid=True)
+
+
+# Site picker above a site's dashboard, navigating to the chosen site or the roll-up
+def create_site_picker(site):
+    return dbc.Row(
+        dbc.Col(
+            [
+                dcc.Location(id="site-location", refresh=True),
+                dcc.Dropdown(
+                    id="site-picker",
+                    options=[{"label": "All sites", "value": "/"}] + [{"label": other.title, "value": other.path} for other in get_sites().values()],
+                    value=site.path,
+                    clearable=False,
+                ),
+            ],
+            width=3,
+        ),
+        justify="end",
+        className="me-3 mt-2",
+    )
+
+
+# Site picker and the live roll-up of several sites
+def register_site_callbacks(app):
+    app.clientside_callback(
+        ClientsideFunction(namespace="oee", function_name="selectSite"),
+        Output("site-location", "href"),
+        Input("site-picker", "value"),
+        State("site-location", "pathname"),
+        prevent_initial_call=True,
+    )
+
+    if LIVE_REFRESH_MS:
+        @app.callback(
+            Output("rollup-content", "children"),
+            Input("rollup-interval", "n_intervals"),
+            State("rollup-versions", "data"),
+            prevent_initial_call=True,
+        )
+        def update_rollup(n_intervals, client_versions):
+            versions = [summary["version"] for _, summary in get_site_summaries()]
+            if versions == client_versions:
+                raise PreventUpdate
+            return create_rollup_content()
+
+
+# App Layout with tabs, or the roll-up outside the sites when several are served
+def create_layout():
+    site = current_site.get()
+    if MULTI_SITE and site is None:
+        return create_rollup_layout()
+    store = get_site().store
+    return html.Div([
+        *([create_site_picker(site)] if MULTI_SITE else []),
+        html.H3(f"{site.title}: Process Monitoring Dashboard" if MULTI_SITE else "Process Monitoring Dashboard", className="my-4 text-center"),
+        create_tabs(),
+        *(
+            [
+                dcc.Interval(id="live-interval", interval=LIVE_REFRESH_MS),
+                dcc.Store(id="gauge-data-version", data=store.version),
+            ]
+            if LIVE_REFRESH_MS else []
+        ),
+    ])
+
+
+# Build what the first requests need ahead of them: the sites, the deferred data and the
+# overview, whose figures land in the app's figure cache. Run by gunicorn's when_ready hook
+# in a master that preloads the app, so every worker forked from it starts with all three.
+def warm_up(dash_app=None):
+    dash_app = dash_app or get_app()
+    load_sites(dash_app)
+    load_deferred(dash_app.sites)
+    with dash_app.server.app_context():
+        for site in dash_app.sites.values():
+            with using_site(site):
+                create_tab_content(0)
+
+
+# Dash app with the Bootstrap theme and its Flask server hooks, sending each site's requests
+# back under the site's prefix (see sites.py). Tab contents are built after the layout is
+# sent, so callbacks refer to ids missing from it; not checking them also keeps Dash from
+# calling the layout function at startup to validate it. Each app has its own sites, figure
+# cache, routes and callbacks; their data is loaded by warm_up or start_worker, not here.
+def create_app():
+    server = flask.Flask(__name__)
+
+    # Servers without gunicorn's hooks (python app.py, other WSGI servers) start the worker
+    # on its first request. Registered before Dash's own hooks, which build the layout.
+    @server.before_request
+    def start_on_first_request():
+        if not app.started:
+            start_worker(app)
+
+    app = SiteDash(__name__, server=server, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+    app.sites = parse_sites(SITES_SPEC) if MULTI_SITE else {"default": Site("default", DATA_SOURCE)}
+    app.figure_cache = create_figure_cache()
+    app.started = False
+    app.server.extensions["oee"] = app
+
+    # Timing and size histograms of callbacks and figure builders, served on /metrics
+    instrument_callbacks(app)
+    instrument_server(app.server, profile_dir=PROFILE_DIR)
+
+    # Registered after the instrumentation hooks so the recorded response sizes are the compressed ones
+    if COMPRESS_LEVEL:
+        enable_compression(app.server, level=COMPRESS_LEVEL)
+    if MULTI_SITE:
+        enable_site_routing(app.server, app.sites)
+    enable_exports(app.server, get_export_datasets, slots=EXPORT_SLOTS)
+
+    register_trend_callbacks(app)
+    register_downtime_callbacks(app)
+    if OVERVIEW_MODE != "classic":
+        register_scalable_overview_callbacks(app)
+    if SIMULATION:
+        register_simulation_callbacks(app)
+    if LAZY_TABS:
+        register_tab_callbacks(app)
+    register_overview_view_callbacks(app)
+    if ROLLUPS != "off":
+        register_period_callbacks(app)
+    if GAUGE_MODE != "html":
+        register_gauge_callbacks(app)
+    if LIVE_REFRESH_MS:
+        register_live_callbacks(app)
+    if ALERT_RULES != "off":
+        register_alert_callbacks(app)
+    if MATERIALS != "off":
+        register_material_callbacks(app)
+    if MULTI_SITE:
+        register_site_callbacks(app)
+
+    # A function, so the layout is built per page load with the current data and not on import
+    app.layout = create_layout
+    return app
+
+
+app = create_app()
+server = app.server
 
 # Run the app
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    app.run(debug=True)
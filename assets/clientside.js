@@ -0,0 +1,164 @@
+/* Clientside callbacks: presentation-only interactions that run in the browser on data
+   already sent, without a request to the server. Registered in app.py with
+   ClientsideFunction("oee", <name>). */
+
+(function () {
+    var noUpdate = function () {
+        return window.dash_clientside.no_update;
+    };
+
+    var HIGHLIGHT_COLOR = "#d62728";
+
+    // Copy of a figure with its own layout and trace objects, so changing them leaves
+    // the figure Dash holds untouched and the new one is seen as changed
+    function copyFigure(figure) {
+        return {
+            data: (figure.data || []).map(function (trace) { return Object.assign({}, trace); }),
+            layout: Object.assign({}, figure.layout || {}),
+        };
+    }
+
+    // Row indices of the overview data kept by the status filter, in the selected order
+    function selectRows(data, status, sort) {
+        var rows = [];
+        for (var i = 0; i < data.step.length; i++) {
+            if (status === "all" || data.status[i] === status) {
+                rows.push(i);
+            }
+        }
+        var value = function (i) {
+            return data.oee[i] === null ? -Infinity : data.oee[i];
+        };
+        if (sort === "oee-desc") {
+            rows.sort(function (a, b) { return value(b) - value(a); });
+        } else if (sort === "oee-asc") {
+            rows.sort(function (a, b) { return value(a) - value(b); });
+        } else if (sort === "step") {
+            rows.sort(function (a, b) { return String(data.step[a]).localeCompare(String(data.step[b])); });
+        }
+        return rows;
+    }
+
+    // Shows only `categories` on a category axis, in their order. The trace arrays keep
+    // their order so live patches addressing them by index stay valid.
+    function orderAxis(layout, name, categories, all) {
+        var axis = Object.assign({}, layout[name]);
+        if (all === null) {
+            axis.categoryorder = "trace";
+            delete axis.categoryarray;
+            axis.autorange = true;
+            delete axis.range;
+        } else {
+            var shown = {};
+            categories.forEach(function (category) { shown[category] = true; });
+            axis.categoryorder = "array";
+            axis.categoryarray = categories.concat(all.filter(function (category) { return !shown[category]; }));
+            axis.autorange = false;
+            axis.range = [-0.5, Math.max(categories.length, 1) - 0.5];
+        }
+        layout[name] = axis;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        oee: {
+            // Status filter, sort order, OEE target highlight and units per hour for the
+            // overview charts, from the columns in the overview-data store
+            applyOverviewView: function (status, sort, units, target, data, oeeFigure, uptimeFigure, progressFigure, unitsFigure, failureFigure) {
+                if (!data) {
+                    return [noUpdate(), noUpdate(), noUpdate(), noUpdate(), noUpdate()];
+                }
+                var rows = selectRows(data, status, sort);
+                var unchanged = status === "all" && sort === "order";
+                var categories = rows.map(function (i) { return data.step[i]; });
+                var all = unchanged ? null : data.step;
+
+                var figures = [oeeFigure, uptimeFigure, progressFigure, unitsFigure, failureFigure].map(copyFigure);
+                [0, 3, 4].forEach(function (i) { orderAxis(figures[i].layout, "xaxis", categories, all); });
+                [1, 2].forEach(function (i) { orderAxis(figures[i].layout, "yaxis", categories, all); });
+
+                // Bars below the OEE target in red, with the target as a dashed line
+                var oee = figures[0];
+                var hasTarget = target !== null && target !== undefined && target !== "";
+                oee.data[0].marker = Object.assign({}, oee.data[0].marker, {
+                    color: hasTarget
+                        ? data.oee.map(function (value) { return value !== null && value < target ? HIGHLIGHT_COLOR : "#008080"; })
+                        : "#008080",
+                });
+                oee.layout.shapes = hasTarget
+                    ? [{type: "line", xref: "paper", x0: 0, x1: 1, y0: target, y1: target, line: {color: HIGHLIGHT_COLOR, dash: "dash"}}]
+                    : [];
+
+                var unitsChart = figures[3];
+                var perHour = units === "per-hour";
+                unitsChart.data[0].y = data.units.map(function (value, i) {
+                    if (!perHour) {
+                        return value;
+                    }
+                    return data.run_time[i] ? value / data.run_time[i] : null;
+                });
+                unitsChart.layout.yaxis = Object.assign({}, unitsChart.layout.yaxis, {
+                    title: {text: perHour ? "Units per Hour of Run Time" : "Units Produced"},
+                });
+                return figures;
+            },
+
+            // Traces of the spider chart shown for the selected processes, all when none is selected
+            showSpiderTraces: function (selected, figure) {
+                if (!figure) {
+                    return noUpdate();
+                }
+                var shown = {};
+                (selected || []).forEach(function (step) { shown[step] = true; });
+                var copy = copyFigure(figure);
+                copy.data.forEach(function (trace) {
+                    trace.visible = !selected || !selected.length || shown[trace.name] ? true : "legendonly";
+                });
+                return copy;
+            },
+
+            // Threshold marker and bar colour of the KPI gauges of a process tab: bars below
+            // the target are drawn red. Status dials and other traces are left alone.
+            highlightGauges: function (target) {
+                // The gauge figures are the last argument, after the live data version if any
+                var figures = arguments[arguments.length - 1];
+                var hasTarget = target !== null && target !== undefined && target !== "";
+                return figures.map(function (figure) {
+                    if (!figure) {
+                        return noUpdate();
+                    }
+                    var copy = copyFigure(figure);
+                    copy.data.forEach(function (trace) {
+                        if (trace.type !== "indicator" || !trace.gauge) {
+                            return;
+                        }
+                        var below = hasTarget && trace.value !== null && trace.value < target;
+                        trace.gauge = Object.assign({}, trace.gauge, {
+                            bar: Object.assign({}, trace.gauge.bar, {color: below ? HIGHLIGHT_COLOR : "darkblue"}),
+                            threshold: Object.assign({}, trace.gauge.threshold, {value: hasTarget ? target : 100}),
+                        });
+                    });
+                    return copy;
+                });
+            },
+
+            // Tabs of a lazily rendered tab bar to build for the selected one: the selected
+            // tab and its neighbours that were not rendered yet. Switching between tabs
+            // already rendered does not reach the server.
+            requestTabs: function (value, rendered, settings) {
+                var selected = parseInt(value.split("-")[1], 10);
+                var wanted = [];
+                for (var i = selected - settings.prefetch; i <= selected + settings.prefetch; i++) {
+                    if (i >= 0 && i < settings.tabs && (rendered || []).indexOf(i) < 0) {
+                        wanted.push(i);
+                    }
+                }
+                return wanted.length ? wanted : noUpdate();
+            },
+
+            // Page of the site chosen in the site picker ("/" for the roll-up of all sites)
+            selectSite: function (path, current) {
+                return path && path !== current ? path : noUpdate();
+            },
+        },
+    });
+})();
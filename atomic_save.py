@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+
+# Write a saved directory through `write(path)` into a fresh directory next to it, then
+# swap it into place. Loaded data memory-maps the files of the directory, so writing
+# over them would truncate the files being read from; the replaced files are unlinked
+# instead and their maps stay valid. A failed write leaves the previous save untouched.
+def replace_directory(directory, write):
+    directory = os.path.abspath(directory)
+    parent, name = os.path.split(directory)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=f".{name}-", suffix=".tmp")
+    try:
+        write(staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.chmod(staging, 0o755)
+    if os.path.exists(directory):
+        previous = staging + ".old"
+        os.rename(directory, previous)
+        os.rename(staging, directory)
+        shutil.rmtree(previous, ignore_errors=True)
+    else:
+        os.rename(staging, directory)
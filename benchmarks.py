@@ -0,0 +1,315 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+# Plant sizes benchmarked by default, in stations
+SIZES = (10, 100, 1000, 10000)
+# Relative slowdown (or growth in memory or payload) reported as a regression by compare
+DEFAULT_THRESHOLD = 0.15
+# Metrics compared between runs
+COMPARED = ("median_ms", "peak_kib", "payload_bytes")
+# Benchmarks whose warm-up call takes longer than this are timed once instead of `repeat` times
+SLOW_MS = 2000
+# Largest plant some builders are run for; the plant KPI grid draws four indicators
+# per station and takes minutes beyond this
+LIMITS = {"create_plant_kpi_grid": 1000}
+
+
+# (name, function) pairs timed for the store the app loaded. Builders reading the whole
+# plant take no arguments; per-process ones are called for the first process.
+def get_benchmarks(app):
+    process = app.get_site().store.record(0)
+    benchmarks = [
+        ("app_layout", app.create_layout),
+        ("create_overview_layout", app.create_overview_layout),
+        ("create_scalable_overview_layout", app.create_scalable_overview_layout),
+        ("create_process_layout", lambda: app.create_process_layout(process)),
+        ("create_oee_summary_chart", app.create_oee_summary_chart),
+        ("create_spider_chart", app.create_spider_chart),
+        ("create_downtime_uptime_chart", app.create_downtime_uptime_chart),
+        ("create_stacked_bar_chart", app.create_stacked_bar_chart),
+        ("create_units_bar_chart", app.create_units_bar_chart),
+        ("create_downtime_failure_chart", app.create_downtime_failure_chart),
+        ("create_plant_kpi_grid", app.create_plant_kpi_grid),
+        ("create_metric_gauges", lambda: app.create_metric_gauges(process)),
+        ("create_gauge_charts", lambda: app.create_gauge_charts(process)),
+        ("create_kpi_indicator_grid", lambda: app.create_kpi_indicator_grid([process])),
+        ("create_material_pie_chart", lambda: app.create_material_pie_chart(process["material_used"], process["waste_material"])),
+        ("create_runtime_pie_chart", lambda: app.create_runtime_pie_chart(process["run_time"], process["expected_time"])),
+    ]
+    rollups = app.get_rollups()
+    if rollups is not None:
+        store = app.get_site().store
+        # Refresh ticks one second apart
+        clock = itertools.count(int(time.time()))
+        benchmarks += [
+            # One refresh folded into the shift, day and week sums
+            ("rollups_add", lambda: rollups.add(next(clock), store)),
+            # Columns of a period as read by the period selectors, uncached
+            ("rollups_period_columns", lambda: len(rollups.period_columns("day", rollups.period_key("day"), store))),
+        ]
+    alerts = app.get_site().alert_worker
+    if alerts is not None:
+        store = app.get_site().store
+        clock = itertools.count(int(time.time()))
+        # One evaluation of every alert rule over the whole plant
+        benchmarks.append(("alerts_evaluate", lambda: len(alerts.engine.evaluate(next(clock), store))))
+    if app.get_materials() is not None:
+        benchmarks += [
+            # Material analysis over the longest range, read from the ledger's buckets
+            ("create_material_cards", lambda: app.create_material_cards("30d")),
+            ("create_scrap_pareto_chart", lambda: app.create_scrap_pareto_chart("30d", "process")),
+            ("create_yield_trend_chart", lambda: app.create_yield_trend_chart("30d", "Shift")),
+        ]
+    if app.simulator is not None:
+        parameters = app.get_simulation_parameters(0)
+        # The what-if tab's default run: 1000 shifts of the first route
+        benchmarks.append(("simulate_shifts", lambda: len(app.simulator.run(parameters, 8 * 3600, app.SIMULATION_REPLICATIONS)["throughput"])))
+    return benchmarks
+
+
+# Time one benchmark: best and median of `repeat` calls after a warm-up call, peak
+# Python memory of one traced call and the size of its result as sent to the browser
+def measure(function, repeat):
+    from plotly.io.json import to_json_plotly
+
+    started = time.perf_counter()
+    result = function()
+    if (time.perf_counter() - started) * 1000 > SLOW_MS:
+        repeat = 1
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "peak_kib": round(peak / 1024, 1),
+        "payload_bytes": len(to_json_plotly(result)),
+    }
+
+
+# Runs inside a fresh interpreter per plant size, so the app module loads the
+# synthetic data source and memory use is not shared between sizes
+def run_worker(stations, repeat, only):
+    started = time.perf_counter()
+    import app
+    import_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    app.start_worker()
+    start_ms = (time.perf_counter() - started) * 1000
+    # Wait for the data built in the background so it does not compete with the builders
+    app.load_deferred()
+
+    results = [
+        {"stations": stations, "name": name, "min_ms": round(ms, 3), "median_ms": round(ms, 3)}
+        for name, ms in (("import_app", import_ms), ("start_worker", start_ms))
+    ]
+    for name, function in get_benchmarks(app):
+        if (only and name not in only) or stations > LIMITS.get(name, stations):
+            continue
+        results.append({"stations": stations, "name": name, **measure(function, repeat)})
+        print(f"{stations:>6} {name:<34} {results[-1]['median_ms']:>10.2f} ms", file=sys.stderr)
+    json.dump(results, sys.stdout)
+
+
+# Boot of a worker in a fresh interpreter, run once as a plain worker and once preloaded.
+# Plain: importing the app, then its start and first page (the layout and the overview
+# tab, waiting for the deferred data). Preloaded: the master's import with warm_up, then
+# a worker forked from it until it has started and built the same page.
+def run_boot_worker(stations):
+    results = {}
+    started = time.perf_counter()
+    import app
+    if os.environ.get("OEE_PRELOAD", "0") != "1":
+        results["boot_import"] = time.perf_counter() - started
+        started = time.perf_counter()
+        app.start_worker()
+        app.create_layout()
+        app.create_tab_content(0)
+        results["boot_first_page"] = time.perf_counter() - started
+    else:
+        app.warm_up()
+        results["boot_preload_master"] = time.perf_counter() - started
+        read_fd, write_fd = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            app.start_worker()
+            app.create_layout()
+            app.create_tab_content(0)
+            os.write(write_fd, b"1")
+            os._exit(0)
+        os.read(read_fd, 1)
+        results["boot_preloaded_worker"] = time.perf_counter() - started
+        os.waitpid(pid, 0)
+    json.dump({name: seconds * 1000 for name, seconds in results.items()}, sys.stdout)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_env(args):
+    env = dict(os.environ)
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    return env
+
+
+def run(args):
+    env = get_env(args)
+    # Builders are measured uncached unless asked otherwise
+    env.setdefault("OEE_FIGURE_CACHE", "off")
+
+    results = []
+    for stations in args.sizes:
+        worker_env = dict(env, OEE_DATA_SOURCE=f"synthetic:{stations}")
+        command = [sys.executable, os.path.abspath(__file__), "worker", str(stations), "--repeat", str(args.repeat)]
+        for name in args.only:
+            command += ["--only", name]
+        output = subprocess.run(command, env=worker_env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        sys.stderr.write(output.stderr)
+        if output.returncode:
+            raise SystemExit(f"Benchmark worker for {stations} stations failed")
+        results.extend(json.loads(output.stdout))
+    write_report(args, env, results)
+
+
+# Startup benchmark: `repeat` plain and preloaded worker boots per plant size, each in its
+# own interpreter so nothing is imported or built already
+def boot(args):
+    env = get_env(args)
+    results = []
+    for stations in args.sizes:
+        timings = {}
+        for _ in range(args.repeat):
+            for preload in ("0", "1"):
+                worker_env = dict(env, OEE_DATA_SOURCE=f"synthetic:{stations}", OEE_PRELOAD=preload)
+                command = [sys.executable, os.path.abspath(__file__), "boot-worker", str(stations)]
+                output = subprocess.run(command, env=worker_env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+                if output.returncode:
+                    sys.stderr.write(output.stderr)
+                    raise SystemExit(f"Boot benchmark for {stations} stations failed")
+                for name, ms in json.loads(output.stdout).items():
+                    timings.setdefault(name, []).append(ms)
+        for name, values in timings.items():
+            results.append({"stations": stations, "name": name, "min_ms": round(min(values), 3), "median_ms": round(statistics.median(values), 3)})
+            print(f"{stations:>6} {name:<34} {results[-1]['median_ms']:>10.2f} ms", file=sys.stderr)
+    write_report(args, env, results)
+
+
+def write_report(args, env, results):
+    report = {
+        "meta": {
+            "commit": get_git_commit(),
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "env": {key: value for key, value in env.items() if key.startswith("OEE_") and key != "OEE_DATA_SOURCE"},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+
+# Print the change of every metric between two reports and exit with status 1 when
+# any grew by more than the threshold
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {(row["stations"], row["name"]): row for row in json.load(f)["results"]}
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'stations':>8} {'benchmark':<34} {'metric':<14} {'baseline':>12} {'current':>12} {'change':>8}")
+    for row in current:
+        previous = baseline.get((row["stations"], row["name"]))
+        if previous is None:
+            continue
+        for metric in COMPARED:
+            if metric not in row or metric not in previous:
+                continue
+            old, new = previous[metric], row[metric]
+            change = (new - old) / old if old else 0.0
+            # Tiny timings are dominated by noise, only flag them past a millisecond
+            regressed = change > args.threshold and not (metric == "median_ms" and new - old < 1)
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{row['stations']:>8} {row['name']:<34} {metric:<14} {old:>12g} {new:>12g} {change:>+8.1%}{flag}")
+
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    raise SystemExit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark layout construction, figure builders and payload sizes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark synthetic plants and write a JSON report")
+    run_parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=list(SIZES))
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--only", action="append", default=[], help="benchmark name, may be repeated")
+    run_parser.add_argument("--env", action="append", default=[], help="OEE_* setting for the app, e.g. OEE_GAUGE_MODE=grid")
+    run_parser.add_argument("--output", help="report file, stdout by default")
+
+    boot_parser = commands.add_parser("boot", help="benchmark worker startup, plain and preloaded, and write a JSON report")
+    boot_parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=list(SIZES))
+    boot_parser.add_argument("--repeat", type=int, default=3)
+    boot_parser.add_argument("--env", action="append", default=[], help="OEE_* setting for the app, e.g. OEE_LOT_TRACKING=off")
+    boot_parser.add_argument("--output", help="report file, stdout by default")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    worker_parser = commands.add_parser("worker")
+    worker_parser.add_argument("stations", type=int)
+    worker_parser.add_argument("--repeat", type=int, default=5)
+    worker_parser.add_argument("--only", action="append", default=[])
+
+    boot_worker_parser = commands.add_parser("boot-worker")
+    boot_worker_parser.add_argument("stations", type=int)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "boot":
+        boot(args)
+    elif args.command == "compare":
+        compare(args)
+    elif args.command == "boot-worker":
+        run_boot_worker(args.stations)
+    else:
+        run_worker(args.stations, args.repeat, args.only)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from process_store import get_routes, load_store
+
+
+# Cycle time in seconds of stations whose route has none to go by
+DEFAULT_CYCLE_TIME = 60.0
+# Availability of stations whose route reports none, e.g. every station stopped
+DEFAULT_AVAILABILITY = 0.9
+# Mean repair time in seconds of stations without recorded failures
+DEFAULT_MTTR = 600.0
+# Coefficient of variation of the cycle times
+DEFAULT_CYCLE_CV = 0.1
+# Width in seconds of the windows the bottleneck is picked in, to see it shift over a shift
+WINDOW_SECONDS = 3600
+# Units in the line at most, per station, unless a simulation sets its own limit
+WIP_PER_STATION = 2
+
+
+# Parameters of the stations of one route of `store`, in stage order: mean cycle time
+# (run time per unit, else the ideal cycle time), availability, and mean time between
+# failures and to repair in seconds. `mttr` gives measured repair times per station of
+# the store (NaN where unknown); MTBF follows from availability = MTBF / (MTBF + MTTR).
+# Stations without figures take the median of their route.
+def chain_parameters(store, route, mttr=None):
+    routes = get_routes(store)
+    stations = np.flatnonzero(routes["route"] == route)
+    stations = stations[np.argsort(routes["stage"][stations], kind="stable")]
+
+    def per_station(values, default):
+        values = values[stations]
+        known = np.isfinite(values) & (values > 0)
+        fill = np.median(values[known]) if known.any() else default
+        return np.where(known, values, fill)
+
+    run_time = store.values("run_time", fill=np.nan).astype(np.float64)
+    units = store.values("units", fill=np.nan).astype(np.float64)
+    ideal_cycle_time = store.values("ideal_cycle_time", fill=np.nan).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cycle_time = np.where(units > 0, run_time * 3600 / units, np.nan)
+    cycle_time = np.where(np.isnan(cycle_time), ideal_cycle_time * 3600, cycle_time)
+    availability = np.minimum(store.values("availability", fill=np.nan).astype(np.float64) / 100, 0.999)
+
+    mttr = per_station(np.full(len(store), np.nan) if mttr is None else np.asarray(mttr, dtype=np.float64), DEFAULT_MTTR)
+    availability = per_station(availability, DEFAULT_AVAILABILITY)
+    return {
+        "stations": stations,
+        "steps": store.column("step")[stations].tolist(),
+        "cycle_time": per_station(cycle_time, DEFAULT_CYCLE_TIME),
+        "cycle_cv": np.full(len(stations), DEFAULT_CYCLE_CV),
+        "mtbf": mttr * availability / (1 - availability),
+        "mttr": mttr,
+    }
+
+
+# Copy of `parameters` with the station at `position` faster by `speed` percent (its
+# cycle time divided by 1 + speed / 100) and running at `availability` percent
+def apply_scenario(parameters, position, speed=0, availability=None):
+    changed = {name: value.copy() if isinstance(value, np.ndarray) else value for name, value in parameters.items()}
+    changed["cycle_time"][position] /= 1 + speed / 100
+    if availability is not None:
+        share = min(max(availability / 100, 0.001), 0.999)
+        changed["mtbf"][position] = changed["mttr"][position] * share / (1 - share)
+    return changed
+
+
+# Process times of a block of units on one station, a row per replication: lognormal cycle
+# times plus the repairs of the failures hitting them. Failures come after exponential
+# running time, a Poisson process over the station's running time: their number is drawn
+# per replication, they fall uniformly over it, and each adds an exponential repair to the
+# unit running at the time.
+def _process_times(rng, shape, cycle_time, cycle_cv, mtbf, mttr):
+    sigma = np.sqrt(np.log1p(cycle_cv ** 2))
+    times = cycle_time * np.exp(sigma * rng.standard_normal(shape) - sigma ** 2 / 2)
+    running = np.cumsum(times, axis=1)
+    rows = np.repeat(np.arange(shape[0]), rng.poisson(running[:, -1] / mtbf))
+    if len(rows):
+        # Rows apart on one axis, so one search finds the unit of every failure
+        span = np.arange(shape[0]) * (running[:, -1].max() + 1)
+        points = rng.random(len(rows)) * running[rows, -1] + span[rows]
+        units = np.searchsorted((running + span[:, None]).ravel(), points, side="right")
+        np.add.at(times.ravel(), units, rng.exponential(mttr, len(units)))
+    return times
+
+
+# One chunk of replications of a shift of `seconds` starting with an empty line. Units are
+# released onto the first station whenever fewer than `wip_limit` are in the line (CONWIP)
+# and go through the stations in order, queueing in front of each. A station's departures
+# are D[i] = max(arrived[i], D[i - 1]) + p[i], solved for many units at once as a running
+# maximum: unit i is released when unit i - wip_limit leaves, so the units of a block of
+# `wip_limit` only depend on the block before and a whole block is simulated per station.
+def simulate_chunk(parameters, seconds, replications, seed, wip_limit):
+    rng = np.random.default_rng(seed)
+    n_stations = len(parameters["cycle_time"])
+    edges = np.append(np.arange(0, seconds, WINDOW_SECONDS), seconds)
+    n_windows = len(edges) - 1
+    rows = np.arange(replications)[:, None] * (n_windows + 1)
+
+    # Window of each time, n_windows past the end of the shift
+    def window_of(times):
+        return np.where(times < seconds, np.minimum((times * (1 / WINDOW_SECONDS)).astype(np.int64), n_windows - 1), n_windows)
+
+    throughput = np.zeros(replications, dtype=np.int64)
+    station_wip = np.zeros((replications, n_stations))
+    window_active = np.zeros((replications, n_stations, n_windows))
+    # Departure of the last unit each station processed
+    free = np.zeros((replications, n_stations))
+    released = np.zeros((replications, wip_limit))
+    while released.min() < seconds:
+        arrived = released
+        for position in range(n_stations):
+            station = {name: parameters[name][position] for name in ("cycle_time", "cycle_cv", "mtbf", "mttr")}
+            process = _process_times(rng, arrived.shape, **station)
+            offset = np.zeros(arrived.shape)
+            offset[:, 1:] = np.cumsum(process[:, :-1], axis=1)
+            earliest = arrived - offset
+            earliest[:, 0] = np.maximum(earliest[:, 0], free[:, position])
+            started = offset + np.maximum.accumulate(earliest, axis=1)
+            departed = started + process
+            free[:, position] = departed[:, -1]
+
+            # Time in [0, seconds) the units spent at the station, queued or processed, and
+            # in process per window, the station's active time including repairs. A unit
+            # processed within one window counts there whole, the few crossing the end of
+            # a window are split.
+            station_wip[:, position] += (np.minimum(departed, seconds) - np.minimum(arrived, seconds)).sum(axis=1)
+            first, last = window_of(started), window_of(departed)
+            inside = first == last
+            by_window = np.bincount((rows + first)[inside], weights=process[inside], minlength=replications * (n_windows + 1))
+            window_active[:, position] += by_window.reshape(replications, n_windows + 1)[:, :n_windows]
+            crossing = np.nonzero(~inside)
+            busy = np.clip(edges - started[crossing][:, None], 0, process[crossing][:, None])
+            np.add.at(window_active[:, position], crossing[0], np.diff(busy, axis=1))
+            arrived = departed
+        throughput += (arrived <= seconds).sum(axis=1)
+        released = arrived
+
+    # The bottleneck is the most active station, over the shift and in each window
+    active = window_active.sum(axis=2)
+    return {
+        "throughput": throughput,
+        "wip": station_wip.sum(axis=1) / seconds,
+        "station_wip": station_wip / seconds,
+        "active": active / seconds,
+        "bottleneck": active.argmax(axis=1),
+        "window_bottleneck": window_active.argmax(axis=1),
+    }
+
+
+def _simulate_job(job):
+    return simulate_chunk(*job)
+
+
+class Simulator:
+    # Runs the replications of a simulation in chunks, spread over a pool of `workers`
+    # processes started on first use, or in the calling thread with a single worker.
+    # Workers come from a fork server where available: forking a server process with
+    # ingest and alert threads running could copy a held lock into the child.
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    # Results of `replications` shifts of `seconds`, one array per measure with a row per
+    # replication. The same seed gives the same random numbers to every scenario, so two
+    # scenarios differ by their parameters rather than by chance.
+    def run(self, parameters, seconds, replications, seed=0, wip_limit=None):
+        wip_limit = wip_limit or WIP_PER_STATION * len(parameters["cycle_time"])
+        chunk = -(-replications // self.workers)
+        sizes = [min(chunk, replications - start) for start in range(0, replications, chunk)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        jobs = [(parameters, seconds, size, chunk_seed, wip_limit) for size, chunk_seed in zip(sizes, seeds)]
+        if len(jobs) == 1:
+            results = [_simulate_job(job) for job in jobs]
+        else:
+            results = list(self._get_pool().map(_simulate_job, jobs))
+        return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+
+# Means and spread of a simulation's results: throughput (units per shift, with its
+# 5th and 95th percentiles), WIP, per-station WIP and active share, the share of
+# replications and of windows each station was the bottleneck in, and how often the
+# bottleneck moved from one window to the next
+def summarise(results, n_stations):
+    throughput = results["throughput"]
+    windows = results["window_bottleneck"]
+    return {
+        "throughput": float(throughput.mean()),
+        "throughput_low": float(np.percentile(throughput, 5)),
+        "throughput_high": float(np.percentile(throughput, 95)),
+        "throughput_error": float(1.96 * throughput.std(ddof=1) / np.sqrt(len(throughput))) if len(throughput) > 1 else 0.0,
+        "wip": float(results["wip"].mean()),
+        "station_wip": results["station_wip"].mean(axis=0),
+        "active": results["active"].mean(axis=0) * 100,
+        "bottleneck_share": np.bincount(results["bottleneck"], minlength=n_stations) * 100 / len(throughput),
+        "window_bottleneck_share": np.bincount(windows.ravel(), minlength=n_stations) * 100 / windows.size,
+        "bottleneck_shifts": float((windows[:, 1:] != windows[:, :-1]).sum(axis=1).mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate shifts of a route of the plant, as is and with one station changed.")
+    parser.add_argument("--source", default="sample", help="data source, e.g. synthetic:1000")
+    parser.add_argument("--route", type=int, default=0)
+    parser.add_argument("--step", help="station to change, the route's first by default")
+    parser.add_argument("--speed", type=float, default=10, help="percent faster")
+    parser.add_argument("--availability", type=float, default=None, help="percent")
+    parser.add_argument("--hours", type=float, default=8)
+    parser.add_argument("--replications", type=int, default=1000)
+    parser.add_argument("--wip-limit", type=int, default=None, help=f"units in the line at most, {WIP_PER_STATION} per station by default")
+    parser.add_argument("--workers", type=int, default=None, help="processes, defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    parameters = chain_parameters(load_store(args.source), args.route)
+    position = parameters["steps"].index(args.step) if args.step else 0
+    scenario = apply_scenario(parameters, position, args.speed, args.availability)
+    simulator = Simulator(args.workers)
+    for name, chosen in (("As is", parameters), (f"{parameters['steps'][position]} changed", scenario)):
+        started = time.perf_counter()
+        summary = summarise(simulator.run(chosen, args.hours * 3600, args.replications, wip_limit=args.wip_limit), len(parameters["steps"]))
+        print(
+            f"{name}: {summary['throughput']:.1f} units per shift (90% within {summary['throughput_low']:.0f}-{summary['throughput_high']:.0f}), "
+            f"WIP {summary['wip']:.1f}, bottleneck {parameters['steps'][int(summary['bottleneck_share'].argmax())]}, "
+            f"{summary['bottleneck_shifts']:.2f} bottleneck shifts, {time.perf_counter() - started:.2f}s"
+        )
+    simulator.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import gzip
+
+import flask
+
+
+# Responses smaller than this are sent as they are
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+
+
+# Gzip responses of the Flask server for clients accepting it: callback responses,
+# the layout and the component bundles. Streamed responses (files, exports) are left alone.
+def enable_compression(server, level=6, min_bytes=MIN_COMPRESS_BYTES):
+    @server.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)
+            or "gzip" not in flask.request.headers.get("Accept-Encoding", "")
+        ):
+            return response
+
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+
+        response.set_data(gzip.compress(body, compresslevel=level))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
@@ -0,0 +1,254 @@
+import csv
+import datetime
+import io
+import threading
+
+import flask
+import numpy as np
+
+from downtime_log import PLANNED_REASONS
+from history_store import HISTORY_METRICS
+from process_store import COLUMNS, NUMERIC_COLUMNS
+
+# pyarrow is optional, only needed for Parquet exports
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Rows per streamed chunk: an export holds one chunk in memory, whatever its length
+CHUNK_ROWS = 10000
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# Seconds a client turned away because every export slot is busy is asked to wait
+RETRY_AFTER = 30
+# Bounds of an open time range, in epoch seconds
+NO_START, NO_END = 0, 2 ** 62
+
+
+# Epoch seconds, or an ISO 8601 date or time (UTC unless it has an offset)
+def parse_time(text):
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid time {text!r}, expected epoch seconds or YYYY-MM-DD[THH:MM[:SS]]") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+# Filters of an export request: repeated step and lot parameters, start and end times
+def parse_filters(args):
+    steps = args.getlist("step") or None
+    try:
+        lots = [int(lot) for lot in args.getlist("lot")] or None
+    except ValueError:
+        raise ValueError("Lots are numbers") from None
+    start = parse_time(args["start"]) if "start" in args else None
+    end = parse_time(args["end"]) if "end" in args else None
+    if start is not None and end is not None and end <= start:
+        raise ValueError("The export ends before it starts")
+    return {"steps": steps, "lots": lots, "start": start, "end": end}
+
+
+def _times(seconds, unit="s"):
+    scale = {"s": 1, "ms": 1000}[unit]
+    seconds = np.asarray(seconds, dtype=np.float64)
+    times = np.round(np.nan_to_num(seconds) * scale).astype(np.int64).astype(f"datetime64[{unit}]")
+    times[np.isnan(seconds)] = np.datetime64("NaT")
+    return times
+
+
+# Datasets: each returns its columns and a generator of column chunks, after checking the
+# filters so a bad request fails before anything is streamed
+
+# Current values of every process
+def export_processes(store, steps=None, lots=None, start=None, end=None):
+    if start is not None or end is not None:
+        raise ValueError("Processes hold the current values, export the history for a time range")
+    rows = np.ones(len(store), dtype=bool)
+    if steps is not None:
+        rows &= np.isin(store.column("step"), steps)
+    if lots is not None:
+        rows &= ~store.missing("lot") & np.isin(store.values("lot"), lots)
+
+    def chunks():
+        selected = np.flatnonzero(rows)
+        for offset in range(0, len(selected), CHUNK_ROWS):
+            chunk_rows = selected[offset:offset + CHUNK_ROWS]
+            chunk = {}
+            for name in COLUMNS:
+                values = store.column(name)[chunk_rows]
+                chunk[name] = np.ma.array(values, mask=store.missing(name)[chunk_rows]) if name in NUMERIC_COLUMNS else values
+            yield chunk
+
+    return list(COLUMNS), chunks()
+
+
+# Snapshots of the trend history, one row per process and time
+def export_history(history, steps=None, lots=None, start=None, end=None):
+    if lots is not None:
+        raise ValueError("The history is not recorded per lot, filter downtime or lots by lot instead")
+
+    def chunks():
+        for chunk in history.iter_rows(
+            NO_START if start is None else start, NO_END if end is None else end, steps, chunk_rows=CHUNK_ROWS,
+        ):
+            yield {"time": _times(chunk.pop("timestamp")), **chunk}
+
+    return ["time", "step", *HISTORY_METRICS], chunks()
+
+
+# Closed downtime events that started in the time range
+def export_downtime(log, steps=None, lots=None, start=None, end=None):
+    machines = None if steps is None else [log.machine_index(step) for step in steps if log.machine_index(step) is not None]
+    names = np.array(log.machines, dtype=object)
+    reasons = np.array([reason or "Unspecified" for reason in log.reasons], dtype=object)
+    planned = np.isin(log.reasons, PLANNED_REASONS)
+
+    def chunks():
+        for chunk in log.iter_events(
+            machines, lots, -np.inf if start is None else start, np.inf if end is None else end, chunk_rows=CHUNK_ROWS,
+        ):
+            yield {
+                "start": _times(chunk["start"], "ms"),
+                "end": _times(chunk["end"], "ms"),
+                "duration": chunk["end"] - chunk["start"],
+                "step": names[chunk["machine"]],
+                "reason": reasons[chunk["reason"]],
+                "planned": planned[chunk["reason"]],
+                "lot": np.ma.masked_less(chunk["lot"], 0),
+            }
+
+    return ["start", "end", "duration", "step", "reason", "planned", "lot"], chunks()
+
+
+# Lot moves onto the stations, with the station each lot came from
+def export_lot_moves(tracker, steps=None, lots=None, start=None, end=None):
+    stations = None if steps is None else [tracker.stations.index(step) for step in steps if step in tracker.stations]
+    names = np.array(tracker.stations + [None], dtype=object)
+
+    def chunks():
+        for chunk in tracker.iter_moves(
+            stations, lots, -np.inf if start is None else start, np.inf if end is None else end, chunk_rows=CHUNK_ROWS,
+        ):
+            yield {
+                "time": _times(chunk["time"], "ms"),
+                "lot": chunk["lot"],
+                "step": names[chunk["station"]],
+                # -1 picks the trailing None: released onto the station
+                "from_step": names[chunk["previous"]],
+            }
+
+    return ["time", "lot", "step", "from_step"], chunks()
+
+
+# A chunk column as Python values for the CSV writer, None for missing ones
+def _csv_values(column):
+    if np.ma.isMaskedArray(column):
+        return np.where(np.ma.getmaskarray(column), None, column.data.astype(object)).tolist()
+    if np.issubdtype(column.dtype, np.datetime64):
+        text = np.datetime_as_string(column, unit="s", timezone="UTC")
+        return np.where(np.isnat(column), None, text).tolist()
+    if np.issubdtype(column.dtype, np.floating):
+        return np.where(np.isnan(column), None, column.astype(object)).tolist()
+    return column.tolist()
+
+
+def iter_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(zip(*(_csv_values(chunk[name]) for name in columns)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _Spool(io.RawIOBase):
+    # Write-only file collecting what the Parquet writer wrote since the last drain()
+
+    def __init__(self):
+        self._pieces = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._pieces)
+        self._pieces = []
+        return data
+
+
+# One row group per chunk, each sent as soon as it is written
+def iter_parquet(columns, chunks):
+    def to_arrow(column):
+        if np.ma.isMaskedArray(column):
+            return pyarrow.array(column.data, mask=np.ma.getmaskarray(column))
+        if np.issubdtype(column.dtype, np.datetime64):
+            return pyarrow.array(column, type=pyarrow.timestamp(np.datetime_data(column.dtype)[0], tz="UTC"))
+        return pyarrow.array(column, from_pandas=True)
+
+    spool = _Spool()
+    writer = None
+    for chunk in chunks:
+        table = pyarrow.table({name: to_arrow(chunk[name]) for name in columns})
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(spool, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        yield spool.drain()
+    if writer is None:
+        # Nothing matched: a file with the columns and no rows
+        writer = pyarrow.parquet.ParquetWriter(spool, pyarrow.schema([(name, pyarrow.null()) for name in columns]))
+    writer.close()
+    yield spool.drain()
+
+
+def _text_response(message, status, **headers):
+    return flask.Response(message + "\n", status=status, mimetype="text/plain", headers=headers)
+
+
+# Serve /export/<dataset>.<csv|parquet> on the Flask server, with the datasets returned by
+# get_datasets() for the request ({name: function(steps, lots, start, end)} as above).
+# Filters: step and lot (repeatable), start and end. Exports stream chunk by chunk; at
+# most `slots` run at once in each process, further ones are answered 503 so long
+# downloads never take every request thread from the dashboard.
+def enable_exports(server, get_datasets, slots=1):
+    exporting = threading.BoundedSemaphore(slots)
+
+    @server.route("/export/<dataset>.<file_format>")
+    def export(dataset, file_format):
+        datasets = get_datasets()
+        if dataset not in datasets or file_format not in FORMATS:
+            return _text_response(f"Unknown export {dataset}.{file_format}, available: {', '.join(datasets)} as {' or '.join(FORMATS)}", 404)
+        if file_format == "parquet" and pyarrow is None:
+            return _text_response("Parquet exports need pyarrow, export as CSV instead", 501)
+        try:
+            columns, chunks = datasets[dataset](**parse_filters(flask.request.args))
+        except ValueError as error:
+            return _text_response(str(error), 400)
+
+        if not exporting.acquire(blocking=False):
+            return _text_response("Every export slot is busy, try again shortly", 503, **{"Retry-After": str(RETRY_AFTER)})
+        body = iter_csv(columns, chunks) if file_format == "csv" else iter_parquet(columns, chunks)
+        response = flask.Response(body, mimetype=FORMATS[file_format])
+        response.headers["Content-Disposition"] = f'attachment; filename="{dataset}.{file_format}"'
+        # Released once the download finished or the client went away
+        response.call_on_close(exporting.release)
+        return response
@@ -0,0 +1,436 @@
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from atomic_save import replace_directory
+from ingest import DOWNTIME_REASONS, STATE
+from shift_calendar import DEFAULT_SHIFTS, ShiftCalendar
+
+
+# Shifts of logs given no calendar, in UTC. Aggregates are kept per shift of the calendar.
+DEFAULT_CALENDAR = ShiftCalendar.from_spec(DEFAULT_SHIFTS, utc_offset=0)
+# Planned stops count as downtime but not as failures for MTBF and MTTR
+PLANNED_REASONS = ("Changeover", "Maintenance")
+# Events appended since the last index rebuild are scanned directly up to this many
+MAX_TAIL = 65536
+FIELDS = {"start": np.float64, "end": np.float64, "machine": np.int32, "reason": np.int16, "lot": np.int64}
+# Aggregate keys pack (machine, shift, reason) into one sortable integer. The reason
+# field is as wide as the int16 reason column, so every code it can hold fits.
+SHIFT_BITS = 24
+REASON_BITS = 16
+MAX_REASONS = np.iinfo(FIELDS["reason"]).max + 1
+
+
+def _aggregate_key(machine, shift, reason):
+    return (machine.astype(np.int64) << (SHIFT_BITS + REASON_BITS)) | (shift.astype(np.int64) << REASON_BITS) | reason
+
+
+class DowntimeLog:
+    # Append-only log of downtime events (start, end, machine, reason code, lot; lot -1
+    # when unknown) held as columns. Indexes by machine, start time and reason and the
+    # per-(machine, shift, reason) aggregates cover the first `_indexed` events; the
+    # tail appended since is scanned directly and folded in once it reaches MAX_TAIL.
+    # Events are attributed to the shift of `calendar` they started in (the last one
+    # started before them between shifts). Stops still going on are kept per machine as
+    # open events and counted up to the query time.
+
+    def __init__(self, machines, reasons=DOWNTIME_REASONS, calendar=DEFAULT_CALENDAR):
+        self.machines = list(machines)
+        self.reasons = list(reasons)
+        if len(self.reasons) > MAX_REASONS:
+            raise ValueError(f"A downtime log holds at most {MAX_REASONS} reasons, got {len(self.reasons)}")
+        self.calendar = calendar
+        self._machine_index = {machine: number for number, machine in enumerate(self.machines)}
+        self._failure = np.array([reason not in PLANNED_REASONS for reason in self.reasons])
+
+        self._columns = {name: np.empty(0, dtype) for name, dtype in FIELDS.items()}
+        self.size = 0
+        n = len(self.machines)
+        self.open_start = np.full(n, np.nan)
+        self.open_reason = np.zeros(n, dtype=np.int16)
+        self.open_lot = np.full(n, -1, dtype=np.int64)
+
+        self._indexed = 0
+        self._by_machine = self._machine_offsets = None
+        self._by_start = None
+        self._by_reason = self._reason_offsets = None
+        self._aggregate_keys = np.empty(0, dtype=np.int64)
+        self._aggregate_count = np.empty(0, dtype=np.int64)
+        self._aggregate_duration = np.empty(0)
+        self._lock = threading.RLock()
+        self._rebuild()
+
+    def __len__(self):
+        return self.size
+
+    def machine_index(self, machine):
+        return self._machine_index.get(machine)
+
+    def column(self, name):
+        return self._columns[name][:self.size]
+
+    def shift_of(self, timestamp):
+        return self.calendar.shift_of(timestamp)
+
+    # Start times of the events of shifts [first_shift, last_shift] lie in [start, end)
+    def _window(self, first_shift, last_shift):
+        return self.calendar.period_bounds("shift", first_shift)[0], self.calendar.period_bounds("shift", last_shift + 1)[0]
+
+    # Append closed events given as arrays of equal length
+    def append(self, start, end, machine, reason, lot=None):
+        start = np.asarray(start, dtype=np.float64)
+        if lot is None:
+            lot = np.full(len(start), -1)
+        values = {"start": start, "end": end, "machine": machine, "reason": reason, "lot": lot}
+        with self._lock:
+            needed = self.size + len(start)
+            for name, dtype in FIELDS.items():
+                column = self._columns[name]
+                if needed > len(column) or not column.flags.writeable:
+                    # Grow by doubling; also copies columns memory-mapped by load()
+                    grown = np.empty(max(needed, 2 * len(column), 1024), dtype)
+                    grown[:self.size] = column[:self.size]
+                    self._columns[name] = column = grown
+                column[self.size:needed] = values[name]
+            self.size = needed
+            if self.size - self._indexed >= MAX_TAIL:
+                self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            n = self.size
+            start, end = self.column("start"), self.column("end")
+            machine, reason = self.column("machine"), self.column("reason")
+
+            self._by_machine = np.lexsort((start, machine))
+            self._machine_offsets = np.searchsorted(machine[self._by_machine], np.arange(len(self.machines) + 1))
+            self._by_start = np.argsort(start, kind="stable")
+            self._by_reason = np.lexsort((start, reason))
+            self._reason_offsets = np.searchsorted(reason[self._by_reason], np.arange(len(self.reasons) + 1))
+
+            keys = _aggregate_key(machine, self.calendar.shift_keys(start), reason)
+            self._aggregate_keys, inverse = np.unique(keys, return_inverse=True)
+            self._aggregate_count = np.bincount(inverse, minlength=len(self._aggregate_keys))
+            self._aggregate_duration = np.bincount(inverse, weights=end - start, minlength=len(self._aggregate_keys))
+            self._indexed = n
+
+    # Row numbers of events of `machine` (or every machine) and `reason` (or any) that
+    # started in [start, end), using the narrowest index
+    def rows(self, machine=None, reason=None, start=-np.inf, end=np.inf):
+        with self._lock:
+            starts = self.column("start")
+            if machine is not None:
+                candidates = self._by_machine[self._machine_offsets[machine]:self._machine_offsets[machine + 1]]
+            elif reason is not None:
+                candidates = self._by_reason[self._reason_offsets[reason]:self._reason_offsets[reason + 1]]
+            else:
+                candidates = self._by_start
+            # Indexed slices are sorted by start, so the window is a binary search
+            low, high = np.searchsorted(starts[candidates], [start, end])
+            candidates = candidates[low:high]
+
+            tail = np.arange(self._indexed, self.size)
+            keep = (starts[tail] >= start) & (starts[tail] < end)
+            if machine is not None:
+                keep &= self.column("machine")[tail] == machine
+            if reason is not None:
+                keep &= self.column("reason")[tail] == reason
+            rows = np.concatenate((candidates, tail[keep]))
+            if machine is not None and reason is not None:
+                rows = rows[self.column("reason")[rows] == reason]
+            return rows
+
+    # Downtime seconds and event counts per reason for shifts [first_shift, last_shift]
+    # from the aggregates, the tail and open events; machine None covers the plant
+    def totals_by_reason(self, machine, first_shift, last_shift, now=None):
+        n_reasons = len(self.reasons)
+        with self._lock:
+            keys = self._aggregate_keys
+            if machine is not None:
+                low, high = np.searchsorted(keys, [
+                    _aggregate_key(np.int64(machine), np.int64(first_shift), 0),
+                    _aggregate_key(np.int64(machine), np.int64(last_shift + 1), 0),
+                ])
+                selected = np.arange(low, high)
+            else:
+                shifts = (keys >> REASON_BITS) & ((1 << SHIFT_BITS) - 1)
+                selected = np.flatnonzero((shifts >= first_shift) & (shifts <= last_shift))
+            reasons = keys[selected] & ((1 << REASON_BITS) - 1)
+            # bincount of nothing is integer even with weights
+            durations = np.bincount(reasons, weights=self._aggregate_duration[selected], minlength=n_reasons).astype(np.float64)
+            counts = np.bincount(reasons, weights=self._aggregate_count[selected], minlength=n_reasons).astype(np.float64)
+
+            window_start, window_end = self._window(first_shift, last_shift)
+            tail = np.arange(self._indexed, self.size)
+            starts = self.column("start")[tail]
+            keep = (starts >= window_start) & (starts < window_end)
+            if machine is not None:
+                keep &= self.column("machine")[tail] == machine
+            tail = tail[keep]
+            tail_reasons = self.column("reason")[tail]
+            durations += np.bincount(tail_reasons, weights=self.column("end")[tail] - self.column("start")[tail], minlength=n_reasons)
+            counts += np.bincount(tail_reasons, minlength=n_reasons)
+
+            now = time.time() if now is None else now
+            open_rows = np.flatnonzero((self.open_start >= window_start) & (self.open_start < window_end))
+            if machine is not None:
+                open_rows = open_rows[open_rows == machine]
+            durations += np.bincount(self.open_reason[open_rows], weights=now - self.open_start[open_rows], minlength=n_reasons)
+            counts += np.bincount(self.open_reason[open_rows], minlength=n_reasons)
+        return durations, counts.astype(np.int64)
+
+    # Reasons sorted by lost time, with the cumulative share of the total in %
+    def pareto(self, machine, first_shift, last_shift, now=None):
+        durations, counts = self.totals_by_reason(machine, first_shift, last_shift, now)
+        order = np.argsort(-durations, kind="stable")
+        order = order[durations[order] > 0]
+        total = durations.sum()
+        cumulative = np.cumsum(durations[order]) * 100 / total if total else np.zeros(len(order))
+        return {
+            "reasons": [self.reasons[reason] or "Unspecified" for reason in order.tolist()],
+            "durations": durations[order],
+            "counts": counts[order],
+            "cumulative": cumulative,
+        }
+
+    # Failure statistics over shifts [first_shift, last_shift]: planned stops are excluded,
+    # MTBF is the time not lost to failures per failure and MTTR the lost time per failure
+    def reliability(self, machine, first_shift, last_shift, now=None):
+        now = time.time() if now is None else now
+        durations, counts = self.totals_by_reason(machine, first_shift, last_shift, now)
+        failures = int(counts[self._failure].sum())
+        downtime = float(durations[self._failure].sum())
+        window_start, window_end = self._window(first_shift, last_shift)
+        window = min(window_end, now) - window_start
+        window *= len(self.machines) if machine is None else 1
+        return {
+            "failures": failures,
+            "downtime": downtime,
+            "planned_downtime": float(durations[~self._failure].sum()),
+            "mtbf": (window - downtime) / failures if failures else None,
+            "mttr": downtime / failures if failures else None,
+        }
+
+    # The n longest events of a machine that started within the shifts, longest first
+    def top_losses(self, machine, first_shift, last_shift, n=10, now=None):
+        now = time.time() if now is None else now
+        window_start, window_end = self._window(first_shift, last_shift)
+        with self._lock:
+            rows = self.rows(machine, start=window_start, end=window_end)
+            starts = self.column("start")[rows]
+            durations = self.column("end")[rows] - starts
+            reasons = self.column("reason")[rows]
+            lots = self.column("lot")[rows]
+            if window_start <= self.open_start[machine] < window_end:
+                starts = np.append(starts, self.open_start[machine])
+                durations = np.append(durations, now - self.open_start[machine])
+                reasons = np.append(reasons, self.open_reason[machine])
+                lots = np.append(lots, self.open_lot[machine])
+
+        if len(durations) > n:
+            selected = np.argpartition(-durations, n)[:n]
+        else:
+            selected = np.arange(len(durations))
+        selected = selected[np.argsort(-durations[selected], kind="stable")]
+        return [
+            {
+                "start": start,
+                "duration": duration,
+                "reason": self.reasons[reason] or "Unspecified",
+                "lot": lot if lot >= 0 else None,
+            }
+            for start, duration, reason, lot in zip(
+                starts[selected].tolist(), durations[selected].tolist(), reasons[selected].tolist(), lots[selected].tolist()
+            )
+        ]
+
+    # Closed events of `machines` and `lots` (all when None) that started in [start, end),
+    # in the order they were logged, as column chunks of events scanned `chunk_rows` at a
+    # time. Only views of the columns are held, so memory does not grow with the log.
+    def iter_events(self, machines=None, lots=None, start=-np.inf, end=np.inf, chunk_rows=65536):
+        with self._lock:
+            columns = {name: self.column(name) for name in FIELDS}
+        for offset in range(0, len(columns["start"]), chunk_rows):
+            chunk = {name: column[offset:offset + chunk_rows] for name, column in columns.items()}
+            keep = (chunk["start"] >= start) & (chunk["start"] < end)
+            if machines is not None:
+                keep &= np.isin(chunk["machine"], machines)
+            if lots is not None:
+                keep &= np.isin(chunk["lot"], lots)
+            if keep.any():
+                yield {name: column[keep] for name, column in chunk.items()}
+
+    # Write the columns as .npy files with an index that load() reads back. The directory
+    # is replaced as a whole, so it can be the one this log was loaded from.
+    def save(self, directory):
+        replace_directory(directory, self._write)
+
+    def _write(self, directory):
+        with self._lock:
+            for name in FIELDS:
+                np.save(os.path.join(directory, f"{name}.npy"), self.column(name))
+            index = {
+                "machines": self.machines,
+                "reasons": self.reasons,
+                "open": [
+                    [int(machine), float(self.open_start[machine]), int(self.open_reason[machine]), int(self.open_lot[machine])]
+                    for machine in np.flatnonzero(~np.isnan(self.open_start)).tolist()
+                ],
+            }
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    # Memory-maps the columns saved by save(); appending copies them into memory. The
+    # aggregates are rebuilt for `calendar`, so a log can be loaded under other shifts.
+    @classmethod
+    def load(cls, directory, machines=None, calendar=DEFAULT_CALENDAR):
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        log = cls(index["machines"], index["reasons"], calendar)
+        for name in FIELDS:
+            log._columns[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        log.size = len(log._columns["start"])
+        for machine, start, reason, lot in index["open"]:
+            log.open_start[machine], log.open_reason[machine], log.open_lot[machine] = start, reason, lot
+        log._rebuild()
+        return log.for_machines(machines) if machines is not None else log
+
+    # The same events renumbered for another list of machines, e.g. after stations were
+    # added to the data source; events of machines no longer listed are dropped
+    def for_machines(self, machines):
+        if list(machines) == self.machines:
+            return self
+        log = DowntimeLog(machines, self.reasons, self.calendar)
+        mapping = np.array([log._machine_index.get(machine, -1) for machine in self.machines], dtype=np.int64)
+        machine = mapping[self.column("machine")] if len(self.machines) else np.empty(0, dtype=np.int64)
+        keep = machine >= 0
+        log.append(self.column("start")[keep], self.column("end")[keep], machine[keep], self.column("reason")[keep], self.column("lot")[keep])
+        for old, new in enumerate(mapping.tolist()):
+            if new >= 0:
+                log.open_start[new], log.open_reason[new], log.open_lot[new] = self.open_start[old], self.open_reason[old], self.open_lot[old]
+        log._rebuild()
+        return log
+
+
+class DowntimeRecorder:
+    # IngestService listener turning running/stopped state events into downtime events.
+    # A stop opens an event, the next start closes it with the station's downtime reason
+    # and lot at that time.
+
+    def __init__(self, log, service):
+        self.log = log
+        self.service = service
+        self.running = service.running.copy()
+        stopped = np.flatnonzero(~self.running)
+        log.open_start[stopped] = service.last_change[stopped]
+
+    def __call__(self, batch):
+        rows = batch["kind"] == STATE
+        if not rows.any():
+            return
+        stations = batch["station"][rows]
+        timestamps = batch["timestamp"][rows]
+        states = batch["value"][rows] > 0
+        order = np.lexsort((timestamps, stations))
+        stations, timestamps, states = stations[order], timestamps[order], states[order]
+
+        first = np.ones(len(stations), dtype=bool)
+        first[1:] = stations[1:] != stations[:-1]
+        previous = np.where(first, self.running[stations], np.roll(states, 1))
+        changes = states != previous
+        stations, timestamps, states, first = stations[changes], timestamps[changes], states[changes], first[changes]
+        if not len(stations):
+            return
+
+        # Changes of a station alternate between stop and start
+        same_station_next = np.zeros(len(stations), dtype=bool)
+        same_station_next[:-1] = stations[1:] == stations[:-1]
+        log = self.log
+        with log._lock:
+            # Starts closing an event opened before this batch: the station's first change
+            has_previous = np.roll(same_station_next, 1)
+            closing = np.flatnonzero(states & ~has_previous & ~np.isnan(log.open_start[stations]))
+            # Stops closed by the next change of the same station within the batch
+            paired = np.flatnonzero(~states & same_station_next)
+            # Stops still open at the end of the batch
+            opening = np.flatnonzero(~states & ~same_station_next)
+
+            machines = np.concatenate((stations[closing], stations[paired]))
+            log.append(
+                np.concatenate((log.open_start[stations[closing]], timestamps[paired])),
+                np.concatenate((timestamps[closing], timestamps[paired + 1])),
+                machines,
+                self.service.reason[machines],
+                np.where(self.service.lot_missing[machines], -1, self.service.lot[machines]),
+            )
+            log.open_start[stations[closing]] = np.nan
+            log.open_start[stations[opening]] = timestamps[opening]
+            log.open_reason[stations[opening]] = self.service.reason[stations[opening]]
+            log.open_lot[stations[opening]] = np.where(self.service.lot_missing[stations[opening]], -1, self.service.lot[stations[opening]])
+
+        last = np.ones(len(stations), dtype=bool)
+        last[:-1] = ~same_station_next[:-1]
+        self.running[stations[last]] = states[last]
+
+
+# Random downtime history for `machines` over the last `days`, about events_per_day
+# stops per machine with log-normal durations, for demos and benchmarks
+def generate_synthetic(machines, days=30, events_per_day=6, seed=0, now=None, calendar=DEFAULT_CALENDAR):
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    n_machines, n_events = len(machines), int(days * events_per_day)
+    mean_gap = 86400 / events_per_day
+    durations = np.minimum(rng.lognormal(np.log(600), 1.0, (n_machines, n_events)), mean_gap / 2)
+    gaps = rng.exponential(mean_gap - durations.mean(), (n_machines, n_events))
+    starts = now - days * 86400 + np.cumsum(gaps + durations, axis=1) - durations
+    # Reason 0 (unspecified) is rare, breakdowns and changeovers common
+    weights = np.array([0.02, 0.3, 0.25, 0.15, 0.1, 0.1, 0.08])[:len(DOWNTIME_REASONS)]
+    reasons = rng.choice(len(DOWNTIME_REASONS), size=(n_machines, n_events), p=weights / weights.sum())
+
+    ended = starts + durations < now
+    log = DowntimeLog(machines, calendar=calendar)
+    log.append(
+        starts[ended],
+        (starts + durations)[ended],
+        np.broadcast_to(np.arange(n_machines)[:, None], starts.shape)[ended],
+        reasons[ended],
+        20000 + rng.integers(0, 5000, int(ended.sum())),
+    )
+    log._rebuild()
+    return log
+
+
+# Import events from a CSV file with start, end (epoch seconds or ISO dates), machine
+# (the process step), reason (name) and optionally lot columns
+def load_csv(path, machines, calendar=DEFAULT_CALENDAR):
+    log = DowntimeLog(machines, calendar=calendar)
+    reasons = {reason: number for number, reason in enumerate(log.reasons)}
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row["machine"] in log._machine_index]
+
+    def to_seconds(values):
+        try:
+            return np.array(values, dtype=np.float64)
+        except ValueError:
+            return np.array(values, dtype="datetime64[s]").astype(np.float64)
+
+    for row in rows:
+        if row["reason"] not in reasons:
+            if len(log.reasons) == MAX_REASONS:
+                raise ValueError(f"{path} has more than the {MAX_REASONS} reasons a downtime log holds")
+            reasons[row["reason"]] = len(log.reasons)
+            log.reasons.append(row["reason"])
+    log._failure = np.array([reason not in PLANNED_REASONS for reason in log.reasons])
+    log.append(
+        to_seconds([row["start"] for row in rows]),
+        to_seconds([row["end"] for row in rows]),
+        [log._machine_index[row["machine"]] for row in rows],
+        [reasons[row["reason"]] for row in rows],
+        [int(row["lot"]) if row.get("lot") else -1 for row in rows],
+    )
+    log._rebuild()
+    return log
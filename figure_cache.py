@@ -0,0 +1,198 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+# Default size of the in-process tier
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _key_string(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class DiskBackend:
+    # Shared tier on a local directory, used by every gunicorn worker on the host.
+    # Files are written atomically and the oldest are pruned past max_bytes.
+
+    def __init__(self, directory, max_bytes=4 * DEFAULT_MAX_BYTES, prune_every=100):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, _key_string(key) + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+
+        self._puts += 1
+        if self._puts % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class RedisBackend:
+    # Shared tier on Redis (or anything speaking its protocol), entries expire after ttl seconds
+
+    def __init__(self, url, ttl=3600):
+        # redis is optional, only needed for this backend
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get("oee-figure:" + _key_string(key))
+        return value.decode() if value is not None else None
+
+    def set(self, key, value):
+        self.client.set("oee-figure:" + _key_string(key), value, ex=self.ttl)
+
+
+class FigureCache:
+    # Size-bounded LRU of serialised figures, optionally backed by a shared tier.
+    # Keys are (builder name, process step, data version) tuples.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, backend=None):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # Called as on_build(key, serialised value, serialisation seconds) for every built figure
+        self.on_build = None
+        # Figure to JSON string and back, replaceable by faster implementations
+        self.serialise = serialise
+        self.loads = json.loads
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    # Serialised figure for key, building and storing it with build() on a miss.
+    # Returns plain dicts (or a list of them) ready to hand to dcc.Graph.
+    def get_or_build(self, key, build):
+        value = self.get(key)
+        if value is None:
+            figure = build()
+            started = time.perf_counter()
+            value = self.serialise(figure)
+            if self.on_build is not None:
+                self.on_build(key, value, time.perf_counter() - started)
+            self.set(key, value)
+        return self.loads(value)
+
+    # Build a cache from a spec: "memory", "disk:<directory>", "redis://..." or "off"
+    @classmethod
+    def from_spec(cls, spec="memory", max_bytes=DEFAULT_MAX_BYTES):
+        if spec == "off":
+            return None
+        if spec == "memory":
+            return cls(max_bytes)
+        if spec.startswith("disk:"):
+            return cls(max_bytes, DiskBackend(spec[len("disk:"):]))
+        if spec.startswith(("redis://", "rediss://", "unix://")):
+            return cls(max_bytes, RedisBackend(spec))
+        raise ValueError(f"Unknown figure cache '{spec}', expected memory, disk:<dir>, redis://... or off")
+
+
+# A figure, or list of figures, as a JSON string
+def serialise(figure):
+    if isinstance(figure, list):
+        return "[" + ",".join(serialise(item) for item in figure) + "]"
+    if isinstance(figure, dict):
+        return json.dumps(figure)
+    return figure.to_json()
+
+
+# Decorator caching a figure builder in `cache`. Builders without arguments read the
+# whole data set and are keyed on version(); builders taking a process record or
+# scalars are keyed on the step and a hash of their arguments.
+def cached_builder(cache, version):
+    def decorator(builder):
+        if cache is None:
+            return builder
+
+        @functools.wraps(builder)
+        def wrapper(*args):
+            if args:
+                step = args[0].get("step", "") if isinstance(args[0], dict) else ""
+                key = (builder.__name__, step, _key_string(args))
+            else:
+                key = (builder.__name__, "", version())
+            return cache.get_or_build(key, lambda: builder(*args))
+
+        return wrapper
+
+    return decorator
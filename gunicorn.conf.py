@@ -0,0 +1,30 @@
+import os
+
+
+# gunicorn settings of the dashboard: gunicorn -c gunicorn.conf.py -w 4 app:server
+#
+# Importing the app loads no data. Each worker loads its sites and starts its threads in
+# post_worker_init. With OEE_PRELOAD=1 (or --preload) the master imports the app once and
+# builds the data and the overview (app.warm_up) before forking, so every worker starts in
+# milliseconds and shares that memory copy-on-write.
+# python load_test.py sweep measures worker and thread counts on this machine.
+preload_app = os.environ.get("OEE_PRELOAD", "0") == "1"
+# Request threads per worker. A streamed data export holds its thread for as long as the
+# client downloads, the other threads keep serving the dashboard (see OEE_EXPORT_SLOTS).
+threads = int(os.environ.get("OEE_THREADS", "4"))
+
+
+# Runs in the master before the workers are forked
+def when_ready(server):
+    if server.cfg.preload_app:
+        import app
+
+        app.warm_up()
+
+
+# Threads do not survive the fork: each worker starts the ingest or takes part in the
+# shared state election once it has loaded the app
+def post_worker_init(worker):
+    import app
+
+    app.start_worker()
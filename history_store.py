@@ -0,0 +1,447 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from atomic_save import replace_directory
+
+
+# Rollup resolutions in seconds, kept up to date as points are appended
+RESOLUTIONS = {"1min": 60, "15min": 900, "1h": 3600, "1d": 86400}
+# Store columns recorded by append_snapshot
+HISTORY_METRICS = ("oee", "availability", "performance", "quality", "downtime", "units")
+# A rollup is used for a query when it has at most this many times max_points buckets,
+# the rest is done by LTTB so the shape of the curve is kept
+OVERSAMPLE = 4
+
+
+# Largest-Triangle-Three-Buckets downsampling of (x, y) to n_out points.
+# Keeps first and last points and, per bucket, the point spanning the largest
+# triangle with the previously selected point and the average of the next bucket.
+def lttb(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    x_float = x.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x_float[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+
+        areas = np.abs(
+            (x_float[previous] - average_x) * (y[start:end] - y[previous])
+            - (x_float[previous] - x_float[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return x[selected], y[selected]
+
+
+# Append `extra` after the first `size` rows of `array`, doubling capacity when full
+def _append(array, size, extra):
+    needed = size + len(extra)
+    if needed > len(array) or isinstance(array, np.memmap):
+        grown = np.empty((max(needed, 2 * len(array), 64),) + array.shape[1:], dtype=array.dtype)
+        grown[:size] = array[:size]
+        array = grown
+    array[size:needed] = extra
+    return array
+
+
+class _Rollup:
+    # Per-bucket sum, count, min and max at one resolution
+
+    FIELDS = ("starts", "sums", "counts", "mins", "maxs")
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.size = 0
+        self.starts = np.empty(0, dtype=np.int64)
+        self.sums = np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.mins = np.empty(0)
+        self.maxs = np.empty(0)
+
+    def add(self, timestamps, values):
+        buckets, inverse = np.unique(timestamps - timestamps % self.resolution, return_inverse=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(buckets))
+        counts = np.bincount(inverse, minlength=len(buckets))
+        mins = np.full(len(buckets), np.inf)
+        maxs = np.full(len(buckets), -np.inf)
+        np.minimum.at(mins, inverse, values)
+        np.maximum.at(maxs, inverse, values)
+
+        starts = self.starts[:self.size]
+        if isinstance(self.starts, np.memmap):
+            self._copy_to_memory()
+            starts = self.starts[:self.size]
+
+        # Buckets that already exist (the last one, or late data) are merged in place
+        positions = np.searchsorted(starts, buckets)
+        existing = positions < self.size
+        existing[existing] = starts[positions[existing]] == buckets[existing]
+        if existing.any():
+            at = positions[existing]
+            self.sums[at] += sums[existing]
+            self.counts[at] += counts[existing]
+            np.minimum.at(self.mins, at, mins[existing])
+            np.maximum.at(self.maxs, at, maxs[existing])
+
+        new = ~existing
+        if not new.any():
+            return
+        fresh = (buckets, sums, counts, mins, maxs)
+        if self.size == 0 or buckets[new][0] > starts[-1]:
+            # Common case: new buckets after the end, amortised append
+            for name, column in zip(self.FIELDS, fresh):
+                setattr(self, name, _append(getattr(self, name), self.size, column[new]))
+        else:
+            # Late data opening buckets in the middle, rebuild the arrays
+            for name, column in zip(self.FIELDS, fresh):
+                setattr(self, name, np.insert(getattr(self, name)[:self.size], positions[new], column[new]))
+        self.size += int(new.sum())
+
+    def _copy_to_memory(self):
+        for name in self.FIELDS:
+            setattr(self, name, np.array(getattr(self, name)[:self.size]))
+
+    def query(self, start, end):
+        starts = self.starts[:self.size]
+        lo, hi = np.searchsorted(starts, [start, end], side="left")
+        return starts[lo:hi], self.sums[lo:hi] / self.counts[lo:hi]
+
+
+class _Series:
+    # Raw points of one (step, metric) pair plus its rollups
+
+    def __init__(self):
+        self.size = 0
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0)
+        self.rollups = {name: _Rollup(resolution) for name, resolution in RESOLUTIONS.items()}
+
+    def append(self, timestamps, values):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+
+        if self.size and timestamps[0] < self.timestamps[self.size - 1]:
+            # Out-of-order points, merge into the sorted raw arrays
+            merged_timestamps = np.concatenate([self.timestamps[:self.size], timestamps])
+            merged_values = np.concatenate([self.values[:self.size], values])
+            order = np.argsort(merged_timestamps, kind="stable")
+            self.timestamps, self.values = merged_timestamps[order], merged_values[order]
+        else:
+            self.timestamps = _append(self.timestamps, self.size, timestamps)
+            self.values = _append(self.values, self.size, values)
+        self.size += len(timestamps)
+
+        for rollup in self.rollups.values():
+            rollup.add(timestamps, values)
+
+    # Query interface shared with _SnapshotFrame, `key` is unused for a single series
+    def count(self, key, start, end):
+        lo, hi = np.searchsorted(self.timestamps[:self.size], [start, end], side="left")
+        return hi - lo
+
+    def raw(self, key, start, end):
+        lo, hi = np.searchsorted(self.timestamps[:self.size], [start, end], side="left")
+        return self.timestamps[lo:hi], self.values[lo:hi]
+
+    def rollup(self, name, key, start, end):
+        return self.rollups[name].query(start, end)
+
+
+class _FrameRollup:
+    # Per-bucket sums and counts of whole snapshots, shaped (bucket, metric, step)
+
+    FIELDS = ("starts", "sums", "counts")
+
+    def __init__(self, resolution, shape):
+        self.resolution = resolution
+        self.size = 0
+        self.starts = np.empty(0, dtype=np.int64)
+        self.sums = np.empty((0,) + shape)
+        self.counts = np.empty((0,) + shape, dtype=np.int32)
+
+    def add(self, timestamp, row):
+        if isinstance(self.starts, np.memmap):
+            for name in self.FIELDS:
+                setattr(self, name, np.array(getattr(self, name)[:self.size]))
+
+        present = ~np.isnan(row)
+        values = np.where(present, row, 0)
+        bucket = timestamp - timestamp % self.resolution
+        position = int(np.searchsorted(self.starts[:self.size], bucket))
+
+        if position < self.size and self.starts[position] == bucket:
+            self.sums[position] += values
+            self.counts[position] += present
+        elif position == self.size:
+            self.starts = _append(self.starts, self.size, [bucket])
+            self.sums = _append(self.sums, self.size, values[np.newaxis])
+            self.counts = _append(self.counts, self.size, present[np.newaxis])
+            self.size += 1
+        else:
+            # Late snapshot opening a bucket in the middle
+            self.starts = np.insert(self.starts[:self.size], position, bucket)
+            self.sums = np.insert(self.sums[:self.size], position, values, axis=0)
+            self.counts = np.insert(self.counts[:self.size], position, present, axis=0)
+            self.size += 1
+
+    def query(self, key, start, end):
+        lo, hi = np.searchsorted(self.starts[:self.size], [start, end], side="left")
+        counts = self.counts[lo:hi, key[0], key[1]]
+        keep = counts > 0
+        return self.starts[lo:hi][keep], self.sums[lo:hi, key[0], key[1]][keep] / counts[keep]
+
+
+class _SnapshotFrame:
+    # Snapshots of a fixed list of steps stored as (time, metric, step) arrays, so a
+    # snapshot of the whole plant and all of its rollups take a few array operations.
+    # A new frame is started whenever the list of steps changes.
+
+    def __init__(self, steps, metrics):
+        self.steps = np.asarray(steps, dtype=object)
+        self.metrics = list(metrics)
+        self.step_index = {step: index for index, step in enumerate(self.steps.tolist())}
+        shape = (len(self.metrics), len(self.steps))
+        self.size = 0
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0,) + shape)
+        self.rollups = {name: _FrameRollup(resolution, shape) for name, resolution in RESOLUTIONS.items()}
+
+    def key(self, step, metric):
+        if step not in self.step_index or metric not in self.metrics:
+            return None
+        return self.metrics.index(metric), self.step_index[step]
+
+    def append(self, timestamp, row):
+        position = int(np.searchsorted(self.timestamps[:self.size], timestamp, side="right"))
+        if position == self.size:
+            self.timestamps = _append(self.timestamps, self.size, [timestamp])
+            self.values = _append(self.values, self.size, row[np.newaxis])
+        else:
+            self.timestamps = np.insert(self.timestamps[:self.size], position, timestamp)
+            self.values = np.insert(self.values[:self.size], position, row, axis=0)
+        self.size += 1
+
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, row)
+
+    def count(self, key, start, end):
+        lo, hi = np.searchsorted(self.timestamps[:self.size], [start, end], side="left")
+        return hi - lo
+
+    def raw(self, key, start, end):
+        lo, hi = np.searchsorted(self.timestamps[:self.size], [start, end], side="left")
+        values = self.values[lo:hi, key[0], key[1]]
+        keep = ~np.isnan(values)
+        return self.timestamps[lo:hi][keep], values[keep]
+
+    def rollup(self, name, key, start, end):
+        return self.rollups[name].query(key, start, end)
+
+
+class HistoryStore:
+    # Time series per process step and metric, with timestamps in epoch seconds.
+    # Whole-plant snapshots go into _SnapshotFrames, series appended point by point
+    # (e.g. backfills) into _Series; queries combine both.
+
+    def __init__(self, snapshot_interval=0):
+        self.snapshot_interval = snapshot_interval
+        self._series = {}
+        self._frames = []
+        self._last_snapshot = None
+        self._lock = threading.Lock()
+
+    def append(self, step, metric, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=np.int64).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(timestamps):
+            return
+        with self._lock:
+            series = self._series.setdefault((step, metric), _Series())
+            series.append(timestamps, values)
+
+    # Record the current value of every process for `metrics` at `timestamp`, at most
+    # once per snapshot_interval seconds. Cheap enough to call on every refresh tick.
+    def append_snapshot(self, timestamp, store, metrics=HISTORY_METRICS):
+        timestamp = int(timestamp)
+        if self._last_snapshot is not None and 0 <= timestamp - self._last_snapshot < self.snapshot_interval:
+            return
+        steps = store.column("step")
+        row = np.stack([store.values(metric, fill=np.nan).astype(np.float64) for metric in metrics])
+
+        with self._lock:
+            frame = self._frames[-1] if self._frames else None
+            if frame is None or frame.metrics != list(metrics) or not np.array_equal(frame.steps, steps):
+                frame = _SnapshotFrame(steps, metrics)
+                self._frames.append(frame)
+            frame.append(timestamp, row)
+            self._last_snapshot = timestamp
+
+    def _sources(self, step, metric):
+        sources = []
+        if (step, metric) in self._series:
+            sources.append((self._series[(step, metric)], None))
+        for frame in self._frames:
+            key = frame.key(step, metric)
+            if key is not None:
+                sources.append((frame, key))
+        return sources
+
+    # Points of one series between start and end (epoch seconds), at most max_points
+    # long. Returns (timestamps, values, resolution name).
+    def query(self, step, metric, start, end, max_points=1000):
+        start, end = int(start), int(end)
+        with self._lock:
+            sources = self._sources(step, metric)
+            if not sources:
+                return np.empty(0, dtype=np.int64), np.empty(0), "raw"
+
+            if sum(source.count(key, start, end) for source, key in sources) <= max_points * OVERSAMPLE:
+                name = "raw"
+                pieces = [source.raw(key, start, end) for source, key in sources]
+            else:
+                # Finest rollup that does not return far more points than can be shown
+                name = next(
+                    (name for name, resolution in RESOLUTIONS.items() if (end - start) / resolution <= max_points * OVERSAMPLE),
+                    "1d",
+                )
+                pieces = [source.rollup(name, key, start, end) for source, key in sources]
+
+        timestamps = np.concatenate([timestamps for timestamps, _ in pieces])
+        values = np.concatenate([values for _, values in pieces])
+        if len(pieces) > 1:
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        timestamps, values = lttb(timestamps, values, max_points)
+        return timestamps, values, name
+
+    # Raw points between start and end of `steps` (all when None) in chunks of about
+    # `chunk_rows` rows, as {"timestamp", "step", metric...} columns, one row per step and
+    # time. Snapshots come first, in time order, then series appended point by point,
+    # whose rows only hold their own metric. Chunks are built from views of the stored
+    # arrays, so memory does not grow with the range.
+    def iter_rows(self, start, end, steps=None, metrics=HISTORY_METRICS, chunk_rows=10000):
+        start, end = int(start), int(end)
+        with self._lock:
+            frames = []
+            for frame in self._frames:
+                lo, hi = np.searchsorted(frame.timestamps[:frame.size], [start, end], side="left")
+                columns = np.array([
+                    frame.step_index[step] for step in (frame.steps.tolist() if steps is None else steps)
+                    if step in frame.step_index
+                ], dtype=np.int64)
+                if hi > lo and len(columns):
+                    frames.append((frame, frame.timestamps[lo:hi], frame.values[lo:hi], columns))
+            series = [
+                (step, metric, *source.raw(None, start, end))
+                for (step, metric), source in self._series.items()
+                if (steps is None or step in steps) and metric in metrics
+            ]
+
+        for frame, timestamps, values, columns in frames:
+            positions = [frame.metrics.index(metric) if metric in frame.metrics else None for metric in metrics]
+            times_per_chunk = max(chunk_rows // len(columns), 1)
+            for offset in range(0, len(timestamps), times_per_chunk):
+                block = values[offset:offset + times_per_chunk][:, :, columns]
+                n_times = len(block)
+                chunk = {
+                    "timestamp": np.repeat(timestamps[offset:offset + n_times], len(columns)),
+                    "step": np.tile(frame.steps[columns], n_times),
+                }
+                for metric, position in zip(metrics, positions):
+                    chunk[metric] = block[:, position, :].ravel() if position is not None else np.full(n_times * len(columns), np.nan)
+                # Steps without any value at a time were not reporting then
+                keep = ~np.all(np.isnan(np.stack([chunk[metric] for metric in metrics])), axis=0)
+                yield {name: column[keep] for name, column in chunk.items()}
+
+        for step, metric, timestamps, values in series:
+            for offset in range(0, len(timestamps), chunk_rows):
+                n = len(timestamps[offset:offset + chunk_rows])
+                chunk = {"timestamp": timestamps[offset:offset + n], "step": np.full(n, step, dtype=object)}
+                for name in metrics:
+                    chunk[name] = values[offset:offset + n] if name == metric else np.full(n, np.nan)
+                yield chunk
+
+    def steps(self):
+        with self._lock:
+            steps = {step for step, _ in self._series}
+            for frame in self._frames:
+                steps.update(frame.step_index)
+        return sorted(steps)
+
+    # Write everything as .npy files that load() memory-maps back. The directory is
+    # replaced as a whole, so it can be the one this history was loaded from.
+    def save(self, directory):
+        replace_directory(directory, self._write)
+
+    def _write(self, directory):
+        index = {"series": [], "frames": []}
+        with self._lock:
+            for number, ((step, metric), series) in enumerate(self._series.items()):
+                path = os.path.join(directory, f"series-{number}")
+                os.makedirs(path, exist_ok=True)
+                np.save(os.path.join(path, "timestamps.npy"), series.timestamps[:series.size])
+                np.save(os.path.join(path, "values.npy"), series.values[:series.size])
+                for name, rollup in series.rollups.items():
+                    for field in _Rollup.FIELDS:
+                        np.save(os.path.join(path, f"{name}_{field}.npy"), getattr(rollup, field)[:rollup.size])
+                index["series"].append([step, metric, f"series-{number}"])
+
+            for number, frame in enumerate(self._frames):
+                path = os.path.join(directory, f"frame-{number}")
+                os.makedirs(path, exist_ok=True)
+                np.save(os.path.join(path, "timestamps.npy"), frame.timestamps[:frame.size])
+                np.save(os.path.join(path, "values.npy"), frame.values[:frame.size])
+                for name, rollup in frame.rollups.items():
+                    for field in _FrameRollup.FIELDS:
+                        np.save(os.path.join(path, f"{name}_{field}.npy"), getattr(rollup, field)[:rollup.size])
+                index["frames"].append([frame.steps.tolist(), frame.metrics, f"frame-{number}"])
+
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    @classmethod
+    def load(cls, directory, snapshot_interval=0):
+        history = cls(snapshot_interval)
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+
+        for step, metric, name in index["series"]:
+            path = os.path.join(directory, name)
+            series = _Series()
+            series.timestamps = np.load(os.path.join(path, "timestamps.npy"), mmap_mode="r")
+            series.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+            series.size = len(series.timestamps)
+            for resolution, rollup in series.rollups.items():
+                for field in _Rollup.FIELDS:
+                    setattr(rollup, field, np.load(os.path.join(path, f"{resolution}_{field}.npy"), mmap_mode="r"))
+                rollup.size = len(rollup.starts)
+            history._series[(step, metric)] = series
+
+        for steps, metrics, name in index["frames"]:
+            path = os.path.join(directory, name)
+            frame = _SnapshotFrame(steps, metrics)
+            frame.timestamps = np.load(os.path.join(path, "timestamps.npy"), mmap_mode="r")
+            frame.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+            frame.size = len(frame.timestamps)
+            for resolution, rollup in frame.rollups.items():
+                for field in _FrameRollup.FIELDS:
+                    setattr(rollup, field, np.load(os.path.join(path, f"{resolution}_{field}.npy"), mmap_mode="r"))
+                rollup.size = len(rollup.starts)
+            history._frames.append(frame)
+            history._last_snapshot = int(frame.timestamps[-1]) if frame.size else history._last_snapshot
+
+        return history
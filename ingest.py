@@ -0,0 +1,410 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+
+from oee_engine import compute_oee
+from process_store import get_routes
+
+
+# Event kinds. Every event is (timestamp, station index, kind, value):
+#   STATE     value 1 = running, 0 = stopped
+#   UNITS     value = units produced since the last event
+#   SCRAP     value = scrapped units since the last event
+#   REASON    value = index into IngestService.reasons of the current downtime reason
+#   LOT       value = lot number now on the station
+STATE, UNITS, SCRAP, REASON, LOT = range(5)
+KIND_NAMES = {"state": STATE, "units": UNITS, "scrap": SCRAP, "reason": REASON, "lot": LOT}
+
+DOWNTIME_REASONS = ["", "Breakdown", "Changeover", "Material Shortage", "Quality Check", "Maintenance", "No Operator"]
+# Ideal cycle time in seconds for stations whose data source does not provide one
+DEFAULT_IDEAL_CYCLE_TIME = 1.0
+
+
+# A batch of events as parallel arrays, the unit transports hand to the service
+def make_batch(timestamps, stations, kinds, values):
+    return {
+        "timestamp": np.asarray(timestamps, dtype=np.float64),
+        "station": np.asarray(stations, dtype=np.int64),
+        "kind": np.asarray(kinds, dtype=np.int8),
+        "value": np.asarray(values, dtype=np.float64),
+    }
+
+
+class IngestService:
+    # Keeps per-station counters and state for the stations of `base_store` and folds
+    # event batches into them with array operations. KPIs are recomputed for the stations
+    # whose counters or times a batch changed; snapshot() turns the state into a ProcessStore.
+
+    def __init__(self, base_store, transport, start_time=None):
+        self.base_store = base_store
+        self.transport = transport
+        self.stations = base_store.column("step").tolist()
+        self.reasons = list(DOWNTIME_REASONS)
+        # Callables receiving every applied batch, e.g. downtime or lot trackers
+        self.listeners = []
+
+        n = len(self.stations)
+        start_time = time.time() if start_time is None else start_time
+        self.running = base_store.column("status") == "Running"
+        self.last_change = np.full(n, start_time)
+        self.run_seconds = np.zeros(n)
+        self.down_seconds = np.zeros(n)
+        self.units = np.zeros(n, dtype=np.int64)
+        self.scrap = np.zeros(n, dtype=np.int64)
+        self.lot = base_store.values("lot").copy()
+        self.lot_missing = base_store.missing("lot").copy()
+        self.reason = np.zeros(n, dtype=np.int64)
+
+        ideal_cycle_time = base_store.values("ideal_cycle_time", fill=np.nan) * 3600
+        self.ideal_cycle_time = np.where(np.isnan(ideal_cycle_time), DEFAULT_IDEAL_CYCLE_TIME, ideal_cycle_time)
+        self.kpis = {name: np.zeros(n) for name in ("availability", "performance", "quality", "oee")}
+
+        self.events = 0
+        self.batches = 0
+        self.apply_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def apply(self, batch, now=None):
+        started = time.perf_counter()
+        with self._lock:
+            self._apply(batch, batch["timestamp"].max() if now is None and len(batch["timestamp"]) else now)
+        for listener in self.listeners:
+            listener(batch)
+        self.apply_seconds += time.perf_counter() - started
+
+    def _apply(self, batch, now):
+        n = len(self.stations)
+        stations, kinds, values = batch["station"], batch["kind"], batch["value"]
+        touched = np.zeros(n, dtype=bool)
+        touched[stations] = True
+
+        for kind, counter in ((UNITS, self.units), (SCRAP, self.scrap)):
+            rows = kinds == kind
+            if rows.any():
+                counter += np.bincount(stations[rows], weights=values[rows], minlength=n).astype(np.int64)
+
+        self._apply_state_changes(batch, kinds == STATE)
+
+        for kind, target in ((REASON, self.reason), (LOT, self.lot)):
+            rows = np.flatnonzero(kinds == kind)
+            if len(rows):
+                # The last event of the batch wins for each station
+                last = rows[::-1][np.unique(stations[rows][::-1], return_index=True)[1]]
+                target[stations[last]] = values[last]
+                if kind == LOT:
+                    self.lot_missing[stations[last]] = False
+
+        # Credit the time since the last change up to `now` to every station's current state,
+        # which changes the availability and performance of stations without events too
+        if now is not None:
+            elapsed = np.maximum(now - self.last_change, 0)
+            self.run_seconds += np.where(self.running, elapsed, 0)
+            self.down_seconds += np.where(self.running, 0, elapsed)
+            self.last_change = np.maximum(self.last_change, now)
+            touched |= elapsed > 0
+
+        self._update_kpis(np.flatnonzero(touched))
+        self.events += len(stations)
+        self.batches += 1
+
+    # Exact run/down time accounting for state events: each event closes the interval
+    # since the previous change of its station, credited to the state before it
+    def _apply_state_changes(self, batch, rows):
+        if not rows.any():
+            return
+        stations = batch["station"][rows]
+        timestamps = batch["timestamp"][rows]
+        states = batch["value"][rows] > 0
+
+        order = np.lexsort((timestamps, stations))
+        stations, timestamps, states = stations[order], timestamps[order], states[order]
+        first = np.ones(len(stations), dtype=bool)
+        first[1:] = stations[1:] != stations[:-1]
+
+        previous_time = np.where(first, self.last_change[stations], np.roll(timestamps, 1))
+        previous_state = np.where(first, self.running[stations], np.roll(states, 1))
+        durations = np.maximum(timestamps - previous_time, 0)
+
+        n = len(self.stations)
+        self.run_seconds += np.bincount(stations, weights=np.where(previous_state, durations, 0), minlength=n)
+        self.down_seconds += np.bincount(stations, weights=np.where(previous_state, 0, durations), minlength=n)
+
+        last = np.ones(len(stations), dtype=bool)
+        last[:-1] = stations[1:] != stations[:-1]
+        self.running[stations[last]] = states[last]
+        self.last_change[stations[last]] = np.maximum(self.last_change[stations[last]], timestamps[last])
+
+    def _update_kpis(self, rows):
+        if not len(rows):
+            return
+        kpis = compute_oee(
+            self.run_seconds[rows] + self.down_seconds[rows],
+            self.run_seconds[rows],
+            self.ideal_cycle_time[rows],
+            self.units[rows],
+            self.units[rows] - self.scrap[rows],
+        )
+        for name, values in self.kpis.items():
+            values[rows] = np.round(kpis[name], 2)
+
+    # Current state as a ProcessStore built on the base store's names and hierarchy
+    def snapshot(self):
+        with self._lock:
+            planned = self.run_seconds + self.down_seconds
+            downtime = np.divide(self.down_seconds * 100, planned, out=np.zeros(len(planned)), where=planned > 0)
+            return self.base_store.replace(
+                status=np.where(self.running, "Running", "Stopped"),
+                units=self.units.copy(),
+                good_units=self.units - self.scrap,
+                lot=np.where(self.lot_missing, np.nan, self.lot),
+                run_time=self.run_seconds / 3600,
+                planned_time=planned / 3600,
+                ideal_cycle_time=self.ideal_cycle_time / 3600,
+                downtime=np.round(downtime, 2),
+                **{name: values.copy() for name, values in self.kpis.items()},
+            )
+
+    async def run(self):
+        async for batch in self.transport.batches(self):
+            self.apply(batch)
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="oee-ingest", daemon=True)
+        thread.start()
+        return thread
+
+
+# Transports: objects with an async batches(service) generator of event batches
+
+class SimulatorTransport:
+    # Random machine events for every station at `rate` events per second in batches
+    # of `batch_size`. rate=0 generates as fast as possible, for load testing.
+
+    def __init__(self, rate=1000, batch_size=1000, max_events=None, seed=0):
+        self.rate = rate
+        self.batch_size = batch_size
+        self.max_events = max_events
+        self.rng = np.random.default_rng(seed)
+
+    # With `routes` (see process_store.get_routes) lot events follow the routes: a station
+    # that is empty, or the last of its route, pulls the lot of its predecessor, the first
+    # station of a route releases a new lot. Lot events that cannot happen become unit events.
+    def generate(self, n_stations, n_reasons, start, size, routes=None):
+        rng = self.rng
+        spacing = 1 / self.rate if self.rate else 1e-5
+        kinds = rng.choice([UNITS, SCRAP, STATE, REASON, LOT], size=size, p=[0.8, 0.05, 0.08, 0.04, 0.03])
+        stations = rng.integers(0, n_stations, size)
+        values = np.select(
+            [kinds == UNITS, kinds == SCRAP, kinds == STATE, kinds == REASON],
+            [rng.integers(1, 5, size), 1, rng.random(size) < 0.85, rng.integers(1, n_reasons, size)],
+            default=20000 + rng.integers(0, 5000, size),
+        ).astype(np.float64)
+        if routes is not None:
+            self._move_lots(kinds, stations, values, routes)
+        return make_batch(start + np.arange(size) * spacing, stations, kinds, values)
+
+    def _move_lots(self, kinds, stations, values, routes):
+        rows = np.flatnonzero(kinds == LOT)
+        kinds[rows], values[rows] = UNITS, 1
+        # At most one move per station and batch
+        rows = rows[np.unique(stations[rows], return_index=True)[1]]
+
+        # From the end of the routes backwards, so a lot pulled away empties its station
+        # before that station pulls the next one
+        stages = routes["stage"][stations[rows]]
+        for stage in range(int(stages.max(initial=-1)), -1, -1):
+            at = rows[stages == stage]
+            targets = stations[at]
+            possible = np.isnan(self.holding[targets]) | (routes["next"][targets] < 0)
+            if stage:
+                upstream = routes["previous"][targets]
+                possible &= ~np.isnan(self.holding[upstream])
+                lots = self.holding[upstream[possible]]
+                self.holding[upstream[possible]] = np.nan
+            else:
+                lots = self.next_lot + np.arange(possible.sum())
+                self.next_lot += len(lots)
+            self.holding[targets[possible]] = lots
+            kinds[at[possible]] = LOT
+            values[at[possible]] = lots
+
+    async def batches(self, service):
+        sent = 0
+        started = time.time()
+        next_timestamp = started
+        routes = get_routes(service.base_store)
+        # Lot on each station as the simulator moves them, a lot listed on several stations stays on the first
+        self.holding = np.full(len(service.stations), np.nan)
+        present = np.flatnonzero(~service.lot_missing)
+        first = present[np.unique(service.lot[present], return_index=True)[1]]
+        self.holding[first] = service.lot[first]
+        self.next_lot = int(np.nanmax(service.lot, initial=0)) + 1
+        while self.max_events is None or sent < self.max_events:
+            size = self.batch_size if self.max_events is None else min(self.batch_size, self.max_events - sent)
+            # Event time never goes backwards, even when batches are generated faster than real time
+            batch = self.generate(len(service.stations), len(service.reasons), max(time.time(), next_timestamp), size, routes)
+            next_timestamp = batch["timestamp"][-1] + (1 / self.rate if self.rate else 1e-5)
+            yield batch
+            sent += size
+            if self.rate:
+                # Pace to the target rate
+                await asyncio.sleep(max(0, started + sent / self.rate - time.time()))
+            else:
+                await asyncio.sleep(0)
+
+
+class FileReplayTransport:
+    # Replays a JSON-lines file of {"ts", "station", "kind", "value"} events, e.g. one
+    # written by record_simulation. speed=1 keeps the original pacing, 0 replays as
+    # fast as possible. Reason values may be given as names.
+
+    def __init__(self, path, batch_size=1000, speed=0):
+        self.path = path
+        self.batch_size = batch_size
+        self.speed = speed
+
+    async def batches(self, service):
+        index = {station: number for number, station in enumerate(service.stations)}
+        reasons = {reason: number for number, reason in enumerate(service.reasons)}
+        first_event = started = None
+
+        with open(self.path) as f:
+            while True:
+                lines = [line for line in (f.readline() for _ in range(self.batch_size)) if line.strip()]
+                if not lines:
+                    return
+                events = [json.loads(line) for line in lines]
+                events = [event for event in events if event["station"] in index]
+                if not events:
+                    continue
+
+                batch = make_batch(
+                    [event["ts"] for event in events],
+                    [index[event["station"]] for event in events],
+                    [KIND_NAMES[event["kind"]] for event in events],
+                    [reasons.get(event["value"], 0) if isinstance(event["value"], str) else event["value"] for event in events],
+                )
+                if self.speed:
+                    first_event = batch["timestamp"][0] if first_event is None else first_event
+                    started = time.time() if started is None else started
+                    delay = (batch["timestamp"][-1] - first_event) / self.speed - (time.time() - started)
+                    await asyncio.sleep(max(0, delay))
+                else:
+                    await asyncio.sleep(0)
+                yield batch
+
+
+class QueueTransport:
+    # In-process transport for other producers (an MQTT or OPC-UA client callback, a
+    # test): put() events from any thread, they are delivered in batches of up to
+    # batch_size or whatever arrived within flush_interval seconds.
+
+    def __init__(self, batch_size=1000, flush_interval=0.1):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._events = []
+        self._lock = threading.Lock()
+
+    def put(self, timestamp, station, kind, value):
+        with self._lock:
+            self._events.append((timestamp, station, kind, value))
+
+    async def batches(self, service):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            with self._lock:
+                events, self._events = self._events, []
+            for start in range(0, len(events), self.batch_size):
+                chunk = events[start:start + self.batch_size]
+                yield make_batch(*zip(*chunk))
+
+
+class MqttTransport(QueueTransport):
+    # Subscribes to `topic` on an MQTT broker; payloads are JSON events as read by
+    # FileReplayTransport. Needs paho-mqtt.
+
+    def __init__(self, host, topic="oee/events", port=1883, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.topic = topic
+
+    async def batches(self, service):
+        import paho.mqtt.client as mqtt
+
+        index = {station: number for number, station in enumerate(service.stations)}
+        reasons = {reason: number for number, reason in enumerate(service.reasons)}
+
+        def on_message(client, userdata, message):
+            event = json.loads(message.payload)
+            if event["station"] in index:
+                value = event["value"]
+                self.put(event["ts"], index[event["station"]], KIND_NAMES[event["kind"]], reasons.get(value, 0) if isinstance(value, str) else value)
+
+        client = mqtt.Client()
+        client.on_message = on_message
+        client.connect(self.host, self.port)
+        client.subscribe(self.topic)
+        client.loop_start()
+        try:
+            async for batch in super().batches(service):
+                yield batch
+        finally:
+            client.loop_stop()
+
+
+# Build a transport from a spec: "simulator[:rate]", "replay:<path>" or "mqtt:<host>"
+def create_transport(spec):
+    kind, _, argument = spec.partition(":")
+    if kind == "simulator":
+        return SimulatorTransport(rate=float(argument or 1000))
+    if kind == "replay":
+        return FileReplayTransport(argument, speed=1)
+    if kind == "mqtt":
+        return MqttTransport(argument)
+    raise ValueError(f"Unknown ingest transport '{kind}', expected simulator, replay or mqtt")
+
+
+# Write n_events simulated events for `stations` to a JSON-lines replay file
+def record_simulation(path, stations, n_events, seed=0, rate=1000):
+    simulator = SimulatorTransport(rate=rate, seed=seed)
+    batch = simulator.generate(len(stations), len(DOWNTIME_REASONS), time.time(), n_events)
+    names = {number: name for name, number in KIND_NAMES.items()}
+    with open(path, "w") as f:
+        for timestamp, station, kind, value in zip(*(batch[key].tolist() for key in ("timestamp", "station", "kind", "value"))):
+            f.write(json.dumps({"ts": timestamp, "station": stations[station], "kind": names[kind], "value": value}) + "\n")
+
+
+# Load test: push events through the service as fast as possible (or at --rate)
+def main():
+    from process_store import load_store
+
+    parser = argparse.ArgumentParser(description="Run the ingest pipeline against the simulator and report throughput.")
+    parser.add_argument("--source", default="synthetic:300", help="process data source providing the stations")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 for unpaced")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    store = load_store(args.source)
+    transport = SimulatorTransport(rate=args.rate, batch_size=args.batch_size, max_events=args.events)
+    service = IngestService(store, transport)
+
+    started = time.perf_counter()
+    asyncio.run(service.run())
+    elapsed = time.perf_counter() - started
+    snapshot_started = time.perf_counter()
+    snapshot = service.snapshot()
+    snapshot_ms = (time.perf_counter() - snapshot_started) * 1000
+
+    print(f"{service.events} events in {service.batches} batches over {len(store)} stations")
+    print(f"{service.events / elapsed:,.0f} events/s end to end, {service.events / service.apply_seconds:,.0f} events/s applying")
+    print(f"snapshot {snapshot_ms:.1f} ms, mean OEE {snapshot.values('oee').mean():.1f}%")
+
+
+if __name__ == "__main__":
+    main()
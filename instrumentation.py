@@ -0,0 +1,207 @@
+import bisect
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+import flask
+
+
+# Upper bounds of the histogram buckets: seconds for timings, bytes for payload sizes
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Seconds between two stack samples of a profiled request
+PROFILE_INTERVAL = 0.001
+
+
+class Histogram:
+    # Prometheus-style histogram with one set of cumulative buckets per label value.
+    # Metrics live in the worker process; behind gunicorn each worker reports its own.
+
+    def __init__(self, name, help, label, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total) in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # Value read from a callable at scrape time, e.g. a cache counter
+
+    def __init__(self, name, help, read, type="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.type = type
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", f"{self.name} {self.read()}"]
+
+
+BUILDER_SECONDS = Histogram("oee_figure_build_seconds", "Time spent constructing figures in builders.", "builder")
+SERIALISE_SECONDS = Histogram("oee_figure_serialise_seconds", "Time spent serialising built figures to JSON.", "builder")
+FIGURE_BYTES = Histogram("oee_figure_bytes", "Size of serialised figures.", "builder", BYTES_BUCKETS)
+CALLBACK_SECONDS = Histogram("oee_callback_seconds", "Time spent inside Dash callback functions.", "callback")
+REQUEST_SECONDS = Histogram(
+    "oee_callback_request_seconds", "Time to answer a callback request, including JSON serialisation.", "callback"
+)
+RESPONSE_BYTES = Histogram("oee_callback_response_bytes", "Size of callback responses.", "callback", BYTES_BUCKETS)
+METRICS = [BUILDER_SECONDS, SERIALISE_SECONDS, FIGURE_BYTES, CALLBACK_SECONDS, REQUEST_SECONDS, RESPONSE_BYTES]
+
+
+# Exposition text of every metric, as served on /metrics
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Decorator recording the build time of a figure builder under its name
+def timed_builder(builder):
+    @functools.wraps(builder)
+    def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            return builder(*args)
+        finally:
+            BUILDER_SECONDS.observe(builder.__name__, time.perf_counter() - started)
+
+    return wrapper
+
+
+# FigureCache.on_build hook: serialisation time and size of every figure the cache stores
+def record_figure_build(key, value, serialise_seconds):
+    SERIALISE_SECONDS.observe(key[0], serialise_seconds)
+    FIGURE_BYTES.observe(key[0], len(value))
+
+
+# Expose the hit and miss counters of a figure cache
+def instrument_figure_cache(cache):
+    if cache is None:
+        return
+    cache.on_build = record_figure_build
+    METRICS.append(Gauge("oee_figure_cache_hits_total", "Figure cache hits.", lambda: cache.hits, "counter"))
+    METRICS.append(Gauge("oee_figure_cache_misses_total", "Figure cache misses.", lambda: cache.misses, "counter"))
+
+
+# Make app.callback time every callback registered after this call, under the name of
+# its function. The name is also kept on the request for the response histograms.
+def instrument_callbacks(app):
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorate = register(*args, **kwargs)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*callback_args, **callback_kwargs):
+                flask.g.oee_callback = function.__name__
+                started = time.perf_counter()
+                try:
+                    return function(*callback_args, **callback_kwargs)
+                finally:
+                    CALLBACK_SECONDS.observe(function.__name__, time.perf_counter() - started)
+
+            return decorate(wrapper)
+
+        return decorator
+
+    app.callback = callback
+
+
+class SamplingProfiler:
+    # Samples the stack of one thread every `interval` seconds from a helper thread and
+    # counts identical stacks, giving folded output for flamegraph.pl or speedscope
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="oee-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# Register /metrics and the callback request histograms on the Flask server. With
+# profile_dir set, requests carrying an X-OEE-Profile header or a profile query
+# parameter are sampled and their folded stacks written to that directory.
+def instrument_server(server, profile_dir=None):
+    @server.route("/metrics")
+    def metrics():
+        return flask.Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    def wants_profile():
+        return profile_dir and (flask.request.headers.get("X-OEE-Profile") or "profile" in flask.request.args)
+
+    @server.before_request
+    def start_request():
+        flask.g.oee_started = time.perf_counter()
+        if wants_profile():
+            flask.g.oee_profiler = SamplingProfiler(threading.get_ident())
+            flask.g.oee_profiler.start()
+
+    @server.after_request
+    def finish_request(response):
+        name = flask.g.get("oee_callback")
+        if name is not None:
+            REQUEST_SECONDS.observe(name, time.perf_counter() - flask.g.oee_started)
+            if not response.direct_passthrough:
+                RESPONSE_BYTES.observe(name, response.calculate_content_length() or 0)
+
+        profiler = flask.g.pop("oee_profiler", None)
+        if profiler is not None:
+            profiler.stop()
+            os.makedirs(profile_dir, exist_ok=True)
+            label = name or flask.request.path.strip("/").replace("/", "_") or "index"
+            path = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{label}.folded")
+            with open(path, "w") as f:
+                f.write(profiler.folded())
+            response.headers["X-OEE-Profile-File"] = path
+        return response
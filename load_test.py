@@ -0,0 +1,738 @@
+import argparse
+import datetime
+import gzip
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+
+# Users, gunicorn workers and threads per worker swept by default
+SWEEP_USERS = (25, 50, 100, 200)
+SWEEP_WORKERS = (1, 2, 4)
+SWEEP_THREADS = (2, 4, 8)
+# Share of users that are wallboards: they load the page and only follow its refreshes
+WALLBOARD_SHARE = 0.3
+# Mean seconds an operator waits between two actions, and how often an action switches
+# tabs, changes a control of the rendered tabs or reloads the page
+THINK_SECONDS = 5.0
+ACTIONS = {"tab": 0.45, "control": 0.45, "reload": 0.1}
+# What a configuration has to keep up to serve a number of users: 95th percentile
+# latency in milliseconds and share of failed requests
+SLO_P95_MS = 1000
+SLO_ERRORS = 0.01
+# Seconds before a request counts as failed, gunicorn's default worker timeout
+REQUEST_TIMEOUT = 30
+# Seconds the local server gets to load its data and answer
+START_TIMEOUT = 300
+# Seconds between two samples of the server processes' memory and CPU time
+SAMPLE_SECONDS = 1.0
+# Callbacks set off by one change at most, following outputs that are inputs again
+MAX_CHAIN = 5
+WILDCARDS = (["ALL"], ["ALLSMALLER"])
+
+
+# The id of a component as Dash writes it in dependencies and responses
+def stringify_id(component_id):
+    if isinstance(component_id, dict):
+        return json.dumps(component_id, sort_keys=True, separators=(",", ":"))
+    return component_id
+
+
+def parse_id(text):
+    return json.loads(text) if text.startswith("{") else text
+
+
+# "id.prop", "..id.prop...id.prop.." for several outputs, as [(id, prop)]
+def parse_outputs(output):
+    parts = output[2:-2].split("...") if output.startswith("..") else [output]
+    outputs = []
+    for part in parts:
+        component_id, _, prop = part.rpartition(".")
+        outputs.append((parse_id(component_id), prop.partition("@")[0]))
+    return outputs
+
+
+# Callbacks of /_dash-dependencies, with the name reported for each (its first output)
+def parse_dependencies(raw):
+    callbacks = []
+    for dependency in raw:
+        outputs = parse_outputs(dependency["output"])
+        first_id, first_prop = outputs[0]
+        name = f"{first_id.get('type', first_id) if isinstance(first_id, dict) else first_id}.{first_prop}"
+        callbacks.append({
+            "name": name,
+            "output": dependency["output"],
+            "outputs": outputs,
+            "multi": dependency["output"].startswith(".."),
+            "inputs": [(parse_id(item["id"]), item["property"]) for item in dependency["inputs"]],
+            "state": [(parse_id(item["id"]), item["property"]) for item in dependency["state"]],
+            "prevent_initial_call": dependency.get("prevent_initial_call", False),
+            "clientside": (dependency.get("clientside_function") or {}).get("function_name"),
+        })
+    return callbacks
+
+
+def matches(pattern, component_id, match):
+    if not isinstance(pattern, dict):
+        return pattern == component_id
+    if not isinstance(component_id, dict) or pattern.keys() != component_id.keys():
+        return False
+    for key, wanted in pattern.items():
+        if wanted == ["MATCH"]:
+            if key in match and component_id[key] != match[key]:
+                return False
+        elif wanted not in WILDCARDS and component_id[key] != wanted:
+            return False
+    return True
+
+
+# Client side callbacks the load depends on, as the browser runs them: tabs to render
+# when a tab is selected (assets/clientside.js requestTabs)
+def request_tabs(value, rendered, settings):
+    selected = int(value.split("-")[1])
+    wanted = [
+        index for index in range(selected - settings["prefetch"], selected + settings["prefetch"] + 1)
+        if 0 <= index < settings["tabs"] and index not in (rendered or [])
+    ]
+    return wanted or None
+
+
+CLIENTSIDE = {"requestTabs": request_tabs}
+
+
+class Page:
+    # The components of a dashboard page as a browser holds them, {stringified id:
+    # {"id", "type", "props"}}, and the callbacks their changes set off
+
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+        self.components = {}
+
+    # Components of a layout or of the children a callback returned, returned by key
+    def add(self, node):
+        found = {}
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                # Component lists hold dicts, long lists of numbers are figure data
+                stack.extend(item for item in node if isinstance(item, (dict, list)))
+            elif isinstance(node, dict) and "props" in node and "type" in node:
+                props = node["props"]
+                if "id" in props:
+                    found[stringify_id(props["id"])] = {"id": props["id"], "type": node["type"], "props": props}
+                stack.extend(value for value in props.values() if isinstance(value, (dict, list)))
+        self.components.update(found)
+        return found
+
+    def _items(self, pattern, prop, match, with_value):
+        def item(component):
+            entry = {"id": component["id"], "property": prop}
+            if with_value:
+                entry["value"] = component["props"].get(prop)
+            return entry
+
+        if isinstance(pattern, dict) and any(value in WILDCARDS for value in pattern.values()):
+            return [item(component) for component in self.components.values() if matches(pattern, component["id"], match)]
+        for component in self.components.values():
+            if matches(pattern, component["id"], match):
+                return item(component)
+        return None
+
+    # Body of a callback request set off by a change of `trigger` (key, prop), or None
+    # when one of its single inputs or outputs is not on the page
+    def request(self, callback, trigger=None):
+        match = {}
+        if trigger is not None and isinstance(self.components[trigger[0]]["id"], dict):
+            match = self.components[trigger[0]]["id"]
+        outputs = [self._items(pattern, prop, match, False) for pattern, prop in callback["outputs"]]
+        inputs = [self._items(pattern, prop, match, True) for pattern, prop in callback["inputs"]]
+        state = [self._items(pattern, prop, match, True) for pattern, prop in callback["state"]]
+        if any(item is None for item in outputs + inputs + state):
+            return None
+        return {
+            "output": callback["output"],
+            "outputs": outputs if callback["multi"] else outputs[0],
+            "inputs": inputs,
+            "state": state,
+            "changedPropIds": [f"{trigger[0]}.{trigger[1]}"] if trigger else [],
+        }
+
+    # Callbacks with an input matching (key, prop)
+    def triggered_by(self, key, prop):
+        component_id = self.components[key]["id"]
+        return [
+            callback for callback in self.callbacks
+            if any(input_prop == prop and matches(pattern, component_id, {}) for pattern, input_prop in callback["inputs"])
+        ]
+
+    # Callbacks run when components are added: those not preventing their initial call
+    # with an input among them, once per MATCH value
+    def initial_calls(self, added):
+        calls = {}
+        for key, component in added.items():
+            for callback in self.callbacks:
+                if callback["prevent_initial_call"]:
+                    continue
+                for pattern, prop in callback["inputs"]:
+                    if matches(pattern, component["id"], {}):
+                        match = json.dumps(component["id"], sort_keys=True) if isinstance(pattern, dict) and ["MATCH"] in pattern.values() else ""
+                        calls.setdefault((id(callback), match), (callback, (key, prop)))
+                        break
+        return list(calls.values())
+
+    # Apply a callback response, returning the changed (key, prop) and the added components
+    def apply(self, response):
+        changed, added = [], {}
+        for key, props in response.items():
+            component = self.components.get(key)
+            if component is None:
+                continue
+            for prop, value in props.items():
+                # Partial updates (dash.Patch) only matter to the figures, not to the requests
+                if isinstance(value, dict) and "__dash_patch_update" in value:
+                    continue
+                component["props"][prop] = value
+                changed.append((key, prop))
+                added.update(self.add(value))
+        return changed, added
+
+
+class User(threading.Thread):
+    # One browser on the dashboard: loads the page, follows its intervals and, unless it is
+    # a wallboard, switches tabs, changes controls and reloads now and then. Every request
+    # is recorded as (start, milliseconds, kind, name, status, bytes).
+
+    def __init__(self, url, callbacks, wallboard, start_at, stop_at, seed, samples):
+        super().__init__(daemon=True)
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.prefix = parsed.path.rstrip("/") + "/"
+        self.callbacks = callbacks
+        self.wallboard = wallboard
+        self.start_at, self.stop_at = start_at, stop_at
+        self.random = random.Random(seed)
+        self.samples = samples
+        self.connection = None
+        self.page = None
+        self.timers = {}
+
+    def send(self, method, path, kind, name, body=None):
+        headers = {"Accept-Encoding": "gzip", "Accept": "application/json"}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        started = time.time()
+        status, data = 0, b""
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+                self.connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                status, data = response.status, response.read()
+                if response.getheader("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection, a browser reconnects
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    break
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                self.connection = None
+                break
+        self.samples.append((started, (time.time() - started) * 1000, kind, name, status, len(data)))
+        return status, data
+
+    def call(self, callback, trigger, kind, depth=0):
+        if callback["clientside"]:
+            function = CLIENTSIDE.get(callback["clientside"])
+            body = self.page.request(callback, trigger) if function else None
+            if body is None:
+                return
+            result = function(*(item["value"] for item in body["inputs"] + body["state"]))
+            if result is None:
+                return
+            output_id, prop = callback["outputs"][0]
+            changed, added = self.page.apply({stringify_id(output_id): {prop: result}})
+        else:
+            body = self.page.request(callback, trigger)
+            if body is None:
+                return
+            status, data = self.send("POST", "_dash-update-component", kind, callback["name"], body)
+            if status != 200:
+                return
+            changed, added = self.page.apply(json.loads(data)["response"])
+        self.follow(changed, added, kind, depth + 1)
+
+    # Callbacks set off by changed properties, and the initial calls of added components
+    def follow(self, changed, added, kind, depth=0):
+        if depth > MAX_CHAIN:
+            return
+        for key, prop in changed:
+            for callback in self.page.triggered_by(key, prop):
+                self.call(callback, (key, prop), kind, depth)
+        for callback, trigger in self.page.initial_calls(added):
+            self.call(callback, trigger, "initial", depth)
+        self.schedule(added)
+
+    def schedule(self, added):
+        for key, component in added.items():
+            props = component["props"]
+            if component["type"] == "Interval" and not props.get("disabled") and props.get("max_intervals", -1) != 0:
+                self.timers[key] = time.time() + props.get("interval", 1000) / 1000
+
+    def load(self):
+        self.page = Page(self.callbacks)
+        self.timers = {}
+        self.send("GET", "", "page", "index")
+        self.send("GET", "_dash-dependencies", "page", "dependencies")
+        status, data = self.send("GET", "_dash-layout", "page", "layout")
+        if status == 200:
+            self.follow([], self.page.add(json.loads(data)), "initial")
+
+    def tick(self, key):
+        component = self.page.components[key]
+        component["props"]["n_intervals"] = (component["props"].get("n_intervals") or 0) + 1
+        for callback in self.page.triggered_by(key, "n_intervals"):
+            self.call(callback, (key, "n_intervals"), "refresh")
+        self.timers[key] = time.time() + component["props"].get("interval", 1000) / 1000
+
+    # Pick a tab, as a click on it, or a new value for a control of a server callback
+    def act(self):
+        action = self.random.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == "reload":
+            self.load()
+            return
+        if action == "tab":
+            tabs = [key for key, component in self.page.components.items() if component["type"] == "Tabs"]
+            if not tabs:
+                return
+            component = self.page.components[tabs[0]]
+            values = [tab["props"].get("value") for tab in component["props"].get("children") or [] if isinstance(tab, dict)]
+            self.change(tabs[0], "value", self.random.choice(values), "tab")
+            return
+        controls = [
+            key for key, component in self.page.components.items()
+            if component["props"].get("options") and any(
+                not callback["clientside"] for callback in self.page.triggered_by(key, "value")
+            )
+        ]
+        if controls:
+            key = self.random.choice(controls)
+            options = self.page.components[key]["props"]["options"]
+            option = self.random.choice(options)
+            self.change(key, "value", option["value"] if isinstance(option, dict) else option, "control")
+
+    def change(self, key, prop, value, kind):
+        self.page.components[key]["props"][prop] = value
+        self.follow([(key, prop)], {}, kind)
+
+    def run(self):
+        time.sleep(max(0, self.start_at - time.time()))
+        self.load()
+        next_action = time.time() + self.random.expovariate(1 / THINK_SECONDS)
+        while time.time() < self.stop_at:
+            key, due = min(self.timers.items(), key=lambda item: item[1], default=(None, float("inf")))
+            if self.wallboard:
+                next_action = float("inf")
+            wake = min(due, next_action, self.stop_at)
+            time.sleep(max(0, wake - time.time()))
+            if time.time() >= self.stop_at:
+                break
+            if key is not None and due <= next_action:
+                self.tick(key)
+            else:
+                self.act()
+                next_action = time.time() + self.random.expovariate(1 / THINK_SECONDS)
+        if self.connection is not None:
+            self.connection.close()
+
+
+# Users of one client process, started evenly over the ramp; the samples are written to
+# `path` as JSON lines (start, ms, kind, name, status, bytes)
+def run_client(url, callbacks, users, wallboards, start_at, ramp, stop_at, seed, path):
+    samples = []
+    threads = []
+    for number in range(users):
+        threads.append(User(url, callbacks, number < wallboards, start_at + ramp * number / max(users, 1), stop_at, seed + number, samples))
+        threads[-1].start()
+    for thread in threads:
+        thread.join(stop_at - time.time() + REQUEST_TIMEOUT + 5)
+    with open(path, "w") as f:
+        json.dump(samples, f)
+
+
+def get_json(url, path):
+    parsed = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=REQUEST_TIMEOUT)
+    try:
+        connection.request("GET", parsed.path.rstrip("/") + "/" + path)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read()) if response.status == 200 else None
+    finally:
+        connection.close()
+
+
+class ProcessSampler(threading.Thread):
+    # Memory (RSS and PSS, which splits pages shared copy-on-write between the processes
+    # sharing them) and CPU time of a gunicorn master and its workers, read from /proc
+
+    def __init__(self, master_pid):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.processes = {}
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def read(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            pss = rss
+            if os.path.exists(f"/proc/{pid}/smaps_rollup"):
+                with open(f"/proc/{pid}/smaps_rollup") as f:
+                    pss = next((int(line.split()[1]) for line in f if line.startswith("Pss:")), rss)
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rpartition(")")[2].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, StopIteration, ValueError):
+            return None
+        return {"rss_kib": rss, "pss_kib": pss, "cpu_seconds": cpu}
+
+    def children(self):
+        try:
+            with open(f"/proc/{self.master_pid}/task/{self.master_pid}/children") as f:
+                return [int(pid) for pid in f.read().split()]
+        except OSError:
+            return []
+
+    def sample(self):
+        now = time.time()
+        for pid in [self.master_pid] + self.children():
+            values = self.read(pid)
+            if values is None:
+                continue
+            entry = self.processes.setdefault(pid, {"role": "master" if pid == self.master_pid else "worker", "first": (now, values), "peak_rss_kib": 0, "peak_pss_kib": 0})
+            entry["last"] = (now, values)
+            entry["peak_rss_kib"] = max(entry["peak_rss_kib"], values["rss_kib"])
+            entry["peak_pss_kib"] = max(entry["peak_pss_kib"], values["pss_kib"])
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_SECONDS):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.sample()
+
+    # Per process: peak and last memory in MiB and CPU use over the samples in percent
+    def report(self):
+        report = []
+        for pid, entry in sorted(self.processes.items()):
+            (first_time, first), (last_time, last) = entry["first"], entry["last"]
+            report.append({
+                "pid": pid,
+                "role": entry["role"],
+                "peak_rss_mib": round(entry["peak_rss_kib"] / 1024, 1),
+                "peak_pss_mib": round(entry["peak_pss_kib"] / 1024, 1),
+                "rss_mib": round(last["rss_kib"] / 1024, 1),
+                "cpu_percent": round((last["cpu_seconds"] - first["cpu_seconds"]) * 100 / (last_time - first_time), 1) if last_time > first_time else None,
+            })
+        return report
+
+
+class LocalServer:
+    # gunicorn serving app:server from this directory on a free local port, its output
+    # kept in a log file shown when it fails to start
+
+    def __init__(self, workers, threads, env):
+        self.workers, self.threads, self.env = workers, threads, env
+        self.process = None
+        self.url = None
+
+    def start(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        self.log = tempfile.TemporaryFile()
+        command = [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+            "-w", str(self.workers), "--threads", str(self.threads), "-b", f"127.0.0.1:{port}", "app:server",
+        ]
+        self.process = subprocess.Popen(
+            command, env=dict(self.env, OEE_THREADS=str(self.threads)), stdout=self.log, stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if get_json(self.url, "_dash-layout")[0] == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        self.log.seek(0)
+        sys.stderr.write(self.log.read().decode(errors="replace")[-4000:])
+        raise SystemExit(f"gunicorn with {self.workers} workers and {self.threads} threads did not start")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def percentiles(latencies):
+    if not len(latencies):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1)}
+
+
+# Requests, throughput, errors and latency percentiles of the samples started in the
+# measured window, in total, per kind of request and per callback
+def summarise_samples(samples, window_start, window_end):
+    samples = [sample for sample in samples if window_start <= sample[0] < window_end]
+    seconds = window_end - window_start
+
+    def summary(rows):
+        latencies = np.array([row[1] for row in rows])
+        errors = sum(1 for row in rows if row[4] not in (200, 204))
+        return {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / seconds, 2),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            **percentiles(latencies),
+            "mean_kib": round(sum(row[5] for row in rows) / len(rows) / 1024, 1) if rows else None,
+        }
+
+    def grouped(column):
+        groups = {}
+        for row in samples:
+            groups.setdefault(row[column], []).append(row)
+        return {name: summary(rows) for name, rows in sorted(groups.items())}
+
+    return {"total": summary(samples), "by_kind": grouped(2), "by_callback": grouped(3)}
+
+
+# One load test: `users` browsers for `duration` seconds after a ramp, against `url` or a
+# local gunicorn started with `workers` and `threads`
+def run_load(args, users, workers=None, threads=None, env=None):
+    server = LocalServer(workers, threads, env).start() if args.url is None else None
+    url = args.url or server.url
+    sampler = None
+    try:
+        status, raw = get_json(url, "_dash-dependencies")
+        if status != 200:
+            raise SystemExit(f"{url}_dash-dependencies answered {status}")
+        callbacks = parse_dependencies(raw)
+        if server is not None:
+            sampler = ProcessSampler(server.process.pid)
+            sampler.sample()
+            sampler.start()
+
+        clients = max(1, min(args.clients, users))
+        start_at = time.time() + 1
+        window_start = start_at + args.ramp
+        stop_at = window_start + args.duration
+        wallboards = round(users * args.wallboards)
+        jobs = []
+        with tempfile.TemporaryDirectory() as directory:
+            context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+            for client in range(clients):
+                share = users // clients + (client < users % clients)
+                client_wallboards = wallboards // clients + (client < wallboards % clients)
+                path = os.path.join(directory, f"client-{client}.json")
+                process = context.Process(target=run_client, args=(url, callbacks, share, client_wallboards, start_at, args.ramp, stop_at, args.seed + 1000 * client, path))
+                process.start()
+                jobs.append((process, path))
+            samples = []
+            for process, path in jobs:
+                process.join()
+                if os.path.exists(path):
+                    with open(path) as f:
+                        samples.extend(json.load(f))
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.stop()
+
+    result = {"users": users, "workers": workers, "threads": threads, **summarise_samples(samples, window_start, stop_at)}
+    if sampler is not None:
+        processes = sampler.report()
+        result["processes"] = processes
+        result["worker_restarts"] = max(0, sum(1 for process in processes if process["role"] == "worker") - workers)
+        result["total_pss_mib"] = round(sum(process["peak_pss_mib"] for process in processes), 1)
+    return result
+
+
+def meets_slo(result, args):
+    total = result["total"]
+    return total["requests"] > 0 and total["p95_ms"] <= args.slo_p95_ms and total["error_rate"] <= args.slo_errors
+
+
+def print_result(result):
+    total = result["total"]
+    config = f"{result['workers']}w x {result['threads']}t " if result["workers"] else ""
+    print(
+        f"{config}{result['users']:>4} users: {total['requests']:>6} requests {total['throughput_rps']:>7.1f}/s "
+        f"p50 {total['p50_ms']} p95 {total['p95_ms']} p99 {total['p99_ms']} ms, {total['error_rate']:.1%} errors"
+        + (f", {result['total_pss_mib']} MiB PSS" if "total_pss_mib" in result else ""),
+        file=sys.stderr,
+    )
+    for kind, summary in result["by_kind"].items():
+        print(f"    {kind:<10} {summary['requests']:>6} p50 {summary['p50_ms']} p95 {summary['p95_ms']} p99 {summary['p99_ms']} ms", file=sys.stderr)
+    for process in result.get("processes", []):
+        print(f"    {process['role']:<6} {process['pid']:>7} RSS {process['peak_rss_mib']} MiB PSS {process['peak_pss_mib']} MiB CPU {process['cpu_percent']}%", file=sys.stderr)
+
+
+def get_env(args):
+    env = dict(os.environ, OEE_DATA_SOURCE=f"synthetic:{args.stations}", OEE_INGEST="simulator")
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    return env
+
+
+def write_report(args, env, report):
+    report = {
+        "meta": {
+            "commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None,
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "duration": args.duration,
+            "ramp": args.ramp,
+            "wallboards": args.wallboards,
+            "env": {key: value for key, value in env.items() if key.startswith("OEE_")} if args.url is None else None,
+        },
+        **report,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+
+def run(args):
+    env = get_env(args)
+    result = run_load(args, args.users, args.workers, args.threads, env)
+    print_result(result)
+    write_report(args, env, {"results": [result]})
+
+
+# Every worker and thread count against growing numbers of users, stopping a configuration
+# at the first number it cannot serve within the SLO. The recommendation serves the most
+# users, then uses the least memory (throughput follows the users, who wait between
+# actions), then has the lowest latency.
+def sweep(args):
+    env = get_env(args)
+    results, capacity = [], {}
+    for workers, threads in itertools.product(args.workers, args.threads):
+        for users in sorted(args.users):
+            result = run_load(args, users, workers, threads, env)
+            result["meets_slo"] = meets_slo(result, args)
+            results.append(result)
+            print_result(result)
+            if not result["meets_slo"]:
+                break
+            capacity[workers, threads] = result
+
+    recommendation = None
+    if capacity:
+        (workers, threads), best = max(
+            capacity.items(),
+            key=lambda item: (item[1]["users"], -item[1].get("total_pss_mib", 0), -item[1]["total"]["p95_ms"]),
+        )
+        recommendation = {
+            "workers": workers,
+            "threads": threads,
+            "users": best["users"],
+            "throughput_rps": best["total"]["throughput_rps"],
+            "p95_ms": best["total"]["p95_ms"],
+            "total_pss_mib": best.get("total_pss_mib"),
+            "command": f"OEE_THREADS={threads} gunicorn -c gunicorn.conf.py -w {workers} app:server",
+            "at_most_users_tested": best["users"] == max(args.users),
+        }
+        print(
+            f"Recommended: {recommendation['command']} serves {best['users']}"
+            + (" or more" if recommendation["at_most_users_tested"] else "")
+            + f" users at p95 {best['total']['p95_ms']} ms, {best['total']['throughput_rps']} requests/s",
+            file=sys.stderr,
+        )
+    else:
+        print(f"No configuration served {min(args.users)} users within p95 {args.slo_p95_ms} ms and {args.slo_errors:.0%} errors", file=sys.stderr)
+    write_report(args, env, {"slo": {"p95_ms": args.slo_p95_ms, "error_rate": args.slo_errors}, "results": results, "recommendation": recommendation})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the dashboard with simulated browsers and recommend a gunicorn configuration.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def numbers(value):
+        return [int(number) for number in value.split(",")]
+
+    def add_common(command_parser):
+        command_parser.add_argument("--stations", type=int, default=10000, help="size of the synthetic plant served")
+        command_parser.add_argument("--duration", type=float, default=60, help="measured seconds, after the ramp")
+        command_parser.add_argument("--ramp", type=float, default=10, help="seconds over which the users arrive, not measured")
+        command_parser.add_argument("--wallboards", type=float, default=WALLBOARD_SHARE, help="share of users only following the refreshes")
+        command_parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="client processes the users are spread over")
+        command_parser.add_argument("--seed", type=int, default=0)
+        command_parser.add_argument("--env", action="append", default=[], help="OEE_* setting for the server, e.g. OEE_PRELOAD=1")
+        command_parser.add_argument("--output", help="report file, stdout by default")
+
+    run_parser = commands.add_parser("run", help="load test one configuration")
+    add_common(run_parser)
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--workers", type=int, default=2)
+    run_parser.add_argument("--threads", type=int, default=4)
+    run_parser.add_argument("--url", help="dashboard already running, e.g. http://host:8050/, instead of a local gunicorn")
+
+    sweep_parser = commands.add_parser("sweep", help="load test worker and thread counts and recommend one")
+    add_common(sweep_parser)
+    sweep_parser.add_argument("--users", type=numbers, default=list(SWEEP_USERS))
+    sweep_parser.add_argument("--workers", type=numbers, default=list(SWEEP_WORKERS))
+    sweep_parser.add_argument("--threads", type=numbers, default=list(SWEEP_THREADS))
+    sweep_parser.add_argument("--slo-p95-ms", type=float, default=SLO_P95_MS)
+    sweep_parser.add_argument("--slo-errors", type=float, default=SLO_ERRORS)
+    sweep_parser.set_defaults(url=None)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sweep(args)
+
+
+if __name__ == "__main__":
+    main()
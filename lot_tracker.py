@@ -0,0 +1,396 @@
+import threading
+import time
+
+import numpy as np
+
+from ingest import LOT
+from process_store import get_routes
+
+
+LOT_FIELDS = {
+    "id": np.int64,
+    "station": np.int32,
+    "released": np.float64,
+    "entered": np.float64,
+    "left": np.float64,
+    "completed": np.float64,
+    "last_move": np.int64,
+}
+MOVE_FIELDS = {"lot": np.int32, "station": np.int32, "time": np.float64, "previous": np.int64}
+
+
+# Columns of `fields` with room for at least `needed` rows, doubling the capacity
+def _reserve(columns, fields, needed):
+    capacity = len(next(iter(columns.values())))
+    if needed <= capacity:
+        return columns
+    capacity = max(needed, 2 * capacity, 1024)
+    grown = {}
+    for name, dtype in fields.items():
+        grown[name] = np.empty(capacity, dtype)
+        grown[name][:len(columns[name])] = columns[name]
+    return grown
+
+
+# Round number of each event such that a round holds at most one event per lot and per
+# station and follows every earlier event of the same lot or station: the longest chain
+# of such dependencies ending at the event
+def _rounds(slots, stations):
+    dependencies = []
+    for keys in (slots, stations):
+        # Events are in time order, a stable sort keeps it within each key
+        order = np.argsort(keys, kind="stable")
+        same = keys[order][1:] == keys[order][:-1]
+        dependencies.append((order[1:][same], order[:-1][same]))
+
+    rounds = np.zeros(len(slots), dtype=np.int64)
+    while True:
+        updated = rounds.copy()
+        for rows, before in dependencies:
+            updated[rows] = np.maximum(updated[rows], rounds[before] + 1)
+        if np.array_equal(updated, rounds):
+            return rounds
+        rounds = updated
+
+
+class LotTracker:
+    # Follows lots along the routes of the plant (see process_store.get_routes) from
+    # "lot now on station" events. A lot is processed on a station from the time it is
+    # put there until it moves on or the next lot displaces it, then queues until it
+    # enters the next station; leaving the last station of its route completes it.
+    # Lots are columns indexed by a slot number and moves an append-only log chained
+    # per lot. Per-station totals and WIP are updated on every event, so no query
+    # has to scan the lots.
+
+    def __init__(self, store):
+        self.stations = store.column("step").tolist()
+        self.routes = get_routes(store)
+        n = len(self.stations)
+        self._slots = {}
+        self._lots = {name: np.empty(0, dtype) for name, dtype in LOT_FIELDS.items()}
+        self._moves = {name: np.empty(0, dtype) for name, dtype in MOVE_FIELDS.items()}
+        self.n_lots = 0
+        self.n_moves = 0
+
+        # Slot of the lot on each station, -1 when empty
+        self.current = np.full(n, -1, dtype=np.int64)
+        # Lots that left the previous station on the route and wait for this one
+        self.waiting = np.zeros(n, dtype=np.int64)
+        self.released = np.zeros(n, dtype=np.int64)
+        self.completed = np.zeros(n, dtype=np.int64)
+        self.processed = np.zeros(n, dtype=np.int64)
+        self.process_seconds = np.zeros(n)
+        self.queued = np.zeros(n, dtype=np.int64)
+        self.queue_seconds = np.zeros(n)
+        self.cycle_seconds = np.zeros(n)
+        # Station to station move counts, keyed by from * n + to
+        self._link_keys = np.empty(0, dtype=np.int64)
+        self._link_counts = np.empty(0, dtype=np.int64)
+        self.version = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.n_lots
+
+    def lot_column(self, name):
+        return self._lots[name][:self.n_lots]
+
+    def move_column(self, name):
+        return self._moves[name][:self.n_moves]
+
+    # Ingest listener: every LOT event puts its lot on its station
+    def __call__(self, batch):
+        rows = batch["kind"] == LOT
+        if rows.any():
+            self.move(batch["timestamp"][rows], batch["station"][rows], batch["value"][rows].astype(np.int64))
+
+    def move(self, timestamps, stations, lot_ids):
+        order = np.argsort(np.asarray(timestamps, dtype=np.float64), kind="stable")
+        timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+        stations = np.asarray(stations, dtype=np.int64)[order]
+        lot_ids = np.asarray(lot_ids, dtype=np.int64)[order]
+        if not len(timestamps):
+            return
+
+        with self._lock:
+            slots = self._get_slots(lot_ids, timestamps)
+            rounds = _rounds(slots, stations)
+            links = []
+            for number in range(rounds.max() + 1):
+                rows = rounds == number
+                links.append(self._move_round(timestamps[rows], stations[rows], slots[rows]))
+            self._add_links(np.concatenate(links))
+            self.version += 1
+
+    # Slot of every lot id, adding lots seen for the first time as released at their first event
+    def _get_slots(self, lot_ids, timestamps):
+        unique, first, inverse = np.unique(lot_ids, return_index=True, return_inverse=True)
+        unique_slots = np.array([self._slots.get(lot_id, -1) for lot_id in unique.tolist()], dtype=np.int64)
+        new = np.flatnonzero(unique_slots < 0)
+        if len(new):
+            start = self.n_lots
+            self._lots = _reserve(self._lots, LOT_FIELDS, start + len(new))
+            unique_slots[new] = np.arange(start, start + len(new))
+            self.n_lots += len(new)
+            lots = {name: column[start:self.n_lots] for name, column in self._lots.items()}
+            lots["id"][:] = unique[new]
+            lots["station"][:] = -1
+            lots["released"][:] = timestamps[first[new]]
+            for name in ("entered", "left", "completed"):
+                lots[name][:] = np.nan
+            lots["last_move"][:] = -1
+            self._slots.update(zip(unique[new].tolist(), unique_slots[new].tolist()))
+        return unique_slots[inverse]
+
+    # Events of one round: distinct lots and distinct stations. Returns the link keys of the moves.
+    def _move_round(self, timestamps, stations, slots):
+        lots = self._lots
+        # A lot announced again on the station it is on does not move
+        moving = lots["station"][slots] != stations
+        timestamps, stations, slots = timestamps[moving], stations[moving], slots[moving]
+        origin = lots["station"][slots].astype(np.int64)
+
+        # Lots leave their station when they move on or when another lot is put on it;
+        # a lot doing both within the round leaves at the earlier time
+        on_station = (origin >= 0) & (self.current[np.maximum(origin, 0)] == slots)
+        displaced = self.current[stations]
+        has_displaced = displaced >= 0
+        leaving = np.concatenate((slots[on_station], displaced[has_displaced]))
+        leave_times = np.concatenate((timestamps[on_station], timestamps[has_displaced]))
+        order = np.lexsort((leave_times, leaving))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = leaving[order][1:] != leaving[order][:-1]
+        self._leave(leaving[order][first], leave_times[order][first])
+        self._enter(timestamps, stations, slots, origin)
+
+        moved = origin >= 0
+        return origin[moved] * len(self.stations) + stations[moved]
+
+    def _leave(self, slots, timestamps):
+        n = len(self.stations)
+        lots = self._lots
+        stations = lots["station"][slots].astype(np.int64)
+        self.processed += np.bincount(stations, minlength=n)
+        self.process_seconds += np.bincount(stations, weights=np.maximum(timestamps - lots["entered"][slots], 0), minlength=n)
+        self.current[stations] = -1
+        lots["left"][slots] = timestamps
+
+        following = self.routes["next"][stations]
+        last = following < 0
+        lots["completed"][slots[last]] = timestamps[last]
+        self.completed += np.bincount(stations[last], minlength=n)
+        self.cycle_seconds += np.bincount(stations[last], weights=timestamps[last] - lots["released"][slots[last]], minlength=n)
+        self.waiting += np.bincount(following[~last], minlength=n)
+
+    def _enter(self, timestamps, stations, slots, origin):
+        n = len(self.stations)
+        lots = self._lots
+        fresh = origin < 0
+        self.released += np.bincount(stations[fresh], minlength=n)
+
+        moved = ~fresh
+        queue = np.maximum(timestamps[moved] - lots["left"][slots[moved]], 0)
+        self.queued += np.bincount(stations[moved], minlength=n)
+        self.queue_seconds += np.bincount(stations[moved], weights=queue, minlength=n)
+        expected = self.routes["next"][origin[moved]]
+        self.waiting -= np.bincount(expected[expected >= 0], minlength=n)
+
+        lots["station"][slots] = stations
+        lots["entered"][slots] = timestamps
+        lots["left"][slots] = np.nan
+        self.current[stations] = slots
+
+        start = self.n_moves
+        self._moves = _reserve(self._moves, MOVE_FIELDS, start + len(slots))
+        self.n_moves += len(slots)
+        self._moves["lot"][start:self.n_moves] = slots
+        self._moves["station"][start:self.n_moves] = stations
+        self._moves["time"][start:self.n_moves] = timestamps
+        self._moves["previous"][start:self.n_moves] = lots["last_move"][slots]
+        lots["last_move"][slots] = np.arange(start, self.n_moves)
+
+    def _add_links(self, keys):
+        if not len(keys):
+            return
+        merged, inverse = np.unique(np.concatenate((self._link_keys, keys)), return_inverse=True)
+        weights = np.concatenate((self._link_counts, np.ones(len(keys), dtype=np.int64)))
+        self._link_keys = merged
+        self._link_counts = np.bincount(inverse, weights=weights, minlength=len(merged)).astype(np.int64)
+
+    # Stations of a lot with the times it entered them, oldest first
+    def genealogy(self, lot_id):
+        with self._lock:
+            slot = self._slots.get(lot_id)
+            if slot is None:
+                return []
+            path = []
+            move = self._lots["last_move"][slot]
+            while move >= 0:
+                path.append((self.stations[self._moves["station"][move]], float(self._moves["time"][move])))
+                move = self._moves["previous"][move]
+        return path[::-1]
+
+    # Moves of `lot_ids` onto `stations` (all when None) in [start, end) in the order they
+    # happened, as column chunks of moves scanned `chunk_rows` at a time: "time", "lot" id,
+    # "station" and the "previous" station, -1 for a lot released onto it
+    def iter_moves(self, stations=None, lot_ids=None, start=-np.inf, end=np.inf, chunk_rows=65536):
+        with self._lock:
+            moves = {name: self.move_column(name) for name in MOVE_FIELDS}
+            ids = self.lot_column("id")
+            slots = None if lot_ids is None else [self._slots[lot_id] for lot_id in lot_ids if lot_id in self._slots]
+        for offset in range(0, len(moves["time"]), chunk_rows):
+            chunk = {name: column[offset:offset + chunk_rows] for name, column in moves.items()}
+            keep = (chunk["time"] >= start) & (chunk["time"] < end)
+            if stations is not None:
+                keep &= np.isin(chunk["station"], stations)
+            if slots is not None:
+                keep &= np.isin(chunk["lot"], slots)
+            if keep.any():
+                previous = chunk["previous"][keep]
+                yield {
+                    "time": chunk["time"][keep],
+                    "lot": ids[chunk["lot"][keep]],
+                    "station": chunk["station"][keep],
+                    "previous": np.where(previous >= 0, moves["station"][np.maximum(previous, 0)], -1),
+                }
+
+    # Per-station lots on the station and queued in front of it, lots processed and
+    # mean processing and queue times in seconds (NaN before the first lot)
+    def station_stats(self):
+        with self._lock:
+            processed, queued = self.processed.copy(), self.queued.copy()
+            return {
+                "on_station": (self.current >= 0).astype(np.int64),
+                "waiting": self.waiting.copy(),
+                "processed": processed,
+                "process_time": np.divide(self.process_seconds, processed, out=np.full(len(processed), np.nan), where=processed > 0),
+                "queue_time": np.divide(self.queue_seconds, queued, out=np.full(len(queued), np.nan), where=queued > 0),
+            }
+
+    # Per-route lots released, completed, in WIP and mean cycle time in seconds
+    def route_summary(self):
+        n_routes = len(self.routes["names"])
+        route = self.routes["route"]
+        with self._lock:
+            released = np.bincount(route, weights=self.released, minlength=n_routes).astype(np.int64)
+            completed = np.bincount(route, weights=self.completed, minlength=n_routes).astype(np.int64)
+            wip = np.bincount(route, weights=(self.current >= 0) + self.waiting, minlength=n_routes).astype(np.int64)
+            cycle_seconds = np.bincount(route, weights=self.cycle_seconds, minlength=n_routes)
+        return {
+            "route": self.routes["names"],
+            "released": released,
+            "completed": completed,
+            "wip": wip,
+            "cycle_time": np.divide(cycle_seconds, completed, out=np.full(n_routes, np.nan), where=completed > 0),
+        }
+
+    # The station of each route with the longest mean processing time, which limits the
+    # throughput of the route, with the lots queued in front of it; -1 for routes no lot
+    # has been processed on yet
+    def bottlenecks(self):
+        stats = self.station_stats()
+        route = self.routes["route"]
+        score = np.where(np.isnan(stats["process_time"]), -1, stats["process_time"])
+        order = np.lexsort((-score, route))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = route[order][1:] != route[order][:-1]
+        stations = order[first]
+        stations = np.where(score[stations] >= 0, stations, -1)
+        return {
+            "route": self.routes["names"],
+            "station": stations,
+            "process_time": np.where(stations >= 0, score[stations], np.nan),
+            "waiting": np.where(stations >= 0, stats["waiting"][stations], 0),
+        }
+
+    # Sankey links of lot moves: node per station, or per stage summed over all routes,
+    # plus "Released" and "Completed". Returns labels, WIP per node and link arrays.
+    def flows(self, by_stage=False):
+        n = len(self.stations)
+        if by_stage:
+            node_of = self.routes["stage"]
+            labels = [f"Stage {stage + 1}" for stage in range(int(node_of.max()) + 1 if n else 0)]
+        else:
+            node_of = np.arange(n)
+            labels = list(self.stations)
+        released_node, completed_node = len(labels), len(labels) + 1
+        n_nodes = len(labels) + 2
+
+        with self._lock:
+            keys, counts = self._link_keys, self._link_counts
+            released, completed = np.flatnonzero(self.released), np.flatnonzero(self.completed)
+            source = np.concatenate((node_of[keys // n], np.full(len(released), released_node), node_of[completed]))
+            target = np.concatenate((node_of[keys % n], node_of[released], np.full(len(completed), completed_node)))
+            values = np.concatenate((counts, self.released[released], self.completed[completed]))
+            wip = np.bincount(node_of, weights=(self.current >= 0) + self.waiting, minlength=n_nodes)
+
+        # Moves back to the same node (rework within a stage) would loop in a Sankey
+        keep = source != target
+        links, inverse = np.unique(source[keep] * n_nodes + target[keep], return_inverse=True)
+        return {
+            "labels": labels + ["Released", "Completed"],
+            "wip": wip.astype(np.int64),
+            "source": links // n_nodes,
+            "target": links % n_nodes,
+            "value": np.bincount(inverse, weights=values[keep]).astype(np.int64),
+        }
+
+
+class LotRecorder:
+    # IngestService listener feeding LOT events to a tracker, starting from the lots
+    # on the stations when the ingest started
+
+    def __init__(self, tracker, service):
+        self.tracker = tracker
+        present = np.flatnonzero(~service.lot_missing)
+        ids, first = np.unique(service.lot[present].astype(np.int64), return_index=True)
+        tracker.move(service.last_change[present[first]], present[first], ids)
+
+    def __call__(self, batch):
+        self.tracker(batch)
+
+
+# Lots flowing through every route of `store` over the last `hours`: each route gets a
+# slower bottleneck station and lots are released a little faster than it can process
+# them, so WIP builds up in front of it. Stations process one lot at a time.
+def generate_synthetic(store, hours=24, seed=0, now=None):
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    tracker = LotTracker(store)
+    routes = tracker.routes
+    n_routes, n_stages = len(routes["names"]), int(routes["stage"].max()) + 1 if len(store) else 0
+    if not n_routes:
+        return tracker
+
+    # Stations of each route by stage, -1 past the end of shorter routes
+    layout = np.full((n_routes, n_stages), -1, dtype=np.int64)
+    layout[routes["route"], routes["stage"]] = np.arange(len(store))
+    mean_time = rng.uniform(180, 480, (n_routes, n_stages))
+    mean_time[np.arange(n_routes), rng.integers(0, np.maximum((layout >= 0).sum(axis=1), 1))] *= 1.6
+    mean_time[layout < 0] = 0
+    bottleneck = mean_time.max(axis=1)
+    n_lots = int(hours * 3600 / bottleneck.min() / 0.95) + 1
+
+    releases = now - hours * 3600 + np.cumsum(rng.exponential(0.95 * bottleneck[:, None], (n_routes, n_lots)), axis=1)
+    durations = rng.exponential(mean_time[:, None, :], (n_routes, n_lots, n_stages))
+    entered = np.empty((n_routes, n_lots, n_stages))
+    ready = releases
+    for stage in range(n_stages):
+        # A lot enters a station once it is ready and the previous lot has been processed:
+        # E[i] = max(ready[i], E[i-1] + p[i-1]), solved as a running maximum
+        processing = durations[:, :, stage]
+        offset = np.zeros((n_routes, n_lots))
+        offset[:, 1:] = np.cumsum(processing[:, :-1], axis=1)
+        entered[:, :, stage] = offset + np.maximum.accumulate(ready - offset, axis=1)
+        ready = entered[:, :, stage] + processing
+
+    ids = 100000 + np.arange(n_routes * n_lots).reshape(n_routes, n_lots)
+    valid = (layout[:, None, :] >= 0) & (entered < now)
+    timestamps = entered[valid]
+    stations = np.broadcast_to(layout[:, None, :], entered.shape)[valid]
+    lot_ids = np.broadcast_to(ids[:, :, None], entered.shape)[valid]
+    order = np.argsort(timestamps, kind="stable")
+    # Fed in chunks of time so the dependency rounds of each call stay short
+    for chunk in np.array_split(order, max(1, len(order) // 50000)):
+        tracker.move(timestamps[chunk], stations[chunk], lot_ids[chunk])
+    return tracker
@@ -0,0 +1,309 @@
+import threading
+import time
+
+import numpy as np
+
+from ingest import SCRAP, UNITS
+from process_store import get_routes
+
+
+# Sums kept per bucket and per lot: material used and wasted (kg), units, scrapped units
+# and the cost of the wasted material
+SUMS = ("used", "waste", "units", "scrap", "cost")
+USED, WASTE, UNITS_SUM, SCRAP_SUM, COST = range(len(SUMS))
+# Bucket lengths of the per-station sums
+BUCKET_SECONDS = 3600
+DAY_SECONDS = 86400
+
+
+def _append(array, size, extra):
+    needed = size + len(extra)
+    if needed > len(array):
+        grown = np.empty((max(needed, 2 * len(array), 1024),) + array.shape[1:], array.dtype)
+        grown[:size] = array[:size]
+        array = grown
+    array[size:needed] = extra
+    return array
+
+
+# Sums of the rows of `sums` per group, shaped (n_groups, len(SUMS))
+def _sum_by(groups, sums, n_groups):
+    return np.stack([np.bincount(groups, weights=sums[:, column], minlength=n_groups) for column in range(len(SUMS))], axis=1)
+
+
+# Yield (material not wasted, % of used), scrap rate (wasted, % of used), scrap cost and
+# material per unit (kg) from sums shaped (..., len(SUMS)), NaN where nothing was used
+def material_metrics(sums):
+    used, waste, units = sums[..., USED], sums[..., WASTE], sums[..., UNITS_SUM]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "used": used,
+            "waste": waste,
+            "units": units,
+            "scrap": sums[..., SCRAP_SUM],
+            "yield": np.where(used > 0, (used - waste) * 100 / used, np.nan),
+            "scrap_rate": np.where(used > 0, waste * 100 / used, np.nan),
+            "scrap_cost": sums[..., COST],
+            "material_per_unit": np.where(units > 0, used / units, np.nan),
+        }
+
+
+# Cost per kg of material of every station from "<default>[,<step>=<cost>...]"
+def parse_costs(spec, stations):
+    default, *overrides = [part.strip() for part in spec.split(",")]
+    costs = np.full(len(stations), float(default or 1))
+    index = {step: number for number, step in enumerate(stations)}
+    for entry in overrides:
+        step, separator, cost = entry.rpartition("=")
+        if not separator or step.strip() not in index:
+            raise ValueError(f"Invalid material cost {entry!r}, expected <step>=<cost per kg> for a known step")
+        costs[index[step.strip()]] = float(cost)
+    return costs
+
+
+class _Buckets:
+    # Sums per (period, station) for periods of `resolution` seconds. Closed periods are
+    # kept as sorted keys (period * stations + station); the current period is a dense row
+    # per station, appended to the keys when a later one starts.
+
+    def __init__(self, resolution, n):
+        self.resolution = resolution
+        self.n = n
+        self.keys = np.empty(0, dtype=np.int64)
+        self.sums = np.empty((0, len(SUMS)))
+        self.size = 0
+        self.period = None
+        self.open = np.zeros((n, len(SUMS)))
+        self.open_seen = np.zeros(n, dtype=bool)
+
+    def add(self, timestamps, stations, sums):
+        periods = (timestamps // self.resolution).astype(np.int64)
+        order = np.argsort(periods, kind="stable")
+        periods, bounds = np.unique(periods[order], return_index=True)
+        for period, rows in zip(periods.tolist(), np.split(order, bounds[1:])):
+            self._add_period(period, stations[rows], sums[rows])
+
+    def _add_period(self, period, stations, sums):
+        if self.period is None or period > self.period:
+            self._close()
+            self.period = period
+        if period == self.period:
+            np.add.at(self.open, stations, sums)
+            self.open_seen[stations] = True
+            return
+
+        # Late records of a closed period
+        keys, inverse = np.unique(period * self.n + stations, return_inverse=True)
+        added = _sum_by(inverse, sums, len(keys))
+        positions = np.searchsorted(self.keys[:self.size], keys)
+        found = positions < self.size
+        found[found] = self.keys[positions[found]] == keys[found]
+        self.sums[positions[found]] += added[found]
+        if not found.all():
+            self.keys = np.insert(self.keys[:self.size], positions[~found], keys[~found])
+            self.sums = np.insert(self.sums[:self.size], positions[~found], added[~found], axis=0)
+            self.size = len(self.keys)
+
+    def _close(self):
+        if self.period is None:
+            return
+        rows = np.flatnonzero(self.open_seen)
+        self.keys = _append(self.keys, self.size, self.period * self.n + rows)
+        self.sums = _append(self.sums, self.size, self.open[rows])
+        self.size += len(rows)
+        self.open[:] = 0
+        self.open_seen[:] = False
+
+    # Keys and sums of the periods in [first, last) as (keys, sums) parts sorted by key:
+    # a view of the closed periods, and the current period when it is in the range
+    def query(self, first, last):
+        low, high = np.searchsorted(self.keys[:self.size], [first * self.n, last * self.n])
+        parts = [(self.keys[low:high], self.sums[low:high])]
+        if self.period is not None and first <= self.period < last:
+            rows = np.flatnonzero(self.open_seen)
+            parts.append((self.period * self.n + rows, self.open[rows].copy()))
+        return parts
+
+
+class MaterialLedger:
+    # Material consumption records (time, station, lot, kg used and wasted, units and
+    # scrapped units) folded into sums as they are appended, so no query reads the
+    # records again: per (hour, station) and (day, station) buckets behind the plant
+    # per-station totals, plant sums per hour behind the trends, and per-lot sums. A long
+    # range reads whole days from the daily buckets and only its ends from the hourly
+    # ones. Lots are attributed to the time of their last record.
+
+    def __init__(self, stations, costs):
+        self.stations = list(stations)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self._hours = _Buckets(BUCKET_SECONDS, len(self.stations))
+        self._days = _Buckets(DAY_SECONDS, len(self.stations))
+        self._plant = _Buckets(BUCKET_SECONDS, 1)
+
+        self._slots = {}
+        self._lot_ids = np.empty(0, dtype=np.int64)
+        self._lot_last = np.empty(0)
+        self._lot_sums = np.empty((0, len(SUMS)))
+        self.n_lots = 0
+        self.records = 0
+        self.version = 0
+        self._lock = threading.RLock()
+
+    # Append records given as arrays of equal length; lot -1 when unknown
+    def append(self, timestamps, stations, lots, used, waste, units, scrap):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not len(timestamps):
+            return
+        stations = np.asarray(stations, dtype=np.int64)
+        lots = np.asarray(lots, dtype=np.int64)
+        sums = np.empty((len(timestamps), len(SUMS)))
+        sums[:, USED], sums[:, WASTE] = used, waste
+        sums[:, UNITS_SUM], sums[:, SCRAP_SUM] = units, scrap
+        sums[:, COST] = sums[:, WASTE] * self.costs[stations]
+
+        with self._lock:
+            self._hours.add(timestamps, stations, sums)
+            self._days.add(timestamps, stations, sums)
+            self._plant.add(timestamps, np.zeros(len(timestamps), dtype=np.int64), sums)
+            known = lots >= 0
+            if known.any():
+                self._add_lots(lots[known], timestamps[known], sums[known])
+            self.records += len(timestamps)
+            self.version += 1
+
+    def _add_lots(self, lots, timestamps, sums):
+        unique, inverse = np.unique(lots, return_inverse=True)
+        slots = np.array([self._slots.get(lot, -1) for lot in unique.tolist()], dtype=np.int64)
+        new = np.flatnonzero(slots < 0)
+        if len(new):
+            slots[new] = np.arange(self.n_lots, self.n_lots + len(new))
+            self._lot_ids = _append(self._lot_ids, self.n_lots, unique[new])
+            self._lot_last = _append(self._lot_last, self.n_lots, np.full(len(new), -np.inf))
+            self._lot_sums = _append(self._lot_sums, self.n_lots, np.zeros((len(new), len(SUMS))))
+            self.n_lots += len(new)
+            self._slots.update(zip(unique[new].tolist(), slots[new].tolist()))
+        np.add.at(self._lot_sums, slots[inverse], sums)
+        np.maximum.at(self._lot_last, slots[inverse], timestamps)
+
+    # Sums per station over the hours in [start, end), shaped (stations, len(SUMS))
+    def station_totals(self, start, end):
+        n = len(self.stations)
+        first, last = int(start // BUCKET_SECONDS), int(np.ceil(end / BUCKET_SECONDS))
+        per_day = DAY_SECONDS // BUCKET_SECONDS
+        first_day, last_day = -(-first // per_day), last // per_day
+        with self._lock:
+            if first_day < last_day:
+                parts = (
+                    self._hours.query(first, first_day * per_day)
+                    + self._days.query(first_day, last_day)
+                    + self._hours.query(last_day * per_day, last)
+                )
+            else:
+                parts = self._hours.query(first, last)
+            return sum(_sum_by(keys % n, sums, n) for keys, sums in parts)
+
+    # Plant sums per hour in [start, end) as (hour starts, sums); with `key_of`, a function
+    # of hour start times returning period keys, per period as (period keys, sums)
+    def trend(self, start, end, key_of=None):
+        with self._lock:
+            parts = self._plant.query(int(start // BUCKET_SECONDS), int(np.ceil(end / BUCKET_SECONDS)))
+            starts = np.concatenate([hours for hours, _ in parts]) * BUCKET_SECONDS
+            totals = np.concatenate([sums for _, sums in parts])
+        if key_of is None:
+            return starts, totals
+        groups, inverse = np.unique(key_of(starts), return_inverse=True)
+        return groups, _sum_by(inverse, totals, len(groups))
+
+    # Lots whose last record is in [start, end) as (lot ids, sums)
+    def lot_totals(self, start, end):
+        with self._lock:
+            last = self._lot_last[:self.n_lots]
+            rows = np.flatnonzero((last >= start) & (last < end))
+            return self._lot_ids[rows], self._lot_sums[rows]
+
+
+class MaterialRecorder:
+    # IngestService listener turning unit and scrap events into material records. Each
+    # unit consumes the station's material per unit (material_used / units of the data
+    # source), of which the station's usual waste share (waste_material / material_used)
+    # is lost; a scrapped unit loses the rest of its material too. Stations without
+    # material figures are not recorded. Events are booked to the lot on the station
+    # after their batch.
+
+    def __init__(self, ledger, service, store):
+        self.ledger = ledger
+        self.service = service
+        self.per_unit, self.waste_share = material_rates(store)
+
+    def __call__(self, batch):
+        kinds, stations = batch["kind"], batch["station"]
+        rows = np.flatnonzero(((kinds == UNITS) | (kinds == SCRAP)) & ~np.isnan(self.per_unit[stations]))
+        if not len(rows):
+            return
+        stations, values = stations[rows], batch["value"][rows]
+        scrapped = kinds[rows] == SCRAP
+        material = values * self.per_unit[stations]
+        share = self.waste_share[stations]
+        lots = np.where(self.service.lot_missing[stations], -1, self.service.lot[stations]).astype(np.int64)
+        self.ledger.append(
+            batch["timestamp"][rows],
+            stations,
+            lots,
+            np.where(scrapped, 0, material),
+            np.where(scrapped, material * (1 - share), material * share),
+            np.where(scrapped, 0, values),
+            np.where(scrapped, values, 0),
+        )
+
+
+# Material per unit (kg) and usual waste share of every station, NaN without figures
+def material_rates(store):
+    used = store.values("material_used", fill=np.nan).astype(np.float64)
+    waste = store.values("waste_material", fill=np.nan).astype(np.float64)
+    units = store.values("units", fill=np.nan).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_unit = np.where((used > 0) & (units > 0), used / units, np.nan)
+        share = np.clip(np.where(used > 0, np.nan_to_num(waste) / used, 0), 0, 1)
+    return per_unit, share
+
+
+# Lots flowing along every route of `store` over the last `days`, one lot an hour per
+# route, each recorded on every station of its route with material figures. Scrap rates
+# differ per station and drift over the period so the trend has a shape.
+def generate_synthetic(store, costs, days=7, lots_per_hour=1.0, seed=0, now=None):
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    ledger = MaterialLedger(store.column("step").tolist(), costs)
+    per_unit, share = material_rates(store)
+    stations = np.flatnonzero(~np.isnan(per_unit))
+    if not len(stations):
+        return ledger
+
+    routes = get_routes(store)
+    n_lots = int(days * 24 * lots_per_hour)
+    releases = now - days * 86400 + np.arange(n_lots) / lots_per_hour * 3600 + rng.uniform(0, 600, n_lots)
+    scrap_rate = rng.uniform(0.002, 0.04, len(store))
+    drift = 1 + 0.5 * np.sin(np.linspace(0, 3 * np.pi, n_lots))
+
+    # One record per (lot, station), stations of a route visited 15 minutes apart
+    for start in range(0, n_lots, max(1, 2_000_000 // len(stations))):
+        lot_rows = np.arange(start, min(n_lots, start + max(1, 2_000_000 // len(stations))))
+        lot_index = np.repeat(lot_rows, len(stations))
+        station = np.tile(stations, len(lot_rows))
+        times = releases[lot_index] + routes["stage"][station] * 900
+        keep = times < now
+        lot_index, station, times = lot_index[keep], station[keep], times[keep]
+        units = rng.integers(40, 120, len(station))
+        scrap = rng.binomial(units, np.minimum(scrap_rate[station] * drift[lot_index], 1))
+        material = units * per_unit[station] * rng.lognormal(0, 0.03, len(station))
+        lost = material * share[station] * rng.lognormal(0, 0.1, len(station))
+        ledger.append(
+            times,
+            station,
+            100000 + lot_index * len(routes["names"]) + routes["route"][station],
+            material,
+            np.minimum(lost + scrap * per_unit[station] * (1 - share[station]), material),
+            units,
+            scrap,
+        )
+    return ledger
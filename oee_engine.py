@@ -0,0 +1,99 @@
+import numpy as np
+
+
+# Raw counters the engine works from, in the order compute_oee takes them
+COUNTER_NAMES = ("planned_time", "run_time", "ideal_cycle_time", "total_count", "good_count")
+KPI_NAMES = ("availability", "performance", "quality", "oee")
+
+
+# Convert input (scalar, list with None, or array) to float64 with NaN for missing entries
+def _as_float(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+# numerator / denominator as a percentage, 0 and masked where either side is missing
+# or the denominator is zero. Returns (percentages, mask) with mask True = undefined.
+def percent(numerator, denominator):
+    numerator = _as_float(numerator)
+    denominator = _as_float(denominator)
+    valid = np.isfinite(numerator) & np.isfinite(denominator) & (denominator != 0)
+    result = np.divide(
+        numerator * 100, denominator,
+        out=np.zeros(np.broadcast_shapes(numerator.shape, denominator.shape)),
+        where=valid,
+    )
+    return result, ~valid
+
+
+# Compute availability, performance, quality and OEE (all in %) for arrays of any
+# broadcastable shape, e.g. (machines,) or (machines, time buckets), in one pass.
+#
+#   availability = run_time / planned_time
+#   performance  = ideal_cycle_time * total_count / run_time
+#   quality      = good_count / total_count
+#   oee          = availability * performance * quality
+#
+# Times must share a unit. Performance is capped at 100% unless clip is False.
+# Returns a dict of KPI arrays plus "<kpi>_mask" arrays marking undefined values.
+def compute_oee(planned_time, run_time, ideal_cycle_time, total_count, good_count, clip=True):
+    run_time = _as_float(run_time)
+    total_count = _as_float(total_count)
+
+    availability, availability_mask = percent(run_time, planned_time)
+    performance, performance_mask = percent(_as_float(ideal_cycle_time) * total_count, run_time)
+    quality, quality_mask = percent(good_count, total_count)
+
+    if clip:
+        np.minimum(performance, 100, out=performance)
+
+    oee_mask = availability_mask | performance_mask | quality_mask
+    oee = np.where(oee_mask, 0, availability * performance * quality / 10000)
+
+    return {
+        "availability": availability,
+        "performance": performance,
+        "quality": quality,
+        "oee": oee,
+        "availability_mask": availability_mask,
+        "performance_mask": performance_mask,
+        "quality_mask": quality_mask,
+        "oee_mask": oee_mask,
+    }
+
+
+# OEE over a coarser period, e.g. hourly buckets summed into a shift along `axis`.
+# Counters are summed first so the KPIs are weighted correctly; ideal cycle time is
+# weighted by total count. Missing counters count as zero within the sum.
+def compute_rolled_up_oee(planned_time, run_time, ideal_cycle_time, total_count, good_count, axis=-1, clip=True):
+    total_count = np.nan_to_num(_as_float(total_count))
+    ideal_time = np.nansum(_as_float(ideal_cycle_time) * total_count, axis=axis)
+    total = total_count.sum(axis=axis)
+    ideal_cycle_time = np.divide(ideal_time, total, out=np.full(total.shape, np.nan), where=total != 0)
+
+    return compute_oee(
+        np.nansum(_as_float(planned_time), axis=axis),
+        np.nansum(_as_float(run_time), axis=axis),
+        ideal_cycle_time,
+        total,
+        np.nansum(_as_float(good_count), axis=axis),
+        clip=clip,
+    )
+
+
+# Replace the KPI columns of a ProcessStore with engine results for every row that has
+# all raw counters; rows without them keep the KPIs supplied by the data source.
+def apply_to_store(store):
+    counters = [store.values(name, fill=np.nan) for name in ("planned_time", "run_time", "ideal_cycle_time", "units", "good_units")]
+    has_counters = np.all([np.isfinite(counter) for counter in counters], axis=0)
+    if not has_counters.any():
+        return store
+
+    kpis = compute_oee(*counters)
+    updates = {}
+    for name in KPI_NAMES:
+        current = store.values(name, fill=np.nan)
+        updates[name] = np.where(has_counters & ~kpis[f"{name}_mask"], np.round(kpis[name], 2), current)
+
+    derived = store.replace(**updates)
+    derived.version = store.version
+    return derived
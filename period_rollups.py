@@ -0,0 +1,309 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from atomic_save import replace_directory
+from oee_engine import compute_oee
+from shift_calendar import LEVELS
+
+
+# Metrics averaged over planned production time. The OEE factors and downtime of
+# stations reporting raw counters come from the summed counters instead.
+GAUGE_METRICS = ("oee", "availability", "performance", "quality", "downtime", "failure_rate")
+# Sums kept per period and station: units produced, and for stations reporting counters
+# the planned seconds they were counted over, run seconds, good units and ideal seconds
+# (ideal cycle time times units), then the planned-time weighted sum of every gauge
+# metric and the planned seconds it was reported for
+FIELDS = (
+    ("units", "counted", "run", "good", "ideal")
+    + tuple(f"{name}_sum" for name in GAUGE_METRICS)
+    + tuple(f"{name}_weight" for name in GAUGE_METRICS)
+)
+UNITS, COUNTED, RUN, GOOD, IDEAL = range(5)
+GAUGE_SUMS = slice(5, 5 + len(GAUGE_METRICS))
+GAUGE_WEIGHTS = slice(5 + len(GAUGE_METRICS), len(FIELDS))
+# Periods kept per level, the oldest is dropped when a new one starts
+RETENTION = {"shift": 9, "day": 7, "week": 4}
+
+# Period the current request reads, as (level, periods before the current one). None
+# reads the live values.
+current_period = contextvars.ContextVar("oee_period", default=None)
+
+
+@contextlib.contextmanager
+def using_period(period):
+    token = current_period.set(period)
+    try:
+        yield period
+    finally:
+        current_period.reset(token)
+
+
+class RollupEngine:
+    # Per-station sums for every shift, production day and week of a ShiftCalendar,
+    # updated in place from each store snapshot: the time since the previous snapshot is
+    # split over the shifts it overlaps, and its counter deltas and planned time are added
+    # to the shift, day and week of each part. Reading a period never looks at older
+    # snapshots. Counters going down (a source resetting them) count from zero.
+
+    def __init__(self, calendar, steps=()):
+        self.calendar = calendar
+        self.steps = []
+        self._step_index = {}
+        # {level: {period key: [version, sums shaped (field, station)]}}
+        self._periods = {level: {} for level in LEVELS}
+        self.version = 0
+        # Time and counters of the last snapshot, None until the next one is a baseline
+        self._previous = None
+        self._rows_of = (None, None)
+        self._stores = {}
+        self._lock = threading.RLock()
+        self._add_steps(steps)
+
+    def _add_steps(self, steps):
+        new = [step for step in dict.fromkeys(steps) if step not in self._step_index]
+        if not new:
+            return
+        for step in new:
+            self._step_index[step] = len(self.steps)
+            self.steps.append(step)
+        padding = len(new)
+        for periods in self._periods.values():
+            for entry in periods.values():
+                entry[1] = np.pad(entry[1], ((0, 0), (0, padding)))
+        if self._previous is not None:
+            timestamp, counters = self._previous
+            self._previous = (timestamp, {name: np.pad(values, (0, padding), constant_values=np.nan) for name, values in counters.items()})
+
+    # Station number of every row of `store`, new steps are added
+    def _rows(self, store):
+        steps = store.column("step")
+        if self._rows_of[0] is not steps:
+            self._add_steps(steps.tolist())
+            self._rows_of = (steps, np.array([self._step_index[step] for step in steps.tolist()], dtype=np.int64))
+        return self._rows_of[1]
+
+    def _period(self, level, key):
+        periods = self._periods[level]
+        entry = periods.get(key)
+        if entry is None:
+            if len(periods) >= RETENTION[level] and key < min(periods):
+                return None
+            entry = periods[key] = [self.version, np.zeros((len(FIELDS), len(self.steps)))]
+            while len(periods) > RETENTION[level]:
+                del periods[min(periods)]
+        entry[0] = self.version
+        return entry[1]
+
+    # The next snapshot only sets the counters later ones are compared with, e.g. after
+    # synthetic history or a gap in recording
+    def reset_baseline(self):
+        with self._lock:
+            self._previous = None
+
+    # Add the time since the previous snapshot with the state in `store` at `timestamp`
+    def add(self, timestamp, store):
+        with self._lock:
+            rows = self._rows(store)
+            n = len(self.steps)
+
+            def gather(values, scale=1):
+                result = np.full(n, np.nan)
+                result[rows] = values * scale
+                return result
+
+            counters = {
+                "units": gather(store.values("units", fill=np.nan)),
+                "run": gather(store.values("run_time", fill=np.nan), 3600),
+                "good": gather(store.values("good_units", fill=np.nan)),
+            }
+            ideal_cycle_time = gather(store.values("ideal_cycle_time", fill=np.nan), 3600)
+            gauges = np.stack([gather(store.values(name, fill=np.nan)) for name in GAUGE_METRICS])
+
+            previous, self._previous = self._previous, (timestamp, counters)
+            if previous is None or timestamp <= previous[0]:
+                return
+            start, previous_counters = previous
+            deltas = {}
+            for name, values in counters.items():
+                before = previous_counters[name]
+                delta = np.where(values >= before, values - before, values)
+                deltas[name] = np.nan_to_num(delta)
+            counted = np.isfinite(counters["run"]) & np.isfinite(counters["good"]) & np.isfinite(ideal_cycle_time) & np.isfinite(counters["units"])
+            reported = np.isfinite(gauges)
+            gauge_values = np.nan_to_num(gauges)
+
+            self.version += 1
+            elapsed = timestamp - start
+            for key, seconds, planned in self.calendar.split(start, timestamp):
+                share = seconds / elapsed
+                units = deltas["units"] * share
+                increments = np.empty((len(FIELDS), n))
+                increments[UNITS] = units
+                increments[COUNTED] = np.where(counted, planned, 0)
+                # Running through a break is not more than the planned time
+                increments[RUN] = np.where(counted, np.minimum(deltas["run"] * share, planned), 0)
+                increments[GOOD] = np.where(counted, deltas["good"] * share, 0)
+                increments[IDEAL] = np.where(counted, np.nan_to_num(ideal_cycle_time) * units, 0)
+                increments[GAUGE_SUMS] = gauge_values * planned
+                increments[GAUGE_WEIGHTS] = reported * planned
+
+                day = self.calendar.day_of_shift(key)
+                for level, period_key in (("shift", key), ("day", day), ("week", self.calendar.week_of_day(day))):
+                    sums = self._period(level, period_key)
+                    if sums is not None:
+                        sums += increments
+
+    # Key of the period `back` periods before the one containing `now`
+    def period_key(self, level, back=0, now=None):
+        return self.calendar.period_key(level, time.time() if now is None else now) - back
+
+    # Columns of a period for the rows of `store`, as arrays with NaN where unknown
+    def period_columns(self, level, key, store):
+        with self._lock:
+            rows = self._rows(store)
+            entry = self._periods[level].get(key)
+            sums = entry[1][:, rows] if entry is not None else np.zeros((len(FIELDS), len(rows)))
+
+        counted = sums[COUNTED] > 0
+        weights = sums[GAUGE_WEIGHTS]
+        means = np.divide(sums[GAUGE_SUMS], weights, out=np.full(weights.shape, np.nan), where=weights > 0)
+        gauges = dict(zip(GAUGE_METRICS, means))
+        observed = counted | (weights > 0).any(axis=0)
+
+        units = sums[UNITS]
+        ideal_cycle_time = np.divide(sums[IDEAL], units, out=np.full(len(units), np.nan), where=units > 0)
+        kpis = compute_oee(sums[COUNTED], sums[RUN], ideal_cycle_time, units, sums[GOOD])
+        columns = {}
+        for name in ("availability", "performance", "quality", "oee"):
+            from_counters = np.where(kpis[f"{name}_mask"], np.nan, kpis[name])
+            columns[name] = np.round(np.where(counted, from_counters, gauges[name]), 2)
+        counted_downtime = np.divide((sums[COUNTED] - sums[RUN]) * 100, sums[COUNTED], out=np.zeros(len(units)), where=counted)
+        columns["downtime"] = np.round(np.where(counted, counted_downtime, gauges["downtime"]), 2)
+        columns["failure_rate"] = np.round(gauges["failure_rate"], 2)
+
+        # Run time against the planned time of the period, from the availability where
+        # there are no counters
+        planned = np.where(counted, sums[COUNTED], weights[GAUGE_METRICS.index("availability")])
+        run = np.where(counted, sums[RUN], gauges["availability"] / 100 * planned)
+        columns["run_time"] = np.where(observed & (planned > 0), run / 3600, np.nan)
+        columns["expected_time"] = np.where(observed & (planned > 0), planned / 3600, np.nan)
+        columns["planned_time"] = np.where(counted, sums[COUNTED] / 3600, np.nan)
+        columns["units"] = np.where(observed, np.round(units), np.nan)
+        columns["good_units"] = np.where(counted, np.round(sums[GOOD]), np.nan)
+        return columns
+
+    # `store` with the KPIs, units and times of a period in place of the live ones. The
+    # version is that of the period's last update, so it only changes while the period
+    # is running. Built once per period update and store.
+    def period_store(self, store, level, back=0, now=None):
+        key = self.period_key(level, back, now)
+        with self._lock:
+            entry = self._periods[level].get(key)
+            version = entry[0] if entry is not None else 0
+            cached = self._stores.get((level, key))
+            if cached is not None and cached[0] == version and cached[1] is store:
+                return cached[2]
+
+        derived = store.replace(**self.period_columns(level, key, store))
+        derived.version = version
+        with self._lock:
+            self._stores = {
+                cache_key: value for cache_key, value in self._stores.items()
+                if cache_key[1] in self._periods[cache_key[0]]
+            }
+            self._stores[(level, key)] = (version, store, derived)
+        return derived
+
+    def has_period(self, level, key):
+        with self._lock:
+            return key in self._periods[level]
+
+    # Save the periods as .npy files with an index that load() reads back. The directory
+    # is replaced as a whole, so a save never leaves arrays and index from different ones.
+    def save(self, directory):
+        replace_directory(directory, self._write)
+
+    def _write(self, directory):
+        index = {"steps": self.steps, "fields": list(FIELDS), "calendar": self.calendar.signature(), "levels": {}}
+        with self._lock:
+            for level, periods in self._periods.items():
+                keys = sorted(periods)
+                index["levels"][level] = {"keys": keys, "versions": [periods[key][0] for key in keys]}
+                sums = np.stack([periods[key][1] for key in keys]) if keys else np.zeros((0, len(FIELDS), len(self.steps)))
+                np.save(os.path.join(directory, f"{level}.npy"), sums)
+            index["version"] = self.version
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(index, f)
+
+    # Rollups saved by save(). Rollups saved under another shift pattern or with other
+    # fields are not loaded, their period keys or sums mean something else.
+    @classmethod
+    def load(cls, directory, calendar):
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        engine = cls(calendar, index["steps"])
+        if index["fields"] != list(FIELDS) or index["calendar"] != calendar.signature():
+            return engine
+        for level, saved in index["levels"].items():
+            sums = np.load(os.path.join(directory, f"{level}.npy"))
+            engine._periods[level] = {
+                key: [version, np.array(sums[position])]
+                for position, (key, version) in enumerate(zip(saved["keys"], saved["versions"]))
+            }
+        engine.version = index["version"]
+        return engine
+
+
+# Rollups of `days` synthetic days up to `now` for the stations of `store`: snapshots every
+# `step` seconds with the KPIs drifting around the store's values, fed through add() like
+# recorded ones. Deterministic for a given store, now and seed.
+def generate_synthetic(store, calendar, days=7, step=900, seed=0, now=None):
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    engine = RollupEngine(calendar, store.column("step").tolist())
+    n = len(store)
+
+    def base(name, default):
+        values = store.values(name, fill=np.nan)
+        return np.where(np.isfinite(values) & (values > 0), values, default) / 100
+
+    availability, performance, quality = base("availability", 80), base("performance", 85), base("quality", 95)
+    failure_rate = store.values("failure_rate", fill=np.nan)
+    ideal_cycle_time = store.values("ideal_cycle_time", fill=np.nan) * 3600
+    has_counters = np.isfinite(ideal_cycle_time) & ~store.missing("good_units")
+    # Stations without counters produce their current units over a shift of running
+    units_rate = store.values("units", fill=0) / (8 * 3600 * availability)
+
+    run = np.zeros(n)
+    units = np.zeros(n)
+    good = np.zeros(n)
+    start = now - days * 86400
+    for timestamp in np.arange(start, now, step).tolist() + [now]:
+        planned = calendar.planned_seconds(timestamp - step, timestamp)
+        a = np.clip(availability + rng.normal(0, 0.05, n), 0, 1)
+        p = np.clip(performance + rng.normal(0, 0.03, n), 0, 1)
+        q = np.clip(quality + rng.normal(0, 0.01, n), 0, 1)
+        produced = np.floor(np.where(has_counters, a * planned * p / np.where(has_counters, ideal_cycle_time, 1), units_rate * a * planned))
+        run += a * planned
+        units += produced
+        good += np.floor(produced * q)
+        snapshot = store.replace(
+            units=units.copy(),
+            good_units=np.where(has_counters, good, np.nan),
+            run_time=run / 3600,
+            availability=a * 100,
+            performance=p * 100,
+            quality=q * 100,
+            oee=a * p * q * 100,
+            downtime=(1 - a) * 100,
+            failure_rate=np.clip(failure_rate + rng.normal(0, 0.5, n), 0, None),
+        )
+        engine.add(timestamp, snapshot)
+    engine.reset_baseline()
+    return engine
@@ -0,0 +1,353 @@
+import csv
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from oee_engine import apply_to_store
+
+
+# Sample Data
+SAMPLE_PROCESSES = [
+    {"step": "Paste Grinding", "status": "Running", "lot": 20005, "units": 1043, "run_time": 1.3, "expected_time": 1.5, "downtime": 8, "failure_rate": 5, "availability": 86.67, "performance": 86.67, "quality":95, "oee":71.36},
+    {"step": "Machine 1", "status": "Running", "lot": 20002, "units": 205, "run_time": 20, "expected_time": 30, "downtime": 12, "failure_rate": None, "availability": 66.67, "performance": 66.67, "material_used": 32.4, "waste_material": 4.2, "quality":100, "oee":44.44},
+    {"step": "Machine 2", "status": "Running", "lot": 20004, "units": 102, "run_time": 74, "expected_time": 108, "downtime": 40, "failure_rate": None, "availability": 68.52, "performance": 68.52, "material_used": 42.5, "waste_material": 5.3, "quality":100, "oee":46.95},
+    {"step": "Machine 3", "status": "Stopped", "lot": None, "units": 733, "run_time": None, "expected_time": None, "downtime": 3, "failure_rate": None, "availability": 0, "performance": 0, "quality":97, "oee":0},
+    {"step": "Furnace", "status": "Running", "lot": 19999, "units": 1037, "run_time": 8, "expected_time": 10, "downtime": 4, "failure_rate": None, "availability": 80, "performance": 80, "quality":100, "oee":64},
+    {"step": "Wirecut", "status": "Running", "lot": 20000, "units": 1036, "run_time": 3, "expected_time": 4, "downtime": 15, "failure_rate": None, "availability": 75, "performance": 75, "quality":100, "oee":56.25},
+    {"step": "Machining", "status": "Stopped", "lot": None, "units": 1035, "run_time": None, "expected_time": None, "downtime": 20, "failure_rate": 4, "availability": 0, "performance": 0, "quality":96, "oee":0},
+    {"step": "Dimension Measurement", "status": "Running", "lot": 19998, "units": 1034, "run_time": 1, "expected_time": 3, "downtime": 30, "failure_rate": 4, "availability": 33.33, "performance": 33.33, "quality":96, "oee":10.67},
+    {"step": "Tensile Strength Measurement", "status": "Running", "lot": 19998, "units": 1034, "run_time": 0.5, "expected_time": 1, "downtime": 14, "failure_rate": 10, "availability": 50, "performance": 50, "quality":90, "oee":22.5},
+    {"step": "Packing", "status": "Running", "lot": 19997, "units": 1033, "run_time": 1, "expected_time": 1, "downtime": 70, "failure_rate": None, "availability": 100, "performance": 100, "quality":100, "oee":100},
+    {"step": "Shipping", "status": "Running", "lot": 19996, "units": 1032, "run_time": 1, "expected_time": 2, "downtime": 70, "failure_rate": None, "availability": 50, "performance": 50, "quality":100, "oee":25},
+]
+
+STRING_COLUMNS = ("step", "status", "plant", "area", "line")
+INTEGER_COLUMNS = ("lot", "units", "good_units")
+FLOAT_COLUMNS = (
+    "run_time", "expected_time", "downtime", "failure_rate",
+    "availability", "performance", "quality", "oee",
+    "material_used", "waste_material",
+    # Optional raw counters, when present the KPIs are derived from them by oee_engine
+    "planned_time", "ideal_cycle_time",
+)
+NUMERIC_COLUMNS = INTEGER_COLUMNS + FLOAT_COLUMNS
+COLUMNS = STRING_COLUMNS + NUMERIC_COLUMNS
+
+
+class ProcessStore:
+    # Column-oriented process data: one NumPy array per field plus a boolean mask
+    # per numeric field marking missing values (True = missing).
+
+    def __init__(self, columns, masks, version=0):
+        self._columns = columns
+        self._masks = masks
+        self.version = version
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self._columns["step"])
+
+    # Raw column array, missing numeric entries hold 0
+    def column(self, name):
+        return self._columns[name]
+
+    # Boolean mask of missing values for a column
+    def missing(self, name):
+        if name in STRING_COLUMNS:
+            return np.zeros(len(self), dtype=bool)
+        return self._masks[name]
+
+    # Numeric column with missing entries replaced by `fill`
+    def values(self, name, fill=0):
+        values = self._columns[name]
+        mask = self._masks[name]
+        if not mask.any():
+            return values
+        if np.isnan(fill):
+            values = values.astype(np.float64)
+        return np.where(mask, fill, values)
+
+    # A single process as a dict, with None for missing values
+    def record(self, index):
+        record = {name: self._columns[name][index] for name in STRING_COLUMNS}
+        for name in NUMERIC_COLUMNS:
+            if self._masks[name][index]:
+                record[name] = None
+            else:
+                record[name] = self._columns[name][index].item()
+        return record
+
+    def records(self):
+        return [self.record(index) for index in range(len(self))]
+
+    def index_of(self, step):
+        matches = np.flatnonzero(self._columns["step"] == step)
+        return int(matches[0]) if len(matches) else None
+
+    # Hash of the contents, equal for equal data in every process (unlike version)
+    def fingerprint(self):
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for name in STRING_COLUMNS:
+                digest.update("\0".join(map(str, self._columns[name])).encode())
+            for name in NUMERIC_COLUMNS:
+                digest.update(self._columns[name].tobytes())
+                digest.update(self._masks[name].tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    # Hash of the contents of each row, to tell which processes changed between two stores
+    def row_fingerprints(self):
+        # Every numeric column is 8 bytes wide, so the rows of all of them form one byte matrix
+        numeric = np.column_stack([self._columns[name].view(np.uint64) for name in NUMERIC_COLUMNS])
+        masks = np.column_stack([self._masks[name] for name in NUMERIC_COLUMNS])
+        strings = ["\0".join(row) for row in zip(*(map(str, self._columns[name]) for name in STRING_COLUMNS))]
+        return [
+            hashlib.blake2b(numeric[index].tobytes() + masks[index].tobytes() + strings[index].encode(), digest_size=16).hexdigest()
+            for index in range(len(self))
+        ]
+
+    # Names of the columns whose values or missing masks differ from `other`
+    def changed_columns(self, other):
+        if len(self) != len(other):
+            return list(COLUMNS)
+        changed = [
+            name for name in STRING_COLUMNS
+            if not np.array_equal(self._columns[name], other._columns[name])
+        ]
+        changed += [
+            name for name in NUMERIC_COLUMNS
+            if not np.array_equal(self._masks[name], other._masks[name])
+            or not np.array_equal(self._columns[name], other._columns[name])
+        ]
+        return changed
+
+    # New store sharing unchanged columns, with `updates` replacing whole columns
+    def replace(self, **updates):
+        columns = dict(self._columns)
+        masks = dict(self._masks)
+        for name, values in updates.items():
+            if name in STRING_COLUMNS:
+                columns[name] = _to_strings(values)
+            else:
+                columns[name], masks[name] = _to_numeric(name, values)
+        return ProcessStore(columns, masks, version=self.version + 1)
+
+    @classmethod
+    def from_columns(cls, data, version=0):
+        n_rows = len(data["step"])
+        columns = {}
+        masks = {}
+        for name in STRING_COLUMNS:
+            columns[name] = _to_strings(data.get(name, [""] * n_rows))
+        for name in NUMERIC_COLUMNS:
+            columns[name], masks[name] = _to_numeric(name, data.get(name, [None] * n_rows))
+        return cls(columns, masks, version=version)
+
+    @classmethod
+    def from_records(cls, records, version=0):
+        data = {name: [record.get(name) for record in records] for name in COLUMNS}
+        return cls.from_columns(data, version=version)
+
+
+# Object array of strings with "" for missing values
+def _to_strings(values):
+    strings = np.asarray(values, dtype=object)
+    missing = np.array([value is None for value in strings], dtype=bool)
+    if missing.any():
+        strings = np.where(missing, "", strings)
+    return strings
+
+
+# Convert a sequence (or array) with None/NaN/"" for missing values into (values, mask)
+def _to_numeric(name, values):
+    dtype = np.int64 if name in INTEGER_COLUMNS else np.float64
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        mask = np.isnan(values) if values.dtype.kind == "f" else np.zeros(len(values), dtype=bool)
+        return np.where(mask, 0, values).astype(dtype), mask
+
+    raw = np.asarray(values, dtype=object)
+    mask = np.array([value is None or value == "" or value != value for value in raw], dtype=bool)
+    raw = np.where(mask, 0, raw)
+    return raw.astype(np.float64).astype(dtype), mask
+
+
+# Data source adapters
+
+def load_sample():
+    return ProcessStore.from_records(SAMPLE_PROCESSES)
+
+
+def load_csv(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    data = {name: [row.get(name, "") for row in rows] for name in COLUMNS}
+    return ProcessStore.from_columns(data)
+
+
+def load_parquet(path):
+    # pyarrow is optional, only needed for Parquet sources
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    data = {}
+    for name in COLUMNS:
+        if name not in table.column_names:
+            continue
+        column = table.column(name)
+        if name in STRING_COLUMNS:
+            data[name] = column.to_pylist()
+        else:
+            data[name] = column.cast("double").to_numpy(zero_copy_only=False)
+    return ProcessStore.from_columns(data)
+
+
+def load_sqlite(path, table="processes"):
+    with sqlite3.connect(path) as connection:
+        cursor = connection.execute(f"SELECT * FROM {table}")
+        names = [description[0] for description in cursor.description]
+        rows = cursor.fetchall()
+    data = {
+        name: [row[names.index(name)] for row in rows] if name in names else [None] * len(rows)
+        for name in COLUMNS
+    }
+    return ProcessStore.from_columns(data)
+
+
+# Write a store into a SQLite table, handy for standing up a local database source
+def write_sqlite(store, path, table="processes"):
+    with sqlite3.connect(path) as connection:
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.execute(f"CREATE TABLE {table} ({', '.join(COLUMNS)})")
+        connection.executemany(
+            f"INSERT INTO {table} VALUES ({', '.join('?' * len(COLUMNS))})",
+            [[record[name] for name in COLUMNS] for record in store.records()],
+        )
+
+
+# Synthetic plant of n stations (argument, default 1000) spread over plants, areas and
+# lines, with KPIs derived from generated counters. Deterministic for a given n and seed.
+def load_synthetic(argument="", seed=0):
+    n = int(argument or 1000)
+    rng = np.random.default_rng(seed)
+    station = np.arange(n)
+    line = station // 10
+    area = line // 10
+    plant = area // 10
+
+    running = rng.random(n) > 0.1
+    planned_time = np.full(n, 8.0)
+    run_time = np.where(running, rng.uniform(3, 8, n), np.nan)
+    ideal_cycle_time = rng.uniform(0.002, 0.01, n)
+    units = np.where(running, np.floor(run_time / ideal_cycle_time * rng.uniform(0.5, 1, n)), rng.integers(0, 500, n))
+    good_units = np.floor(units * rng.uniform(0.85, 1, n))
+    material_used = rng.uniform(20, 50, n)
+
+    data = {
+        "step": [f"Station {index:05d}" for index in station],
+        "status": np.where(running, "Running", "Stopped").tolist(),
+        "plant": [f"Plant {index + 1}" for index in plant],
+        "area": [f"Area {index + 1}" for index in area],
+        "line": [f"Line {index + 1}" for index in line],
+        "lot": np.where(running, 20000 + rng.integers(0, 5000, n), np.nan),
+        "units": units,
+        "good_units": good_units,
+        "planned_time": planned_time,
+        "run_time": run_time,
+        "expected_time": np.where(running, planned_time, np.nan),
+        "ideal_cycle_time": ideal_cycle_time,
+        "downtime": np.round(rng.uniform(0, 60, n), 1),
+        "failure_rate": np.where(rng.random(n) > 0.5, np.round(rng.uniform(0, 10, n), 1), np.nan),
+        "availability": np.zeros(n),
+        "performance": np.zeros(n),
+        "quality": np.zeros(n),
+        "oee": np.zeros(n),
+        "material_used": np.round(material_used, 1),
+        "waste_material": np.round(material_used * rng.uniform(0.02, 0.2, n), 1),
+    }
+    return ProcessStore.from_columns(data)
+
+
+LOADERS = {
+    "sample": lambda argument: load_sample(),
+    "synthetic": load_synthetic,
+    "csv": load_csv,
+    "parquet": load_parquet,
+    "sqlite": load_sqlite,
+}
+
+
+# Load a store from a source spec such as "sample", "csv:data.csv", "sqlite:plant.db"
+# or "synthetic:5000"
+def load_store(spec="sample"):
+    kind, _, argument = spec.partition(":")
+    if kind not in LOADERS:
+        raise ValueError(f"Unknown data source '{kind}', expected one of {sorted(LOADERS)}")
+    return apply_to_store(LOADERS[kind](argument))
+
+
+# Vectorised queries used by the plant overview
+
+# Indices of the n rows with the largest (or smallest) values among rows where
+# `rows` is True, sorted best first. Uses a partial sort so it stays O(len).
+def rank_rows(values, n, largest=True, rows=None):
+    candidates = np.flatnonzero(rows) if rows is not None else np.arange(len(values))
+    selected = values[candidates]
+    if largest:
+        selected = -selected
+    if n < len(candidates):
+        part = np.argpartition(selected, n)[:n]
+    else:
+        part = np.arange(len(candidates))
+    return candidates[part[np.argsort(selected[part], kind="stable")]]
+
+
+# Per-group aggregates of the rows where `rows` is True, grouped by a string column.
+# Returns a dict of arrays: group, stations, running, oee, availability, downtime, units.
+def summarise_by(store, column, rows=None):
+    if rows is None:
+        rows = np.ones(len(store), dtype=bool)
+    groups, inverse = np.unique(store.column(column)[rows].astype(str), return_inverse=True)
+    stations = np.bincount(inverse, minlength=len(groups))
+    running = np.bincount(inverse, weights=store.column("status")[rows] == "Running", minlength=len(groups))
+
+    summary = {"group": groups, "stations": stations, "running": running.astype(np.int64)}
+    for name in ("oee", "availability", "downtime"):
+        present = ~store.missing(name)[rows]
+        totals = np.bincount(inverse, weights=np.where(present, store.values(name)[rows], 0), minlength=len(groups))
+        counts = np.bincount(inverse, weights=present, minlength=len(groups))
+        summary[name] = np.divide(totals, counts, out=np.zeros(len(groups)), where=counts > 0)
+    summary["units"] = np.bincount(inverse, weights=store.values("units")[rows], minlength=len(groups)).astype(np.int64)
+    return summary
+
+
+# Routing of lots through the plant: the stations of one plant, area and line form a
+# route in the order they are listed, which is the single route of the sample. Returns a
+# dict of arrays per station: route number, stage (position on the route) and the
+# previous and next station on the route (-1 at either end), plus the route names.
+def get_routes(store):
+    plant, area, line = (store.column(name).astype(str) for name in ("plant", "area", "line"))
+    keys = np.char.add(np.char.add(np.char.add(np.char.add(plant, "/"), area), "/"), line)
+    names, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # Number routes in the order of their first station
+    by_appearance = np.argsort(first, kind="stable")
+    route = np.argsort(by_appearance)[inverse]
+
+    order = np.argsort(route, kind="stable")
+    starts = np.searchsorted(route[order], np.arange(len(names)))
+    stage = np.empty(len(store), dtype=np.int64)
+    stage[order] = np.arange(len(store)) - starts[route[order]]
+
+    previous = np.full(len(store), -1, dtype=np.int64)
+    following = np.full(len(store), -1, dtype=np.int64)
+    same_route = route[order][1:] == route[order][:-1]
+    previous[order[1:][same_route]] = order[:-1][same_route]
+    following[order[:-1][same_route]] = order[1:][same_route]
+    return {
+        "route": route,
+        "stage": stage,
+        "previous": previous,
+        "next": following,
+        "names": [name.strip("/") or "Main" for name in names[by_appearance].tolist()],
+    }
@@ -0,0 +1,236 @@
+import argparse
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from process_store import NUMERIC_COLUMNS, STRING_COLUMNS, ProcessStore, load_store
+
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = "store.bin"
+LOCK_FILE = "updater.lock"
+MAGIC = b"OEESTORE"
+# Magic and header length, followed by the JSON header and the aligned column data
+PREFIX = struct.Struct("<8sQ")
+ALIGNMENT = 64
+# Seconds between two attempts of a reader to take over a vanished updater
+ELECTION_INTERVAL = 5
+
+
+# tmpfs when available so the mapped file never touches a disk
+def default_directory():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "oee-dashboard")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# Write `store` as one file of raw column arrays under `version`. The file is replaced
+# atomically, readers holding the previous mapping keep reading consistent data.
+def write_store(directory, store, version):
+    arrays = [(name, "column", np.asarray(store.column(name), dtype=str)) for name in STRING_COLUMNS]
+    for name in NUMERIC_COLUMNS:
+        arrays.append((name, "column", np.ascontiguousarray(store.column(name))))
+        arrays.append((name, "mask", np.ascontiguousarray(store.missing(name))))
+
+    entries = []
+    offset = 0
+    for name, kind, array in arrays:
+        entries.append({"name": name, "kind": kind, "dtype": array.dtype.str, "offset": offset, "count": len(array)})
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        "version": version,
+        "fingerprint": store.fingerprint(),
+        "written": time.time(),
+        "arrays": entries,
+    }).encode()
+    data_start = _align(PREFIX.size + len(header))
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for entry, (_, _, array) in zip(entries, arrays):
+            f.seek(data_start + entry["offset"])
+            f.write(array.tobytes())
+    # mkstemp creates owner-only files, workers may run as another user than the updater
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, os.path.join(directory, DATA_FILE))
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        magic, length = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a shared process store")
+        return json.loads(f.read(length))
+
+
+class SharedStoreReader:
+    # Maps the published file and serves it as a ProcessStore. Numeric columns and masks
+    # are read-only views of the mapping; string columns are decoded once and reused
+    # while their bytes do not change. Checking for a new version is a single stat().
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, DATA_FILE)
+        self.store = None
+        self._file_key = None
+        self._raw_strings = {}
+
+    # Latest published store, or None before anything was published
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.store
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._file_key:
+            self._file_key = key
+            self.store = self._map()
+        return self.store
+
+    def _map(self):
+        with open(self.path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = PREFIX.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a shared process store")
+        header = json.loads(buffer[PREFIX.size:PREFIX.size + length])
+        data_start = _align(PREFIX.size + length)
+
+        columns = {}
+        masks = {}
+        for entry in header["arrays"]:
+            array = np.frombuffer(buffer, dtype=entry["dtype"], count=entry["count"], offset=data_start + entry["offset"])
+            if entry["kind"] == "mask":
+                masks[entry["name"]] = array
+            elif entry["name"] in STRING_COLUMNS:
+                columns[entry["name"]] = self._decode_strings(entry["name"], array)
+            else:
+                columns[entry["name"]] = array
+
+        store = ProcessStore(columns, masks, version=header["version"])
+        store._fingerprint = header["fingerprint"]
+        return store
+
+    def _decode_strings(self, name, raw):
+        previous = self._raw_strings.get(name)
+        if previous is not None and previous[0].dtype == raw.dtype and np.array_equal(previous[0], raw):
+            return previous[1]
+        strings = raw.astype(object)
+        self._raw_strings[name] = (raw.copy(), strings)
+        return strings
+
+
+class UpdaterLock:
+    # Exclusive lock on a file in the shared directory, held by the single updater.
+    # The kernel releases it when the holding process exits.
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, LOCK_FILE)
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        if self._file is None:
+            f = open(self.path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._file = f
+        return True
+
+
+class SharedStateUpdater:
+    # Elects one process among those sharing `directory` to call read_latest() every
+    # `interval` seconds and publish changed data under a new version. Every process
+    # calls try_start(); the first to get the lock runs the updater thread and, if
+    # given, on_elected() first (e.g. to start the event ingest only there).
+
+    def __init__(self, directory, read_latest, interval=1.0, on_elected=None):
+        self.directory = directory
+        self.read_latest = read_latest
+        self.interval = interval
+        self.on_elected = on_elected
+        self.lock = UpdaterLock(directory)
+        self._last_attempt = 0.0
+
+    def try_start(self):
+        now = time.monotonic()
+        if self.lock.held:
+            return True
+        if self._last_attempt and now - self._last_attempt < ELECTION_INTERVAL:
+            return False
+        self._last_attempt = now
+        if not self.lock.acquire():
+            return False
+
+        if self.on_elected is not None:
+            self.on_elected()
+        threading.Thread(target=self._run, name="oee-shared-updater", daemon=True).start()
+        return True
+
+    def _run(self):
+        path = os.path.join(self.directory, DATA_FILE)
+        version = read_header(path)["version"] if os.path.exists(path) else 0
+        published = None
+        while True:
+            try:
+                latest = self.read_latest()
+                if published is None or latest.changed_columns(published):
+                    version += 1
+                    write_store(self.directory, latest, version)
+                    published = latest
+            except Exception:
+                # A half-written source file or a failing database must not stop the updater
+                logger.exception("Publishing shared state failed")
+            time.sleep(self.interval)
+
+
+# Dedicated updater process, so no web worker reads the data source itself
+def main():
+    from ingest import IngestService, create_transport
+
+    parser = argparse.ArgumentParser(description="Publish process data to the shared state read by the dashboard workers.")
+    parser.add_argument("--directory", default=default_directory())
+    parser.add_argument("--source", default=os.environ.get("OEE_DATA_SOURCE", "sample"))
+    parser.add_argument("--ingest", default=os.environ.get("OEE_INGEST", "off"), help="event transport, as OEE_INGEST")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.ingest != "off":
+        service = IngestService(load_store(args.source), create_transport(args.ingest))
+        read_latest = service.snapshot
+        on_elected = service.start_in_thread
+    else:
+        read_latest = lambda: load_store(args.source)
+        on_elected = None
+
+    updater = SharedStateUpdater(args.directory, read_latest, args.interval, on_elected)
+    if not updater.try_start():
+        raise SystemExit(f"Another updater already publishes to {args.directory}")
+    print(f"Publishing {args.source} to {args.directory} every {args.interval:g}s")
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == "__main__":
+    main()
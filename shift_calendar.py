@@ -0,0 +1,189 @@
+import bisect
+import calendar
+import re
+import time
+
+import numpy as np
+
+
+# Three eight-hour shifts starting at 06:00
+DEFAULT_SHIFTS = "Early=06:00-14:00,Late=14:00-22:00,Night=22:00-06:00"
+DAY_SECONDS = 86400
+# Period levels, from the finest
+LEVELS = ("shift", "day", "week")
+TIME_OF_DAY = re.compile(r"^(\d{1,2}):(\d{2})$")
+LOCAL_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+# "06:30" as seconds after midnight, "24:00" is accepted as the end of a day
+def parse_time_of_day(text):
+    match = TIME_OF_DAY.match(text.strip())
+    if not match or int(match[2]) > 59 or int(match[1]) * 60 + int(match[2]) > 24 * 60:
+        raise ValueError(f"Invalid time of day {text!r}, expected HH:MM")
+    return int(match[1]) * 3600 + int(match[2]) * 60
+
+
+# "HH:MM-HH:MM" as (start, length) in seconds. A window ending at or before its start
+# runs past midnight, one starting and ending at the same time lasts the whole day.
+def parse_daily_window(text):
+    start, separator, end = text.partition("-")
+    if not separator:
+        raise ValueError(f"Invalid time window {text!r}, expected HH:MM-HH:MM")
+    start, end = parse_time_of_day(start), parse_time_of_day(end)
+    return start % DAY_SECONDS, (end - start) % DAY_SECONDS or DAY_SECONDS
+
+
+# Merge overlapping (start, end) intervals, sorted by start
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+class ShiftCalendar:
+    # Shifts repeating every day, daily breaks and one-off planned stops, in local time at
+    # a fixed UTC offset. A production day starts with its first shift, so a night shift
+    # running past midnight belongs to the day it started on. Shift keys number shifts
+    # since the epoch (day * shifts per day + position), so the shift before key k is
+    # k - 1 across days too; days count from the epoch and weeks start on Mondays.
+    # Breaks and planned stops are not planned production time.
+
+    def __init__(self, shifts, breaks=(), planned_stops=(), utc_offset=0):
+        # shifts as (name, start, length) and breaks as (start, length) in seconds of the
+        # day, planned stops as (start, end) in epoch seconds
+        if not shifts:
+            raise ValueError("A shift calendar needs at least one shift")
+        shifts = sorted(shifts, key=lambda shift: shift[1])
+        self.names = [name for name, _, _ in shifts]
+        self.day_start = shifts[0][1]
+        self.offsets = [start - self.day_start for _, start, _ in shifts]
+        self.lengths = [length for _, _, length in shifts]
+        for position, (offset, length) in enumerate(zip(self.offsets, self.lengths)):
+            next_offset = self.offsets[position + 1] if position + 1 < len(shifts) else DAY_SECONDS
+            if offset + length > next_offset:
+                raise ValueError(f"Shift {self.names[position]!r} overlaps the next one")
+        self.breaks = [((start - self.day_start) % DAY_SECONDS, length) for start, length in breaks]
+        self.planned_stops = _merge(planned_stops)
+        self._stop_starts = [start for start, _ in self.planned_stops]
+        self.utc_offset = utc_offset
+
+    # Calendar from the OEE_SHIFTS, OEE_SHIFT_BREAKS and OEE_PLANNED_STOPS settings, at
+    # the local UTC offset unless one is given
+    @classmethod
+    def from_spec(cls, shifts, breaks="", planned_stops="", utc_offset=None):
+        if utc_offset is None:
+            utc_offset = time.localtime().tm_gmtoff
+        parsed_shifts = []
+        for entry in filter(None, (part.strip() for part in shifts.split(","))):
+            name, separator, window = entry.partition("=")
+            if not separator or not name.strip():
+                raise ValueError(f"Invalid shift {entry!r}, expected <name>=HH:MM-HH:MM")
+            parsed_shifts.append((name.strip(), *parse_daily_window(window)))
+        parsed_breaks = [parse_daily_window(entry) for entry in filter(None, (part.strip() for part in breaks.split(",")))]
+        parsed_stops = []
+        for entry in filter(None, (part.strip() for part in planned_stops.split(","))):
+            start, separator, end = entry.partition("/")
+            if not separator:
+                raise ValueError(f"Invalid planned stop {entry!r}, expected <start>/<end> as {LOCAL_TIME_FORMAT}")
+            start, end = (calendar.timegm(time.strptime(value.strip(), LOCAL_TIME_FORMAT)) - utc_offset for value in (start, end))
+            if end <= start:
+                raise ValueError(f"Planned stop {entry!r} ends before it starts")
+            parsed_stops.append((start, end))
+        return cls(parsed_shifts, parsed_breaks, parsed_stops, utc_offset)
+
+    # Settings the period keys depend on, rollups saved under other ones do not apply
+    def signature(self):
+        return [self.names, self.day_start, self.offsets, self.lengths, self.utc_offset]
+
+    def _day_origin(self, day):
+        return day * DAY_SECONDS + self.day_start - self.utc_offset
+
+    def day_of(self, timestamp):
+        return int((timestamp + self.utc_offset - self.day_start) // DAY_SECONDS)
+
+    def day_of_shift(self, key):
+        return key // len(self.names)
+
+    def week_of_day(self, day):
+        # Day 0, 1970-01-01, was a Thursday
+        return (day + 3) // 7
+
+    # Shift running at `timestamp`, or the last one started before it between shifts
+    def shift_of(self, timestamp):
+        day = self.day_of(timestamp)
+        position = bisect.bisect_right(self.offsets, timestamp - self._day_origin(day)) - 1
+        return day * len(self.names) + position
+
+    # shift_of for an array of timestamps
+    def shift_keys(self, timestamps):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        days = np.floor((timestamps + self.utc_offset - self.day_start) / DAY_SECONDS).astype(np.int64)
+        origins = days * DAY_SECONDS + self.day_start - self.utc_offset
+        positions = np.searchsorted(self.offsets, timestamps - origins, side="right") - 1
+        return days * len(self.names) + positions
+
+    # Key of the shift, day or week containing `timestamp`
+    def period_key(self, level, timestamp):
+        if level == "shift":
+            return self.shift_of(timestamp)
+        day = self.day_of(timestamp)
+        return day if level == "day" else self.week_of_day(day)
+
+    # (start, end) in epoch seconds of a period
+    def period_bounds(self, level, key):
+        if level == "shift":
+            day, position = divmod(key, len(self.names))
+            start = self._day_origin(day) + self.offsets[position]
+            return start, start + self.lengths[position]
+        if level == "day":
+            return self._day_origin(key), self._day_origin(key + 1)
+        return self._day_origin(7 * key - 3), self._day_origin(7 * key + 4)
+
+    def _format(self, timestamp, pattern):
+        return time.strftime(pattern, time.gmtime(timestamp + self.utc_offset))
+
+    # e.g. "Late shift, Fri 2026-10-16 14:00-22:00", "Fri 2026-10-16" or "Week of 2026-10-12"
+    def period_label(self, level, key):
+        start, end = self.period_bounds(level, key)
+        if level == "shift":
+            name = self.names[key % len(self.names)]
+            return f"{name} shift, {self._format(start, '%a %Y-%m-%d %H:%M')}-{self._format(end, '%H:%M')}"
+        if level == "day":
+            return self._format(start, "%a %Y-%m-%d")
+        return f"Week of {self._format(start, '%Y-%m-%d')}"
+
+    # Seconds of [start, end) within breaks or planned stops, for a window inside one
+    # shift of `day`
+    def _stopped_seconds(self, start, end, day):
+        intervals = []
+        # Breaks of the day before can run past midnight into this one
+        for origin in (self._day_origin(day - 1), self._day_origin(day)):
+            for offset, length in self.breaks:
+                intervals.append((origin + offset, origin + offset + length))
+        first = max(bisect.bisect_right(self._stop_starts, start) - 1, 0)
+        for stop_start, stop_end in self.planned_stops[first:]:
+            if stop_start >= end:
+                break
+            intervals.append((stop_start, stop_end))
+        clipped = [(max(low, start), min(high, end)) for low, high in intervals if low < end and high > start]
+        return sum(high - low for low, high in _merge(clipped))
+
+    # The parts of [start, end) inside shifts as (shift key, seconds, planned production
+    # seconds), in time order. Time between shifts belongs to no period.
+    def split(self, start, end):
+        pieces = []
+        n_shifts = len(self.names)
+        for day in range(self.day_of(start), self.day_of(end) + 1):
+            origin = self._day_origin(day)
+            for position, (offset, length) in enumerate(zip(self.offsets, self.lengths)):
+                low, high = max(start, origin + offset), min(end, origin + offset + length)
+                if low < high:
+                    pieces.append((day * n_shifts + position, high - low, high - low - self._stopped_seconds(low, high, day)))
+        return pieces
+
+    def planned_seconds(self, start, end):
+        return sum(planned for _, _, planned in self.split(start, end))
@@ -0,0 +1,154 @@
+import contextlib
+import contextvars
+import re
+import threading
+import time
+
+import dash
+import flask
+import numpy as np
+
+
+# Every site's dashboard is served below this prefix, e.g. /site/north/
+SITE_PREFIX = "site"
+SITE_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+# Metrics averaged over the stations of a site, with the counts needed to combine sites
+AVERAGED_METRICS = ("oee", "availability", "performance", "quality", "downtime", "failure_rate")
+
+# Site of the request being handled, set from its URL. None on the roll-up page.
+current_site = contextvars.ContextVar("oee_site", default=None)
+
+
+class Site:
+    # Data and live state of one plant. The dashboard reads the current site's store,
+    # history, rollups, alerts, downtime log, lot tracker and material ledger, so one
+    # process serves every plant while a request only ever touches the data of its own.
+
+    def __init__(self, name, source):
+        self.name = name
+        self.title = name.replace("-", " ").replace("_", " ").title()
+        self.source = source
+        self.store = None
+        self.previous_store = None
+        self.last_refresh = time.monotonic()
+        self.refresh_lock = threading.Lock()
+        self.history = None
+        self.downtime_log = None
+        self.lot_tracker = None
+        self.rollups = None
+        self.materials = None
+        self.ingest_service = None
+        self.shared_reader = None
+        self.shared_updater = None
+        self.alert_worker = None
+        self.alert_reader = None
+        self.scalable = False
+        # Saves of the data kept across restarts, run on exit by the process updating it
+        self.saves = []
+        self._summary = None
+
+    @property
+    def path(self):
+        return f"/{SITE_PREFIX}/{self.name}/"
+
+    # Plant totals of the current store for the roll-up, computed once per data version
+    def summary(self):
+        store = self.store
+        if self._summary is None or self._summary[0] is not store:
+            self._summary = (store, summarise_store(store))
+        return self._summary[1]
+
+
+# "north=csv:north.csv,south=synthetic:500" as {name: Site}, in the order given
+def parse_sites(spec):
+    sites = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, separator, source = entry.partition("=")
+        name = name.strip().lower()
+        if not separator or not SITE_NAME.match(name) or not source.strip():
+            raise ValueError(f"Invalid site {entry!r}, expected <name>=<data source>")
+        if name in sites:
+            raise ValueError(f"Site {name!r} is listed twice")
+        sites[name] = Site(name, source.strip())
+    return sites
+
+
+# Station count, running count, units and the mean of every averaged metric over the
+# stations reporting it. Sums and counts are kept so sites combine into exact means.
+def summarise_store(store):
+    summary = {
+        "stations": len(store),
+        "running": int(np.count_nonzero(store.column("status") == "Running")),
+        "units": int(store.values("units").sum()),
+        "version": store.version,
+    }
+    for name in AVERAGED_METRICS:
+        present = ~store.missing(name)
+        total = float(store.values(name)[present].sum())
+        count = int(present.sum())
+        summary[f"{name}_total"] = total
+        summary[f"{name}_count"] = count
+        summary[name] = total / count if count else None
+    return summary
+
+
+# Totals over several site summaries, means weighted by the stations reporting each metric
+def combine_summaries(summaries):
+    combined = {name: sum(summary[name] for summary in summaries) for name in ("stations", "running", "units")}
+    for name in AVERAGED_METRICS:
+        total = sum(summary[f"{name}_total"] for summary in summaries)
+        count = sum(summary[f"{name}_count"] for summary in summaries)
+        combined[name] = total / count if count else None
+    return combined
+
+
+@contextlib.contextmanager
+def using_site(site):
+    token = current_site.set(site)
+    try:
+        yield site
+    finally:
+        current_site.reset(token)
+
+
+class SiteRouter:
+    # WSGI middleware taking the site from /site/<name>/...: the request reaches the app
+    # without the prefix and with the site in the environ. Unknown sites get a 404.
+
+    def __init__(self, wsgi_app, sites):
+        self.wsgi_app = wsgi_app
+        self.sites = sites
+
+    def __call__(self, environ, start_response):
+        parts = environ.get("PATH_INFO", "").split("/", 3)
+        if len(parts) >= 3 and parts[1] == SITE_PREFIX:
+            site = self.sites.get(parts[2])
+            if site is None:
+                start_response("404 Not Found", [("Content-Type", "text/plain")])
+                return [f"Unknown site {parts[2]!r}\n".encode()]
+            environ["oee.site"] = site
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + site.path.rstrip("/")
+            environ["PATH_INFO"] = "/" + (parts[3] if len(parts) > 3 else "")
+        return self.wsgi_app(environ, start_response)
+
+
+class SiteDash(dash.Dash):
+    # Dash app whose pages send their layout and callback requests back under the site
+    # prefix they were loaded from; scripts and assets stay shared by every site
+
+    def _config(self):
+        config = super()._config()
+        site = current_site.get()
+        if site is not None:
+            config["requests_pathname_prefix"] = self.config.requests_pathname_prefix + site.path.lstrip("/")
+        return config
+
+
+# Serve each of `sites` under its prefix on `server`, with current_site set for every
+# request (None outside the site prefixes)
+def enable_site_routing(server, sites):
+    server.wsgi_app = SiteRouter(server.wsgi_app, sites)
+
+    @server.before_request
+    def set_current_site():
+        current_site.set(flask.request.environ.get("oee.site"))
@@ -0,0 +1,312 @@
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+
+import dash_bootstrap_components as dbc
+
+
+MANIFEST_FILE = "manifest.json"
+FORMATS = ("html", "png", "pdf")
+# Overview layouts above this many stations produce very large pages; a warning is printed
+LARGE_OVERVIEW = 2000
+# Interactive controls and data holders, meaningless in a static page
+SKIPPED_COMPONENTS = {
+    "Store", "Interval", "Location", "RadioItems", "Dropdown", "Input", "Checklist", "Slider",
+    "InputGroup", "InputGroupText", "Pagination", "Button",
+}
+# Attributes of HTML components copied to the page besides class, style and id
+HTML_ATTRIBUTES = {"href": "href", "src": "src", "alt": "alt", "title": "title", "colSpan": "colspan", "rowSpan": "rowspan", "target": "target"}
+# Bootstrap classes of the dash-bootstrap-components used in the layouts
+BOOTSTRAP_CLASSES = {"Card": "card", "CardBody": "card-body", "CardHeader": "card-header", "Row": "row", "Table": "table"}
+
+
+# Static page rendering of a Dash component tree
+
+# Style dict as CSS, accepting React (fontSize) and CSS (font-size) property names
+def _css(style):
+    return "; ".join(f"{re.sub('([A-Z])', lambda match: '-' + match.group(1).lower(), key)}: {value}" for key, value in style.items())
+
+
+def _attributes(props, classes, attributes=()):
+    parts = []
+    if isinstance(props.get("id"), str):
+        parts.append(f'id="{html.escape(props["id"])}"')
+    classes = " ".join(filter(None, [*classes, props.get("className")]))
+    if classes:
+        parts.append(f'class="{html.escape(classes)}"')
+    if props.get("style"):
+        parts.append(f'style="{html.escape(_css(props["style"]))}"')
+    for name, attribute in attributes:
+        if props.get(name) is not None:
+            parts.append(f'{attribute}="{html.escape(str(props[name]))}"')
+    return (" " + " ".join(parts)) if parts else ""
+
+
+def _bootstrap_classes(kind, props):
+    classes = [BOOTSTRAP_CLASSES.get(kind, "")]
+    if kind == "Container":
+        classes = ["container-fluid" if props.get("fluid") else "container"]
+    elif kind == "Col":
+        classes = [f"col-{props['width']}" if isinstance(props.get("width"), int) else "col"]
+    elif kind == "Row":
+        classes += [f"justify-content-{props['justify']}" if props.get("justify") else "", f"align-items-{props['align']}" if props.get("align") else ""]
+    elif kind == "Badge":
+        classes = ["badge", f"bg-{props.get('color', 'primary')}"]
+    elif kind == "Table":
+        classes += [f"table-{name}" for name in ("bordered", "hover", "striped") if props.get(name)]
+        classes += [f"table-{props['size']}" if props.get("size") else ""]
+    return [name for name in classes if name]
+
+
+# Static HTML of a layout. Graphs become Plotly divs (plotly.js has to be loaded by the
+# page), controls and stores are left out. `graphs` collects the figures drawn.
+def render_component(component, graphs):
+    import plotly.io as pio
+
+    if component is None or isinstance(component, bool):
+        return ""
+    if isinstance(component, (list, tuple)):
+        return "".join(render_component(child, graphs) for child in component)
+    if isinstance(component, (str, int, float)):
+        return html.escape(str(component))
+
+    kind = type(component).__name__
+    namespace = getattr(component, "_namespace", "")
+    props = {name: getattr(component, name, None) for name in component._prop_names}
+    if kind in SKIPPED_COMPONENTS:
+        return ""
+    if kind == "Graph":
+        if props.get("figure") is None:
+            return ""
+        graphs.append(props["figure"])
+        return pio.to_html(props["figure"], include_plotlyjs=False, full_html=False, validate=False, config={"displayModeBar": False})
+    children = render_component(props.get("children"), graphs)
+
+    if namespace == "dash_html_components":
+        tag = kind.lower()
+        return f"<{tag}{_attributes(props, [], HTML_ATTRIBUTES.items())}>{children}</{tag}>"
+    if kind == "Badge":
+        return f"<span{_attributes(props, _bootstrap_classes(kind, props))}>{children}</span>"
+    if kind == "Table":
+        return f"<table{_attributes(props, _bootstrap_classes(kind, props))}>{children}</table>"
+    # Anything else (dbc layout components, unknown wrappers) as a div around its children
+    return f"<div{_attributes(props, _bootstrap_classes(kind, props))}>{children}</div>"
+
+
+def render_page(title, body, taken, refresh=None, plotlyjs="plotly.min.js"):
+    refresh_tag = f'<meta http-equiv="refresh" content="{int(refresh)}">' if refresh else ""
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+{refresh_tag}
+<title>{html.escape(title)}</title>
+<link rel="stylesheet" href="{dbc.themes.BOOTSTRAP}">
+<link rel="stylesheet" href="gauges.css">
+<script src="{plotlyjs}"></script>
+</head>
+<body>
+<p class="text-muted text-end me-3 mt-2">Snapshot taken {html.escape(taken)}</p>
+{body}
+</body>
+</html>
+"""
+
+
+# Tabs and their data fingerprints
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", str(text).lower()).strip("-") or "process"
+
+
+# (name, store row or None for the overview, title) of every exported tab of a site, as app.py shows them
+def get_tabs(site):
+    tabs = [("overview", None, "Operations Status")]
+    used = {"overview"}
+    for index, step in enumerate(site.store.column("step").tolist()):
+        name = _slug(step)
+        if name in used:
+            name = f"{name}-{index}"
+        used.add(name)
+        tabs.append((name, index, f"Details on {step}"))
+    return tabs
+
+
+# Digest of the data a tab is drawn from: the whole store (and lot flow) for the
+# overview, a process row and its downtime events for a process tab
+def get_fingerprints(app, site, tabs):
+    rows = site.store.row_fingerprints()
+    downtime_log = app.get_downtime_log(site)
+    lot_tracker = app.get_lot_tracker(site)
+    fingerprints = {}
+    for name, index, _ in tabs:
+        if index is None:
+            parts = [site.store.fingerprint()]
+            if lot_tracker is not None:
+                parts.append(f"{len(lot_tracker)}:{lot_tracker.n_moves}")
+        else:
+            parts = [rows[index]]
+            machine = downtime_log.machine_index(site.store.column("step")[index]) if downtime_log is not None else None
+            if machine is not None:
+                parts.append(f"{len(downtime_log.rows(machine))}:{downtime_log.open_start[machine]}")
+        fingerprints[name] = hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+    return fingerprints
+
+
+# Export of one tab, run in the worker processes. Workers are forked from the exporting
+# process, so they share its loaded store instead of loading their own.
+def export_tab(job):
+    import app
+    import plotly.io as pio
+
+    site_name, name, index, title, output, formats, taken, refresh = job
+    started = time.perf_counter()
+    site = app.get_sites()[site_name]
+    with app.using_site(site):
+        if index is None:
+            layout = app.create_overview_layout()
+        else:
+            layout = app.create_process_layout(site.store.record(index))
+        graphs = []
+        body = render_component(layout, graphs)
+    files = []
+    if "html" in formats:
+        path = os.path.join(output, f"{name}.html")
+        with open(path, "w") as f:
+            f.write(render_page(title, body, taken, refresh))
+        files.append(os.path.basename(path))
+    # One image per chart; kaleido is optional, only needed for PNG and PDF
+    for image_format in ("png", "pdf"):
+        if image_format in formats:
+            for number, figure in enumerate(graphs):
+                path = os.path.join(output, f"{name}-{number + 1}.{image_format}")
+                pio.write_image(figure, path, format=image_format, validate=False)
+                files.append(os.path.basename(path))
+    return name, files, time.perf_counter() - started
+
+
+def write_index(output, tabs, manifest, taken, refresh=None):
+    items = "".join(
+        f'<li class="list-group-item"><a href="{name}.html">{html.escape(title)}</a>'
+        f' <span class="text-muted">{html.escape(manifest[name]["exported"])}</span></li>'
+        for name, _, title in tabs
+        if name in manifest and f"{name}.html" in manifest[name]["files"]
+    )
+    body = f'<div class="container"><h3 class="my-4">Process Monitoring Snapshots</h3><ul class="list-group">{items}</ul></div>'
+    with open(os.path.join(output, "index.html"), "w") as f:
+        f.write(render_page("Process Monitoring Snapshots", body, taken, refresh))
+
+
+def load_manifest(output):
+    path = os.path.join(output, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Export the overview and every process tab (or those named in `only`) of a site, by
+# default the only or first one, to `output`. Tabs whose data fingerprint matches the last
+# export and whose files are still there are skipped unless `force`. Returns the names
+# of the exported and skipped tabs.
+def export_snapshots(output, formats=("html",), workers=None, only=None, force=False, refresh=None, site=None):
+    import app
+    from plotly.offline import get_plotlyjs
+
+    # Loaded up front and without the live worker's threads, which could hold a lock
+    # across the fork and leave the workers waiting on it
+    app.load_sites()
+    app.load_deferred()
+    site = app.get_sites()[site] if site else next(iter(app.get_sites().values()))
+    os.makedirs(output, exist_ok=True)
+    taken = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    tabs = [tab for tab in get_tabs(site) if only is None or tab[0] in only]
+    if any(index is None for _, index, _ in tabs) and len(site.store) > LARGE_OVERVIEW:
+        print(f"Warning: the overview draws all {len(site.store)} stations in every chart")
+    fingerprints = get_fingerprints(app, site, tabs)
+    manifest = load_manifest(output)
+
+    def is_current(name):
+        entry = manifest.get(name)
+        return (
+            entry is not None
+            and entry["fingerprint"] == fingerprints[name]
+            and set(formats) <= set(entry["formats"])
+            and all(os.path.exists(os.path.join(output, file)) for file in entry["files"])
+        )
+
+    pending = [tab for tab in tabs if force or not is_current(tab[0])]
+    skipped = [name for name, _, _ in tabs if name not in {tab[0] for tab in pending}]
+
+    # Page assets shared by every snapshot, so they work offline on a wallboard
+    if "html" in formats:
+        plotlyjs_path = os.path.join(output, "plotly.min.js")
+        if not os.path.exists(plotlyjs_path):
+            with open(plotlyjs_path, "w") as f:
+                f.write(get_plotlyjs())
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(app.__file__)), "assets", "gauges.css"), output)
+
+    jobs = [(site.name, name, index, title, output, formats, taken, refresh) for name, index, title in pending]
+    # Fork where available so the workers inherit the loaded app instead of importing it again
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for name, files, seconds in pool.map(export_tab, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))):
+            manifest[name] = {"fingerprint": fingerprints[name], "formats": list(formats), "files": files, "exported": taken, "seconds": round(seconds, 3)}
+
+    with open(os.path.join(output, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=1)
+    if "html" in formats:
+        write_index(output, get_tabs(site), manifest, taken, refresh)
+    return [tab[0] for tab in pending], skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the overview and process tabs as static snapshots.")
+    parser.add_argument("--output", default="snapshots", help="directory of the snapshots and their manifest")
+    parser.add_argument("--formats", default="html", help=f"comma separated, any of {', '.join(FORMATS)}; png and pdf need kaleido")
+    parser.add_argument("--workers", type=int, default=None, help="export processes, defaults to the number of CPUs")
+    parser.add_argument("--tabs", default=None, help="comma separated tab names (overview, process slugs) to export")
+    parser.add_argument("--force", action="store_true", help="export tabs whose data did not change as well")
+    parser.add_argument("--refresh", type=int, default=None, help="seconds after which wallboard browsers reload the pages")
+    parser.add_argument("--site", default=None, help="site to export when OEE_SITES lists several, all of them (one subdirectory each) by default")
+    args = parser.parse_args()
+
+    formats = tuple(name.strip() for name in args.formats.split(","))
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown formats {sorted(unknown)}")
+
+    import app
+
+    sites = app.get_sites()
+    if args.site and args.site not in sites:
+        parser.error(f"unknown site {args.site!r}, expected one of {sorted(sites)}")
+    if args.site or not app.MULTI_SITE:
+        targets = [(args.site, args.output)]
+    else:
+        targets = [(name, os.path.join(args.output, name)) for name in sites]
+
+    for site, output in targets:
+        started = time.perf_counter()
+        exported, skipped = export_snapshots(
+            output,
+            formats,
+            workers=args.workers,
+            only=set(args.tabs.split(",")) if args.tabs else None,
+            force=args.force,
+            refresh=args.refresh,
+            site=site,
+        )
+        print(f"Exported {len(exported)} tabs, skipped {len(skipped)} unchanged, in {time.perf_counter() - started:.1f}s to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from downtime_log import FIELDS, MAX_REASONS, DowntimeLog, generate_synthetic, load_csv
+
+
+# Saving a loaded log over the directory it memory-maps its columns from
+def test_save_over_loaded_directory(tmp_path):
+    directory = str(tmp_path / "downtime")
+    log = generate_synthetic([f"Step {number}" for number in range(40)], days=3)
+    log.save(directory)
+    loaded = DowntimeLog.load(directory)
+    loaded.save(directory)
+
+    reloaded = DowntimeLog.load(directory)
+    assert reloaded.size == log.size
+    for name in FIELDS:
+        np.testing.assert_array_equal(reloaded.column(name), log.column(name))
+    np.testing.assert_array_equal(loaded.column("start"), log.column("start"))
+    assert not [path.name for path in tmp_path.iterdir() if path.name != "downtime"]
+
+
+# Reason codes beyond 255 read from a CSV keep their own aggregates
+def test_many_reasons_from_csv(tmp_path):
+    path = tmp_path / "downtime.csv"
+    lines = ["start,end,machine,reason"]
+    for number in range(300):
+        lines.append(f"{1_700_000_000 + number},{1_700_000_000 + number + number % 7 + 1},{'Press' if number % 2 else 'Lathe'},Reason {number}")
+    path.write_text("\n".join(lines) + "\n")
+    log = load_csv(str(path), ["Lathe", "Press"])
+    shift = log.shift_of(1_700_000_000)
+
+    for machine in (None, 0, 1):
+        durations, counts = log.totals_by_reason(machine, shift, shift, now=1_700_010_000)
+        for number in range(300):
+            reason = log.reasons.index(f"Reason {number}")
+            expected = machine is None or machine == number % 2
+            assert counts[reason] == expected
+            assert durations[reason] == (number % 7 + 1 if expected else 0)
+
+
+def test_too_many_reasons():
+    with pytest.raises(ValueError):
+        DowntimeLog(["Lathe"], [f"Reason {number}" for number in range(MAX_REASONS + 1)])
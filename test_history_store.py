@@ -0,0 +1,28 @@
+import numpy as np
+
+from history_store import HistoryStore
+from process_store import load_store
+
+
+# Saving a loaded history over the directory it memory-maps its arrays from
+def test_save_over_loaded_directory(tmp_path):
+    directory = str(tmp_path / "history")
+    store = load_store("sample")
+    step = store.column("step")[0]
+    history = HistoryStore()
+    for minute in range(2000):
+        history.append_snapshot(1_000_000_000 + minute * 60, store)
+    history.append(step, "oee", np.arange(1_000_000_000, 1_000_120_000, 60), np.linspace(0, 100, 2000))
+    history.save(directory)
+    loaded = HistoryStore.load(directory)
+    loaded.save(directory)
+
+    reloaded = HistoryStore.load(directory)
+    for metric in ("oee", "units"):
+        for points in (2000, 100):
+            expected = history.query(step, metric, 1_000_000_000, 1_000_120_000, max_points=points)
+            for source in (loaded, reloaded):
+                actual = source.query(step, metric, 1_000_000_000, 1_000_120_000, max_points=points)
+                np.testing.assert_array_equal(actual[0], expected[0])
+                np.testing.assert_array_equal(actual[1], expected[1])
+    assert not [path.name for path in tmp_path.iterdir() if path.name != "history"]
@@ -0,0 +1,23 @@
+import numpy as np
+
+from ingest import STATE, UNITS, IngestService, make_batch
+from oee_engine import compute_oee
+from process_store import load_store
+
+
+# Time credited up to the batch's clock changes the KPIs of stations without events too
+def test_kpis_follow_the_clock_for_every_station():
+    store = load_store("sample")
+    service = IngestService(store, transport=None, start_time=0)
+    service.apply(make_batch([10, 20], [0, 1], [UNITS, STATE], [5, 0]))
+    service.apply(make_batch([600], [0], [UNITS], [50]))
+
+    expected = compute_oee(
+        service.run_seconds + service.down_seconds,
+        service.run_seconds,
+        service.ideal_cycle_time,
+        service.units,
+        service.units - service.scrap,
+    )
+    for name, values in service.kpis.items():
+        np.testing.assert_allclose(values, np.round(expected[name], 2))
@@ -0,0 +1,36 @@
+import numpy as np
+
+from material_analytics import SUMS, _Buckets
+
+
+def _add(buckets, hour, station, used):
+    sums = np.zeros((1, len(SUMS)))
+    sums[0, 0] = used
+    buckets.add(np.array([hour * 3600.0]), np.array([station]), sums)
+
+
+def _totals(buckets, first, last):
+    totals = {}
+    for keys, sums in buckets.query(first, last):
+        for key, row in zip(keys.tolist(), sums):
+            totals[key] = totals.get(key, 0) + row[0]
+    return totals
+
+
+# A record older than the current period before any period closed
+def test_late_record_without_closed_periods():
+    buckets = _Buckets(3600, 3)
+    _add(buckets, 5, 1, 2.0)
+    _add(buckets, 4, 1, 3.0)
+    assert _totals(buckets, 0, 10) == {4 * 3 + 1: 3.0, 5 * 3 + 1: 2.0}
+
+
+# Late records adding to a closed period and inserting a new key between closed ones
+def test_late_records_with_closed_periods():
+    buckets = _Buckets(3600, 3)
+    _add(buckets, 2, 0, 1.0)
+    _add(buckets, 4, 2, 1.0)
+    _add(buckets, 6, 1, 1.0)
+    _add(buckets, 2, 0, 4.0)
+    _add(buckets, 3, 2, 5.0)
+    assert _totals(buckets, 0, 10) == {2 * 3: 5.0, 3 * 3 + 2: 5.0, 4 * 3 + 2: 1.0, 6 * 3 + 1: 1.0}
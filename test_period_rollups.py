@@ -0,0 +1,22 @@
+import numpy as np
+
+from period_rollups import RollupEngine, generate_synthetic
+from process_store import load_store
+from shift_calendar import DEFAULT_SHIFTS, LEVELS, ShiftCalendar
+
+
+# Saving loaded rollups over the directory they were loaded from
+def test_save_over_loaded_directory(tmp_path):
+    directory = str(tmp_path / "rollups")
+    calendar = ShiftCalendar.from_spec(DEFAULT_SHIFTS, utc_offset=0)
+    store = load_store("sample")
+    rollups = generate_synthetic(store, calendar, days=2, now=1_000_000_000)
+    rollups.save(directory)
+    RollupEngine.load(directory, calendar).save(directory)
+
+    reloaded = RollupEngine.load(directory, calendar)
+    for level in LEVELS:
+        key = rollups.period_key(level, now=1_000_000_000)
+        for name, values in rollups.period_columns(level, key, store).items():
+            np.testing.assert_array_equal(reloaded.period_columns(level, key, store)[name], values)
+    assert not [path.name for path in tmp_path.iterdir() if path.name != "rollups"]